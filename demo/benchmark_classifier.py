@@ -0,0 +1,50 @@
+import sys
+import os
+import json
+import argparse
+
+# Add the directory 'code' to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.classifier.benchmark import benchmark_heads, benchmark_precisions, benchmark_ensemble
+from nyst.classifier.tunedCNN_time import HEADS
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare the NystClassifier heads (parameters, memory, latency, cross-validated accuracy).')
+    parser.add_argument('--heads', nargs='+', default=HEADS, choices=HEADS, help='Heads to compare')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 32, 256], help='Batch sizes of the latency measurement')
+    parser.add_argument('--dataset', default=None, help='Merged CSV or .npz dataset; if given the cross-validated accuracy is computed')
+    parser.add_argument('--k-folds', type=int, default=5, help='Number of folds of the cross-validation')
+    parser.add_argument('--epochs', type=int, default=20, help='Training epochs of each fold')
+    parser.add_argument('--precisions', action='store_true', help='Compare float32/bfloat16 autocast and eager/torch.compile for each head instead of the heads')
+    parser.add_argument('--ensemble', type=int, default=0, help='Compare a single model with a fold ensemble of this many members (sequential and vectorized) for each head')
+    parser.add_argument('--output', default=None, help='Optional JSON file where to save the results')
+    args = parser.parse_args()
+
+    # Load the normalized signals and labels
+    signals, labels = None, None
+    if args.dataset is not None:
+        from nyst.dataset.dataset import CustomDataset
+        dataset = CustomDataset(args.dataset)
+        signals, labels = dataset.fil_norm_data, dataset.fil_data['labels'].astype(float)
+
+    if args.ensemble:
+        results = [result for head in args.heads for result in benchmark_ensemble(head, args.ensemble, args.batch_sizes)]
+    elif args.precisions:
+        results = [result for head in args.heads for result in benchmark_precisions(head, batch_sizes=args.batch_sizes, signals=signals, labels=labels, k_folds=args.k_folds, num_epochs=args.epochs)]
+    else:
+        results = benchmark_heads(args.heads, args.batch_sizes, signals, labels, args.k_folds, args.epochs)
+
+    # Print the comparison table
+    columns = list(results[0].keys())
+    print('\n' + ' | '.join(f'{column:>16}' for column in columns))
+    for result in results:
+        print(' | '.join(f'{value:>16.4g}' if isinstance(value, float) else f'{value:>16}' for value in result.values()))
+
+    # Save the results
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+        print(f'\nResults saved to {args.output}')
@@ -0,0 +1,58 @@
+import sys
+import os
+import json
+import time
+import argparse
+
+# Add the directory 'code' to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.pipeline.first_pipeline import FirstPipeline
+from nyst.roi.motion_gate import SegmentationGate, trace_difference
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Skip rate of the motion-gated segmentation and its effect on the pupil traces: each video is processed without and with the gate.')
+    parser.add_argument('videos', nargs='+', help='Videos to process')
+    parser.add_argument('--threshold', type=float, default=3.0, help='Maximum mean absolute difference (gray levels) of the downsampled crops of a reused frame')
+    parser.add_argument('--refresh-every', type=int, default=10, help='Maximum number of consecutive frames served by one segmentation')
+    parser.add_argument('--output', default=None, help='Optional JSON file where to save the report')
+    args = parser.parse_args()
+
+    pipeline = FirstPipeline()
+    gate = SegmentationGate(args.threshold, args.refresh_every)
+
+    report = []
+    for video in args.videos:
+        # Reference traces: every crop segmented
+        pipeline.motion_gate = None
+        start = time.perf_counter()
+        reference = pipeline.run(video, None, 0, annotate=False)
+        reference_time = time.perf_counter() - start
+
+        # Gated traces
+        pipeline.motion_gate = gate
+        start = time.perf_counter()
+        gated = pipeline.run(video, None, 0, annotate=False)
+        gated_time = time.perf_counter() - start
+
+        report.append({
+            'video': video,
+            'gate': gate.stats(),
+            'time_s': {'reference': reference_time, 'gated': gated_time},
+            'trace_difference': {eye: trace_difference(reference['position'][eye], gated['position'][eye]) for eye in ['left', 'right']}
+        })
+
+        result = report[-1]
+        print(f"\n{video}: skip rate {result['gate']['all']['skip_rate']:.1%} ({result['gate']['all']['reused']}/{result['gate']['all']['crops']} crops), "
+              f"time {reference_time:.1f} s -> {gated_time:.1f} s")
+        for eye, difference in result['trace_difference'].items():
+            if difference['frames']:
+                print(f"\t{eye} pupil: mean {difference['mean_px']:.2f} px, p95 {difference['p95_px']:.2f} px, max {difference['max_px']:.2f} px over {difference['frames']} frames")
+
+    # Save the report
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f'\nReport saved to {args.output}')
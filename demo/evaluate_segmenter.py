@@ -0,0 +1,44 @@
+import sys
+import os
+import json
+import argparse
+
+# Add the directory 'code' to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.roi.roi_segmenter import SegmenterThreshold, INPUT_SIZE_BUCKETS
+from nyst.roi.segmenter_eval import load_eye_crops, evaluate_input_sizes
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='IoU, pupil centre error and latency of the eye segmenter for each input size bucket and for the adaptive selection.')
+    parser.add_argument('--model', required=True, help='Segmenter model (eyes_seg_threshold.h5)')
+    parser.add_argument('--images', required=True, help='Folder of the eye images')
+    parser.add_argument('--masks', required=True, help='Folder of the label masks (same sorted order of the images)')
+    parser.add_argument('--buckets', nargs='+', type=int, default=list(INPUT_SIZE_BUCKETS), help='Input sizes to compare')
+    parser.add_argument('--crop-sizes', nargs='+', type=int, default=[None], help='Longest side the crops are downscaled to, to reproduce the detector boxes (default: original size)')
+    parser.add_argument('--upscale', type=float, default=1.0, help='Minimum ratio between the input size and the longest side of the crop of the adaptive selection')
+    parser.add_argument('--limit', type=int, default=None, help='Maximum number of crops')
+    parser.add_argument('--output', default=None, help='Optional JSON file where to save the results')
+    args = parser.parse_args()
+
+    segmenter = SegmenterThreshold(args.model)
+
+    results = []
+    for crop_size in args.crop_sizes:
+        pairs = load_eye_crops(args.images, args.masks, crop_size, args.limit)
+        for result in evaluate_input_sizes(segmenter, pairs, args.buckets, upscale=args.upscale):
+            results.append({'crop_size': crop_size or 'original', **result})
+
+    # Print the comparison table
+    columns = list(results[0].keys())
+    print('\n' + ' | '.join(f'{column:>16}' for column in columns))
+    for result in results:
+        print(' | '.join(f'{value:>16.4g}' if isinstance(value, float) else f'{value:>16}' for value in result.values()))
+
+    # Save the results
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+        print(f'\nResults saved to {args.output}')
@@ -0,0 +1,59 @@
+import sys
+import os
+import argparse
+import numpy as np
+
+# Add the directory 'code' to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.classifier.export import export_classifier, held_out_clips, LATENCY_BATCH_SIZES
+from nyst.dataset.utils_function import load_holdout_patients, holdout_patients_path
+from nyst.classifier.tunedCNN_time import HEADS
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Export the trained NystClassifier for serving (TorchScript, INT8 dynamic quantization, ONNX) with a parity report and a latency table.')
+    parser.add_argument('--model', required=True, help='Model weights (best_model.pth)')
+    parser.add_argument('--head', default='flatten', choices=HEADS, help='Head the model has been trained with')
+    parser.add_argument('--output-dir', default=None, help='Folder of the artifacts (default: the folder of the model)')
+    parser.add_argument('--dataset', default=None, help='Merged CSV or .npz dataset; if given the parity report is computed on the patients held out from the training (holdout_patients.json next to the model), or on every clip (in-sample accuracy) if there are none')
+    parser.add_argument('--patients', nargs='+', default=None, help='Patients of the parity report (instead of the held-out patients of the model); their accuracy is in-sample unless the model has been trained without them')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=list(LATENCY_BATCH_SIZES), help='Batch sizes of the latency table')
+    parser.add_argument('--threshold', type=float, default=0.5, help='Probability threshold of a positive prediction')
+    parser.add_argument('--no-onnx', action='store_true', help='Do not export the ONNX model')
+    args = parser.parse_args()
+
+    # Clips of the parity report: the patients held out from the training, if any
+    signals, labels, held_out = None, None, False
+    if args.dataset is not None:
+        from nyst.dataset.dataset import CustomDataset
+        dataset = CustomDataset(args.dataset)
+        holdout_patients = load_holdout_patients(holdout_patients_path(args.model))
+        patients = args.patients or holdout_patients
+        if patients:
+            signals, labels, patients = held_out_clips(dataset, patients)
+            held_out = set(str(patient) for patient in patients) <= set(holdout_patients)
+            print(f"Parity report on {len(signals)} clips of the patients {patients} ({'held-out' if held_out else 'in-sample'} accuracy)")
+        else:
+            signals, labels = np.asarray(dataset.fil_norm_data), np.asarray(dataset.fil_data['labels'], dtype=float)
+            print(f"Parity report on all the {len(signals)} clips (in-sample accuracy: no patient has been held out from the training)")
+
+    report = export_classifier(args.model, args.output_dir, args.head, signals, labels, args.batch_sizes, args.threshold, not args.no_onnx, held_out)
+
+    # Artifacts
+    print(f"\nArtifacts (state_dict: {report['state_dict_size_mb']:.1f} MB):")
+    for name, artifact in report['artifacts'].items():
+        print(f"\t{name:>18}: {artifact['size_mb']:8.1f} MB  {artifact['path']}")
+
+    # Latency table
+    print('\nMedian latency (ms):')
+    print(f"{'batch size':>18} | " + ' | '.join(f'{name:>16}' for name in report['latency_ms']))
+    for batch_size in args.batch_sizes:
+        print(f"{batch_size:>18} | " + ' | '.join(f"{latency[batch_size]:>16.2f}" for latency in report['latency_ms'].values()))
+
+    # Parity report
+    if 'parity' in report:
+        print(f"\nParity with the original model ({report['parity_clips']} accuracy):")
+        for name, parity in report['parity'].items():
+            print(f"\t{name:>18}: " + ', '.join(f'{key} {value:.4g}' for key, value in parity.items()))
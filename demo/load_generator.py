@@ -0,0 +1,73 @@
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.request
+import numpy as np
+
+
+# Send a request to the scoring service and return its latency in ms
+def send_request(url:str, body:bytes) -> float:
+    start = time.perf_counter()
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        json.loads(response.read())
+    return (time.perf_counter() - start) * 1000
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Local load generator of the scoring service: concurrent clients sending random (8, 300) traces.')
+    parser.add_argument('--url', default='http://127.0.0.1:8080', help='Base URL of the scoring service')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of concurrent clients')
+    parser.add_argument('--requests', type=int, default=1000, help='Total number of requests')
+    parser.add_argument('--traces', type=int, default=1, help='Traces of each request')
+    parser.add_argument('--frames', type=int, default=300, help='Frames of each trace')
+    args = parser.parse_args()
+
+    # Pre-encoded random requests (the encoding time is not part of the measure)
+    rng = np.random.default_rng(0)
+    bodies = [json.dumps({'traces': rng.normal(size=(args.traces, 8, args.frames)).round(4).tolist()}).encode() for _ in range(min(args.requests, 32))]
+
+    latencies, errors = [], []
+    counter = iter(range(args.requests))
+    lock = threading.Lock()
+
+    # Each client sends requests until all of them have been sent
+    def client():
+        while True:
+            with lock:
+                idx = next(counter, None)
+            if idx is None:
+                return
+            try:
+                latency = send_request(args.url + '/predict', bodies[idx % len(bodies)])
+                with lock:
+                    latencies.append(latency)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    # Client-side report
+    latencies = np.array(latencies)
+    print(f'\nRequests: {len(latencies)} ok, {len(errors)} failed in {elapsed:.2f} s (concurrency {args.concurrency}, {args.traces} traces per request)')
+    if len(latencies):
+        print(f'Throughput: {len(latencies) / elapsed:.1f} requests/s, {len(latencies) * args.traces / elapsed:.1f} traces/s')
+        print(f'Latency: p50 {np.percentile(latencies, 50):.2f} ms, p95 {np.percentile(latencies, 95):.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms')
+    if errors:
+        print(f'First error: {errors[0]}')
+
+    # Server-side metrics
+    with urllib.request.urlopen(args.url + '/metrics') as response:
+        print('\nService metrics:\n' + json.dumps(json.loads(response.read()), indent=4))
+
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,39 @@
+import sys
+import os
+import json
+import argparse
+
+# Add the directory 'code' to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.pipeline.server import DEFAULT_SOCKET, FirstPipelineServer, FirstPipelineClient
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Pipeline daemon keeping the FirstPipeline models loaded: start it once, then the feature extraction of run_code.py and run_inference.py uses it automatically.')
+    parser.add_argument('action', choices=['start', 'stats', 'stop', 'run'], help="'start' the daemon, print its 'stats', 'stop' it or 'run' the extraction of videos through it")
+    parser.add_argument('videos', nargs='*', help="Videos to be processed with the 'run' action")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket of the daemon')
+    parser.add_argument('--output', default='.', help="Output folder of the annotated videos with the 'run' action")
+    parser.add_argument('--no-warmup', action='store_true', help='Do not run the models on a dummy input at start-up')
+    args = parser.parse_args()
+
+    if args.action == 'start':
+        FirstPipelineServer(args.socket, warmup=not args.no_warmup).serve_forever()
+    else:
+        client = FirstPipelineClient(args.socket)
+        if not client.is_available():
+            print(f'No pipeline daemon listening on {args.socket}')
+            exit(1)
+
+        if args.action == 'stats':
+            print(json.dumps(client.stats(), indent=4))
+        elif args.action == 'stop':
+            client.shutdown()
+        else:
+            # The results are printed as soon as every video is completed (matched to the videos by job_id, the index of the job)
+            jobs = [('run', {'video_path': os.path.abspath(video), 'output_path': os.path.abspath(args.output), 'idx': idx, 'annotate': True}) for idx, video in enumerate(args.videos)]
+            for job_id, result, error in client.submit(jobs):
+                status = f"error: {error}" if error is not None else f"{len(result['position']['left'])} frames extracted"
+                print(f'{args.videos[job_id]}: {status}')
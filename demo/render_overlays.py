@@ -0,0 +1,39 @@
+import sys
+import os
+import argparse
+from glob import glob
+
+# Add the directory 'code' to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.visualization.segmentation import render_overlay_video
+
+# Video extensions searched in the input folders
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Offline QA overlays: renders each video with its cached segmentation masks (<video name>.npy or a <video name> folder of PNG masks).')
+    parser.add_argument('inputs', nargs='+', help='Folders and/or videos')
+    parser.add_argument('--masks', required=True, help='Folder of the cached masks')
+    parser.add_argument('--output', required=True, help='Folder of the overlay videos')
+    parser.add_argument('--alpha', type=float, default=0.5, help='Opacity of the class colors')
+    args = parser.parse_args()
+
+    # Videos of the inputs
+    videos = []
+    for path in args.inputs:
+        videos += sorted(file for file in glob(os.path.join(path, '*')) if file.lower().endswith(VIDEO_EXTENSIONS)) if os.path.isdir(path) else [path]
+
+    for video in videos:
+        name = os.path.splitext(os.path.basename(video))[0]
+        masks = os.path.join(args.masks, name + '.npy')
+        if not os.path.exists(masks):
+            masks = os.path.join(args.masks, name)
+        if not os.path.exists(masks):
+            print(f"No cached masks for {video}, skipped")
+            continue
+
+        n_frames = render_overlay_video(video, masks, os.path.join(args.output, name + '_overlay.mp4'), alpha=args.alpha)
+        print(f"{video}: {n_frames} frames rendered")
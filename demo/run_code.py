@@ -4,7 +4,7 @@ import os
 # Add the directory 'code' to the PYTHONPATH
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from demo.yaml_function import load_hyperparams, pathConfiguratorYaml
+from demo.yaml_function import load_hyperparams, pathConfiguratorYaml, yamlParser
 
 
 # Function to perform the pipeline and the entier code
@@ -56,14 +56,14 @@ def main(option):
     # Execute the FEATURE EXTRACTION PHASE
     elif option == '2':
 
-        from nyst.pipeline.first_pipeline import FirstPipeline
+        from nyst.pipeline import connect_pipeline
 
         try:
             ### YAML ###
             _, _, _, _, _, input_folder_extr, output_folder_extr, _, _, _,_, _, _, _, _ = load_hyperparams(pathConfiguratorYaml) 
             
-            # Initialize the pipeline
-            pipeline = FirstPipeline()
+            # Initialize the pipeline (served by the pipeline daemon if it is running)
+            pipeline = connect_pipeline()
 
             # Perform the feature extraction over all the videos in the input folder
             pipeline.videos_feature_extractor(input_folder_extr, output_folder_extr)
@@ -76,8 +76,9 @@ def main(option):
     elif option == '3':
         
         import pandas as pd
-        from nyst.dataset.preprocess_function import preprocess_interpolation, cubic_interpolation  
-        from nyst.dataset.signal_augmentation import augment_data
+        from nyst.dataset.preprocess_function import preprocess_interpolation, cubic_interpolation, resample_to_binary
+        from nyst.dataset.signal_augmentation import augment_data, augment_binary_data
+        from nyst.dataset.binary_dataset import is_binary_dataset
         from nyst.dataset.utils_function import save_csv
 
         ### YAML ###
@@ -96,9 +97,25 @@ def main(option):
         # Perform the join on the 'video' column
         data = pd.merge(input_data, label_data, on='video', how='left')
 
+        # Binary output: resample all the signals with the batched engine and write them straight into the binary dataset
+        if is_binary_dataset(new_csv_file):
+            resample_method = yamlParser(pathConfiguratorYaml).get('resample_method', 'cubic')
+
+            # PREPROCESSING STEP
+            discarded = resample_to_binary(data, new_csv_file, method=resample_method)
+            print(f'\n\t ---> Preprocessing {resample_method} resampling step COMPLETED ({len(discarded)} clips discarded)\n')
+            print(f"Merged data saved to {new_csv_file}")
+
+            # AUGMENTATION STEP
+            for aug in augmentation:
+                if aug == 'augment_data':
+                    augment_binary_data(new_csv_file)
+                else:
+                    raise ValueError('Invalid augmentation choise')
+                print(f'   \n\t ---> Augmentation {aug} step COMPLETED\n')
 
         # Applies the preprocessing function if provided
-        if len(preprocess)!=0 and (augmentation)!=0:
+        elif len(preprocess)!=0 and (augmentation)!=0:
                       
             # PREPROCESSING STEP
             for prep in preprocess:
@@ -170,9 +187,36 @@ def main(option):
     
     # Execute the INFERENCE PHASE
     elif option == '5':
-        # Code block for option 3
-        # Insert code for option 3 here
-        pass
+
+        from nyst.classifier.inference import run_inference
+
+        try:
+            ### YAML ###
+            _, _, _, clip_duration, overlapping, _, _, _, _, _, _, _, save_path, _, _ = load_hyperparams(pathConfiguratorYaml)
+            yaml_configurator = yamlParser(pathConfiguratorYaml)
+
+            # Fold ensemble saved by the training next to the best model
+            if yaml_configurator.get('inference_ensemble', False):
+                save_path = os.path.join(os.path.dirname(save_path), 'ensemble.pth')
+
+            # Extract, normalize and score all the videos, then save the per-video verdicts
+            run_inference(
+                yaml_configurator['inference_input'],
+                save_path,
+                yaml_configurator['inference_output'],
+                head=yaml_configurator.get('inference_head', 'flatten'),
+                workers=yaml_configurator.get('inference_workers', 1),
+                batch_size=yaml_configurator.get('inference_batch_size', 256),
+                clip_duration=clip_duration,
+                overlapping=overlapping,
+                threshold=yaml_configurator.get('inference_threshold', 0.5),
+                precision=yaml_configurator.get('inference_precision', 'fp32'),
+                compile=yaml_configurator.get('inference_compile', False)
+            )
+
+        except Exception as e:
+            print(f"An error occurred during the Inference phase: {e}")
+            exit(1)
     
     else:
         print("Invalid option choosed.")
@@ -181,8 +225,8 @@ def main(option):
 
 if __name__ == "__main__":
 
-    # Select the desired option
-    option = input('\nPlease select an option:\n\t1. Video labelling\n\t2. Feature Exctraction\n\t3. Preprocessing\n\t4. Training Phase\n\t5. Inference Phase\n\nYour choice: ')
+    # Select the desired option (given as command line argument to run headless)
+    option = sys.argv[1] if len(sys.argv) > 1 else input('\nPlease select an option:\n\t1. Video labelling\n\t2. Feature Exctraction\n\t3. Preprocessing\n\t4. Training Phase\n\t5. Inference Phase\n\nYour choice: ')
     
     # Execute the main function with the selected option
     main(option)
\ No newline at end of file
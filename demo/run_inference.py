@@ -0,0 +1,32 @@
+import sys
+import os
+import argparse
+
+# Add the directory 'code' to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.classifier.inference import run_inference
+from nyst.classifier.tunedCNN_time import HEADS
+from nyst.classifier.precision import PRECISIONS
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Headless batched inference: scores videos with the trained NystClassifier and writes the per-video verdicts to a JSON file.')
+    parser.add_argument('inputs', nargs='+', help='Folders and/or videos to be scored')
+    parser.add_argument('--model', required=True, help='Model weights (best_model.pth)')
+    parser.add_argument('--output', required=True, help='JSON results file')
+    parser.add_argument('--stats', default=None, help="Normalization statistics (default: 'normalization_stats.json' next to the model)")
+    parser.add_argument('--head', default='flatten', choices=HEADS, help='Head the model has been trained with')
+    parser.add_argument('--workers', type=int, default=1, help='Number of feature extraction processes')
+    parser.add_argument('--batch-size', type=int, default=256, help='Clips of each forward pass')
+    parser.add_argument('--clip-duration', type=float, default=10, help='Clip duration in seconds')
+    parser.add_argument('--overlapping', type=float, default=8, help='Overlap between consecutive clips in seconds')
+    parser.add_argument('--threshold', type=float, default=0.5, help='Probability threshold of a positive verdict')
+    parser.add_argument('--precision', default='fp32', choices=PRECISIONS, help="Forward pass precision ('bf16': autocast to bfloat16)")
+    parser.add_argument('--compile', action='store_true', help='Compile the model with torch.compile')
+    args = parser.parse_args()
+
+    run_inference(args.inputs, args.model, args.output, head=args.head, workers=args.workers, batch_size=args.batch_size,
+                  clip_duration=args.clip_duration, overlapping=args.overlapping, threshold=args.threshold, stats_file=args.stats,
+                  precision=args.precision, compile=args.compile)
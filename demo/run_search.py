@@ -0,0 +1,53 @@
+import sys
+import os
+import json
+import argparse
+import yaml
+import torch
+
+# Add the directory 'code' to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.training.search import ASHASearch, SearchStore
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Local hyperparameter search with asynchronous successive halving (no W&B service needed).')
+    parser.add_argument('--dataset', required=True, help='Merged CSV or .npz dataset')
+    parser.add_argument('--space', default=os.path.join(os.path.dirname(__file__), 'wb_config.yaml'), help="YAML file with the search space in its 'parameters' section (the W&B sweep configuration)")
+    parser.add_argument('--store', default='search.db', help='SQLite results store (an existing store resumes the search)')
+    parser.add_argument('--min-epochs', type=int, default=5, help='Epochs of the first rung')
+    parser.add_argument('--max-epochs', type=int, default=50, help='Epochs of the last rung')
+    parser.add_argument('--eta', type=int, default=3, help='Reduction factor: the best 1/eta of each rung is promoted')
+    parser.add_argument('--num-configs', type=int, default=None, help='Random subset of the grid to try (default: the whole grid)')
+    parser.add_argument('--workers', type=int, default=1, help='Trials trained at the same time in worker processes')
+    parser.add_argument('--k-folds', type=int, default=5, help='1/k_folds of the data is used for validation (only the first fold: cross-validate the best configurations afterwards)')
+    parser.add_argument('--variable-length', action='store_true', help='Keep the clips with their native number of frames')
+    args = parser.parse_args()
+
+    # Search space: the lists of values of the sweep parameters
+    with open(args.space) as file:
+        parameters = yaml.safe_load(file)['parameters']
+    param_grid = {key: value['values'] if 'values' in value else [value['value']] for key, value in parameters.items()}
+
+    # Dataset
+    from nyst.dataset.dataset import CustomDataset
+    from nyst.dataset.variable_length import VariableLengthDataset
+    from torch.utils.data import TensorDataset
+    dataset = CustomDataset(args.dataset, variable_length=args.variable_length)
+    signals, labels = dataset.fil_norm_data, dataset.fil_data['labels'].astype(float)
+    if isinstance(signals, list):
+        train_dataset = VariableLengthDataset(signals, labels)
+    else:
+        train_dataset = TensorDataset(torch.tensor(signals, dtype=torch.float32), torch.tensor(labels, dtype=torch.float32).reshape(-1, 1))
+
+    device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+    search = ASHASearch(param_grid, SearchStore(args.store), args.min_epochs, args.max_epochs, args.eta, args.num_configs)
+    leaderboard = search.run(train_dataset, device, args.workers, k_folds=args.k_folds)
+
+    # Best configurations
+    print('\nLeaderboard (highest rung first):')
+    for result in leaderboard[:10]:
+        print(f"\tTrial {result['trial_id']}: {result['epochs']} epochs, V Acc {result['val_acc']:.4f}, V Loss {result['val_loss']:.4f} - {json.dumps(result['params'])}")
+    print(f"\nResults stored in {args.store}, checkpoint of the best trial: {search.store.checkpoint_path(leaderboard[0]['trial_id'], leaderboard[0]['rung'])}")
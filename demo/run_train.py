@@ -6,7 +6,7 @@ from yaml_function import *
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from nyst.training.train import training_net
-from demo.yaml_function import load_hyperparams, pathConfiguratorYaml
+from demo.yaml_function import load_hyperparams, pathConfiguratorYaml, yamlParser
 
 
 if __name__ == '__main__':
@@ -15,7 +15,26 @@ if __name__ == '__main__':
         _, _, _, _, _, _, _, csv_input_file, csv_label_file, save_path, save_path_info, batch_size, lr, optimizer, criterion, threshold_correct, patience, num_epochs, k_folds = load_hyperparams(pathConfiguratorYaml) 
         
         # Perform the training and validation of the full net using k-cross validation and grid search
-        results = training_net(csv_input_file, csv_label_file, save_path, batch_size, lr, optimizer, criterion, threshold_correct, patience, num_epochs, k_folds)
+        parallel_folds = yamlParser(pathConfiguratorYaml).get('parallel_folds', 1) # Folds trained concurrently (CPU training)
+        cache_dir = yamlParser(pathConfiguratorYaml).get('result_cache_dir') # Folds already trained are read from the result cache
+        fold_seed = yamlParser(pathConfiguratorYaml).get('fold_seed')
+
+        # Checkpoints: an interrupted training continues from the last checkpoint of each fold with resume
+        checkpoint_dir = yamlParser(pathConfiguratorYaml).get('checkpoint_dir')
+        checkpoint_every = yamlParser(pathConfiguratorYaml).get('checkpoint_every', 1)
+        resume = yamlParser(pathConfiguratorYaml).get('resume', False) or '--resume' in sys.argv
+
+        # Opt-in bf16 autocast and torch.compile
+        precision = yamlParser(pathConfiguratorYaml).get('precision', 'fp32')
+        compile = yamlParser(pathConfiguratorYaml).get('compile', False)
+
+        # Fold ensemble of the best parameters
+        save_ensemble = yamlParser(pathConfiguratorYaml).get('save_ensemble', False)
+
+        # Patients excluded from the training (saved next to the model, used by export_classifier.py)
+        holdout_patients = yamlParser(pathConfiguratorYaml).get('holdout_patients')
+        results = training_net(csv_input_file, csv_label_file, save_path, batch_size, lr, optimizer, criterion, threshold_correct, patience, num_epochs, k_folds, parallel_folds=parallel_folds,
+                               cache_dir=cache_dir, fold_seed=fold_seed, checkpoint_dir=checkpoint_dir, resume=resume, checkpoint_every=checkpoint_every, precision=precision, compile=compile, save_ensemble=save_ensemble, holdout_patients=holdout_patients)
 
     except Exception as e:
         print(f"An error occurred during the Training and Validation phase: {e}")
@@ -0,0 +1,29 @@
+import sys
+import os
+import argparse
+
+# Add the directory 'code' to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.classifier.service import ScoringService
+from nyst.classifier.tunedCNN_time import HEADS
+from nyst.classifier.precision import PRECISIONS
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Local HTTP service scoring eye-position traces with the trained NystClassifier (POST /predict, GET /metrics, GET /health).')
+    parser.add_argument('--model', required=True, help='Model weights (best_model.pth)')
+    parser.add_argument('--stats', default=None, help="Normalization statistics (default: 'normalization_stats.json' next to the model)")
+    parser.add_argument('--head', default='flatten', choices=HEADS, help='Head the model has been trained with')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--max-batch-size', type=int, default=64, help='Maximum number of clips of a micro-batch')
+    parser.add_argument('--max-wait-ms', type=float, default=5, help='Maximum time a request waits to be batched with others')
+    parser.add_argument('--threshold', type=float, default=0.5, help='Probability threshold of a positive verdict')
+    parser.add_argument('--precision', default='fp32', choices=PRECISIONS, help="Forward pass precision ('bf16': autocast to bfloat16)")
+    parser.add_argument('--compile', action='store_true', help='Compile the model with torch.compile')
+    args = parser.parse_args()
+
+    service = ScoringService(args.model, args.head, args.stats, args.max_batch_size, args.max_wait_ms, args.threshold, precision=args.precision, compile=args.compile)
+    service.serve_forever(args.host, args.port)
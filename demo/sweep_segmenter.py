@@ -0,0 +1,31 @@
+import sys
+import os
+import argparse
+
+# Add the directory 'code' to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.roi.roi_segmenter import INPUT_SIZE_BUCKETS
+from nyst.roi.segmenter_sweep import run_sweep, BACKEND_PRECISIONS
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Accuracy vs latency sweep of the eye segmenters (checkpoints x backends x precisions x threads x input sizes) with a Pareto report.')
+    parser.add_argument('--models', nargs='+', required=True, help='Segmentation checkpoints (model.h5, eyes_seg_threshold.h5)')
+    parser.add_argument('--images', required=True, help='Folder of the held-out eye images')
+    parser.add_argument('--masks', required=True, help='Folder of the label masks (same sorted order of the images)')
+    parser.add_argument('--output', required=True, help="Folder of 'sweep_results.json' and 'sweep_report.md'")
+    parser.add_argument('--backends', nargs='+', default=['keras'], choices=list(BACKEND_PRECISIONS), help='Inference backends')
+    parser.add_argument('--precisions', nargs='+', default=['fp32'], choices=sorted({p for precisions in BACKEND_PRECISIONS.values() for p in precisions}), help='Precisions (skipped where the backend does not support them)')
+    parser.add_argument('--threads', nargs='+', type=int, default=[0], help='Thread counts (0: TensorFlow default)')
+    parser.add_argument('--buckets', nargs='+', type=int, default=list(INPUT_SIZE_BUCKETS), help='Input sizes')
+    parser.add_argument('--crop-sizes', nargs='+', type=int, default=[None], help='Longest side the crops are downscaled to (default: original size)')
+    parser.add_argument('--upscale', type=float, default=1.0, help='Upscale of the adaptive input size selection')
+    parser.add_argument('--limit', type=int, default=None, help='Maximum number of crops')
+    args = parser.parse_args()
+
+    sweep = run_sweep(args.models, args.images, args.masks, args.output, args.backends, args.precisions, [t or None for t in args.threads], args.crop_sizes, args.buckets, args.upscale, args.limit)
+    print(f"\n{len(sweep['results'])} results, {len(sweep['failures'])} failed configurations, report written to {os.path.join(args.output, 'sweep_report.md')}")
+    for failure in sweep['failures']:
+        print(f"\tFailed: {failure['model']} {failure['backend']} {failure['precision']} {failure['threads']} threads - {failure['error']}")
@@ -0,0 +1,297 @@
+import io
+import sys
+import os
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader, TensorDataset, Subset
+from sklearn.model_selection import KFold
+
+# Add 'code' directory to PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.classifier.classifier import NystClassifier
+from nyst.classifier.precision import autocast, compile_model
+
+# Execution modes compared by benchmark_precisions: (precision, compile)
+EXECUTION_MODES = [('fp32', False), ('bf16', False), ('fp32', True), ('bf16', True)]
+
+
+# Number of parameters of the model
+def count_parameters(model:nn.Module) -> int:
+    '''
+    Counts the trainable parameters of the model.
+
+    Arguments:
+    - model (nn.Module): The model.
+
+    Returns:
+    - int: The number of trainable parameters.
+    '''
+    return sum(param.numel() for param in model.parameters() if param.requires_grad)
+
+# Size of the serialized weights of the model
+def checkpoint_size_mb(model:nn.Module) -> float:
+    '''
+    Computes the size of the state_dict of the model once saved with torch.save (i.e. the size of best_model.pth).
+
+    Arguments:
+    - model (nn.Module): The model.
+
+    Returns:
+    - float: The checkpoint size in MB.
+    '''
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes / 2**20
+
+# Memory needed to train the model with Adam
+def training_state_mb(model:nn.Module) -> float:
+    '''
+    Estimates the memory taken by the training state of the model with Adam: weights, gradients and the two
+    moment estimates of the optimizer (activations excluded).
+
+    Arguments:
+    - model (nn.Module): The model.
+
+    Returns:
+    - float: The training state size in MB.
+    '''
+    param_bytes = sum(param.numel() * param.element_size() for param in model.parameters())
+    return 4 * param_bytes / 2**20
+
+# Inference latency of the model
+def measure_latency(model:nn.Module, batch_size:int=1, input_dim:int=300, num_channels:int=8, repeats:int=20, warmup:int=3, device=torch.device('cpu'), precision:str='fp32') -> dict:
+    '''
+    Measures the inference latency of the model on random inputs.
+
+    Arguments:
+    - model (nn.Module): The model (already moved to the device).
+    - batch_size (int): The number of clips of each forward pass. Default is 1.
+    - input_dim (int): The number of frames of each clip. Default is 300.
+    - num_channels (int): The number of signals of each clip. Default is 8.
+    - repeats (int): The number of timed forward passes. Default is 20.
+    - warmup (int): The number of untimed forward passes executed before timing. Default is 3.
+    - device (torch.device): The device of the model. Default is CPU.
+    - precision (str): The precision of the forward pass, 'fp32' or 'bf16' (autocast). Default is 'fp32'.
+
+    Returns:
+    - dict: The median ('p50_ms') and 95th percentile ('p95_ms') latency in milliseconds and the throughput ('clips_per_s').
+    '''
+    model.eval()
+    inputs = torch.randn(batch_size, num_channels, input_dim, device=device)
+    timings = []
+
+    with torch.no_grad(), autocast(device, precision):
+        for i in range(warmup + repeats):
+            start = time.perf_counter()
+            model(inputs)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            if i >= warmup:
+                timings.append(time.perf_counter() - start)
+
+    timings = np.array(timings) * 1000
+    return {
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'clips_per_s': float(batch_size * 1000 / np.median(timings))
+    }
+
+# Cross-validated accuracy of a model configuration
+def cross_validated_accuracy(model_fn, signals, labels, k_folds:int=5, num_epochs:int=20, batch_size:int=32, lr:float=1e-3, threshold_correct:float=0.5, device=torch.device('cpu')) -> dict:
+    '''
+    Trains a fresh model on each fold with Adam and BCELoss and evaluates it on the held-out fold.
+
+    Arguments:
+    - model_fn (callable): Function with no arguments returning a new (untrained) model.
+    - signals (np.ndarray or torch.Tensor): The normalized signals with shape (n_samples, 8, n_frames).
+    - labels (np.ndarray or torch.Tensor): The labels with shape (n_samples, 1).
+    - k_folds (int): The number of folds. Default is 5.
+    - num_epochs (int): The number of training epochs of each fold. Default is 20.
+    - batch_size (int): The batch size. Default is 32.
+    - lr (float): The learning rate. Default is 1e-3.
+    - threshold_correct (float): The probability threshold of a positive prediction. Default is 0.5.
+    - device (torch.device): The training device. Default is CPU.
+
+    Returns:
+    - dict: The mean ('mean_acc') and standard deviation ('std_acc') of the final validation accuracy over the folds and the average training time per epoch ('epoch_s').
+    '''
+    dataset = TensorDataset(torch.as_tensor(signals, dtype=torch.float32), torch.as_tensor(labels, dtype=torch.float32).reshape(-1, 1))
+    kf = KFold(n_splits=k_folds, shuffle=True, random_state=0)
+    accuracies = []
+    epoch_times = []
+
+    for train_index, val_index in kf.split(range(len(dataset))):
+        train_loader = DataLoader(Subset(dataset, train_index), batch_size=batch_size, shuffle=True)
+        val_loader = DataLoader(Subset(dataset, val_index), batch_size=batch_size, shuffle=False)
+
+        # Fresh model for every fold
+        model = model_fn().to(device)
+        optimizer = optim.Adam(model.parameters(), lr=lr)
+        criterion = nn.BCELoss()
+
+        # Training
+        for _ in range(num_epochs):
+            start = time.perf_counter()
+            model.train()
+            for inputs, targets in train_loader:
+                inputs, targets = inputs.to(device), targets.to(device)
+                optimizer.zero_grad()
+                loss = criterion(model(inputs), targets)
+                loss.backward()
+                optimizer.step()
+            epoch_times.append(time.perf_counter() - start)
+
+        # Validation
+        model.eval()
+        corrects = 0
+        with torch.no_grad():
+            for inputs, targets in val_loader:
+                inputs, targets = inputs.to(device), targets.to(device)
+                corrects += ((model(inputs) >= threshold_correct).float() == targets).sum().item()
+        accuracies.append(corrects / len(val_index))
+
+    return {'mean_acc': float(np.mean(accuracies)), 'std_acc': float(np.std(accuracies)), 'epoch_s': float(np.mean(epoch_times))}
+
+# Compare the classifier heads
+def benchmark_heads(heads, batch_sizes=(1, 32, 256), signals=None, labels=None, k_folds:int=5, num_epochs:int=20, device=torch.device('cpu')) -> list:
+    '''
+    Compares the NystClassifier heads in terms of parameter count, checkpoint size, training memory, inference
+    latency and, if the data is provided, cross-validated accuracy.
+
+    Arguments:
+    - heads (list): The heads to compare (see nyst.classifier.tunedCNN_time.HEADS).
+    - batch_sizes (tuple): The batch sizes used to measure the latency. Default is (1, 32, 256).
+    - signals (np.ndarray): The normalized signals (n_samples, 8, 300). Default is None (no accuracy).
+    - labels (np.ndarray): The labels (n_samples, 1). Default is None (no accuracy).
+    - k_folds (int): The number of folds of the cross-validation. Default is 5.
+    - num_epochs (int): The number of training epochs of each fold. Default is 20.
+    - device (torch.device): The device. Default is CPU.
+
+    Returns:
+    - list: One dictionary of results for each head.
+    '''
+    results = []
+
+    for head in heads:
+        model = NystClassifier(head=head).to(device)
+        result = {
+            'head': head,
+            'parameters': count_parameters(model),
+            'checkpoint_mb': checkpoint_size_mb(model),
+            'training_state_mb': training_state_mb(model),
+        }
+
+        # Latency for each batch size
+        for batch_size in batch_sizes:
+            latency = measure_latency(model, batch_size, device=device)
+            result[f'latency_b{batch_size}_ms'] = latency['p50_ms']
+            result[f'throughput_b{batch_size}_clips_s'] = latency['clips_per_s']
+
+        # Cross-validated accuracy
+        if signals is not None and labels is not None:
+            result.update(cross_validated_accuracy(lambda: NystClassifier(head=head), signals, labels, k_folds, num_epochs, device=device))
+
+        results.append(result)
+        del model
+
+    return results
+
+# Compare the precisions and the compiled model
+def benchmark_precisions(head:str='flatten', modes=EXECUTION_MODES, batch_sizes=(1, 32, 256), signals=None, labels=None, k_folds:int=5, num_epochs:int=20, batch_size:int=32, device=torch.device('cpu')) -> list:
+    '''
+    Compares the execution modes of a NystClassifier: float32 or bfloat16 autocast, eager or torch.compile'd.
+    For every mode it reports the inference latency, the largest difference of the probabilities from the float32 eager
+    model (same weights) and, if the data is provided, the training time per epoch and the cross-validated accuracy
+    with its difference from the first mode. With few epochs the epoch time of the compiled modes is dominated by the compilation.
+
+    Arguments:
+    - head (str): The head of the classifier. Default is 'flatten'.
+    - modes (list): The (precision, compile) modes. Default is EXECUTION_MODES (the first one is the reference).
+    - batch_sizes (tuple): The batch sizes used to measure the latency. Default is (1, 32, 256).
+    - signals (np.ndarray): The normalized signals (n_samples, 8, 300). Default is None (no training).
+    - labels (np.ndarray): The labels (n_samples, 1). Default is None (no training).
+    - k_folds (int): The number of folds of the cross-validation. Default is 5.
+    - num_epochs (int): The number of training epochs of each fold. Default is 20.
+    - batch_size (int): The training batch size. Default is 32.
+    - device (torch.device): The device. Default is CPU.
+
+    Returns:
+    - list: One dictionary of results for each mode.
+    '''
+    from nyst.training.fast_trainer import fold_tensors, train_model_fast
+
+    reference = NystClassifier(head=head).to(device).eval()
+    probe = torch.randn(256, reference.num_channels, reference.input_dim, device=device)
+    with torch.no_grad():
+        reference_scores = reference(probe)
+
+    results = []
+    for precision, compile in modes:
+        result = {'head': head, 'precision': precision, 'compile': compile}
+
+        # Inference: same weights as the reference model
+        model = compile_model(reference, probe[:1]) if compile else reference
+        with torch.no_grad(), autocast(device, precision):
+            result['max_prob_diff'] = float((model(probe).float() - reference_scores).abs().max())
+        for latency_batch in batch_sizes:
+            latency = measure_latency(model, latency_batch, device=device, precision=precision)
+            result[f'latency_b{latency_batch}_ms'] = latency['p50_ms']
+
+        # Training: epoch time and cross-validated accuracy
+        if signals is not None and labels is not None:
+            dataset = TensorDataset(torch.as_tensor(signals, dtype=torch.float32), torch.as_tensor(labels, dtype=torch.float32).reshape(-1, 1))
+            accuracies, epoch_times = [], []
+            for fold, (train_index, val_index) in enumerate(KFold(n_splits=k_folds, shuffle=True, random_state=0).split(range(len(dataset)))):
+                torch.manual_seed(fold) # Same initialization and batch order in every mode
+                fold_model = NystClassifier(head=head).to(device)
+                optimizer = optim.Adam(fold_model.parameters(), lr=1e-3)
+                start = time.perf_counter()
+                _, _, val_stats, _, _ = train_model_fast(fold_model, fold_tensors(dataset, train_index, device), fold_tensors(dataset, val_index, device), nn.BCELoss(), optimizer, device,
+                                                         num_epochs, num_epochs + 1, 0.5, batch_size, precision=precision, compile=compile)
+                epoch_times.append((time.perf_counter() - start) / num_epochs)
+                accuracies.append(val_stats['accuracy'][-1])
+            result['epoch_s'] = float(np.mean(epoch_times))
+            result['mean_acc'] = float(np.mean(accuracies))
+            result['acc_delta'] = result['mean_acc'] - results[0]['mean_acc'] if results else 0.0
+
+        results.append(result)
+
+    return results
+
+# Compare the fold ensemble with a single model
+def benchmark_ensemble(head:str='flatten', num_members:int=4, batch_sizes=(1, 32, 256), device=torch.device('cpu')) -> list:
+    '''
+    Compares the inference latency of a single NystClassifier with the one of an ensemble of num_members models
+    evaluated one after the other or in one vectorized forward pass (see EnsembleClassifier), with random weights.
+
+    Arguments:
+    - head (str): The head of the classifier. Default is 'flatten'.
+    - num_members (int): The number of members of the ensemble (the number of folds). Default is 4.
+    - batch_sizes (tuple): The batch sizes used to measure the latency. Default is (1, 32, 256).
+    - device (torch.device): The device. Default is CPU.
+
+    Returns:
+    - list: One dictionary of results for the single model and each ensemble mode.
+    '''
+    from nyst.classifier.ensemble import EnsembleClassifier
+
+    members = [NystClassifier(head=head).state_dict() for _ in range(num_members)]
+    models = {
+        'single': NystClassifier(head=head).to(device),
+        'ensemble_sequential': EnsembleClassifier(members, head, vectorized=False).to(device),
+        'ensemble_vectorized': EnsembleClassifier(members, head, vectorized=True).to(device)
+    }
+    del members
+
+    results = []
+    for mode, model in models.items():
+        result = {'head': head, 'mode': mode}
+        for latency_batch in batch_sizes:
+            result[f'latency_b{latency_batch}_ms'] = measure_latency(model, latency_batch, device=device)['p50_ms']
+        results.append(result)
+
+    return results
@@ -8,16 +8,17 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from nyst.classifier.tunedCNN_time import CNNfeatureExtractorTime
 
 class NystClassifier(nn.Module):
-    def __init__(self):
+    def __init__(self, head:str='flatten', input_dim:int=300):
         super(NystClassifier, self).__init__() # Calls up the constructor of the parents class 
-        self.input_dim = 300 # Number total frames
+        self.input_dim = input_dim # Number total frames (only used by the 'flatten' and 'strided' heads)
         self.num_channels = 8 # Number of positions + speed
         self.nf = 64 # Number of filters
         self.index_activation_middle_layer = 0 # Activation function middle layer
         self.index_activation_last_layer = 0 # Activation function last layer
+        self.head = head # Feature extractor head: 'flatten' (original) or the compact 'gap', 'attention', 'strided'
         
         # Initialize the tuned CNN and the output network
-        self.tunedCNN = CNNfeatureExtractorTime(self.input_dim, self.num_channels, self.nf, self.index_activation_middle_layer, self.index_activation_last_layer)
+        self.tunedCNN = CNNfeatureExtractorTime(self.input_dim, self.num_channels, self.nf, self.index_activation_middle_layer, self.index_activation_last_layer, self.head)
         
         # Initialize the output fully connected network
         self.output_net = nn.Sequential(
@@ -32,9 +33,9 @@ class NystClassifier(nn.Module):
             nn.Sigmoid()
         )
 
-    def forward(self,x):# batch_size, 8, 300
+    def forward(self, x, lengths=None):# batch_size, 8, 300 (any number of frames with lengths and the 'gap'/'attention' heads)
         # Pass the input through the tuned CNN to extract features
-        features = self.tunedCNN(x)
+        features = self.tunedCNN(x, lengths)
         # Pass the extracted features through the output network
         output = self.output_net(features)
 
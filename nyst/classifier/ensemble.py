@@ -0,0 +1,111 @@
+import sys
+import os
+import copy
+import torch
+import torch.nn as nn
+from torch.func import functional_call, stack_module_state
+
+# Add 'code' directory to PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.classifier.classifier import NystClassifier
+
+
+class EnsembleClassifier(nn.Module):
+    '''
+    Ensemble of the NystClassifier models of the cross-validation folds. The weights of the members are stacked along a
+    new first dimension and all the members are evaluated in a single vectorized forward pass (torch.func.vmap), so the
+    latency is close to the one of a single model with larger layers rather than k sequential calls.
+    The output is the mean probability of the members, with the same shape as NystClassifier (batch_size, 1).
+    When the forward pass is compute-bound (large batches on few CPU cores) the members can be evaluated one after the
+    other instead (vectorized = False), with the same stacked weights.
+
+    Attributes:
+    - head (str): The head of the members.
+    - num_members (int): The number of members.
+    - vectorized (bool): Evaluate the members with vmap (True) or one after the other (False).
+    - input_dim (int): The number of frames of each clip.
+    - num_channels (int): The number of signals of each clip.
+    '''
+    def __init__(self, members:list, head:str='flatten', vectorized:bool=True):
+        super(EnsembleClassifier, self).__init__()
+        self.head = head
+        self.num_members = len(members)
+        self.vectorized = vectorized
+
+        # Members with their trained weights (evaluation mode: BatchNorm uses the running statistics)
+        models = []
+        for state_dict in members:
+            model = NystClassifier(head=head)
+            model.load_state_dict(state_dict)
+            models.append(model.eval())
+        self.input_dim, self.num_channels = models[0].input_dim, models[0].num_channels
+
+        # Stacked parameters and buffers (registered, so .to(device) and state_dict work as usual)
+        params, buffers = stack_module_state(models)
+        self.param_names, self.buffer_names = list(params), list(buffers)
+        for index, name in enumerate(self.param_names):
+            self.register_buffer(f'param_{index}', params[name].detach())
+        for index, name in enumerate(self.buffer_names):
+            self.register_buffer(f'buffer_{index}', buffers[name])
+
+        # Stateless copy of the architecture used by functional_call
+        self.base = [copy.deepcopy(models[0]).to('meta')] # In a list: not a submodule, no parameters of its own
+
+    # Probabilities of every member
+    def member_scores(self, x, lengths=None):
+        '''
+        Evaluates all the members on the same batch in one vectorized forward pass.
+
+        Arguments:
+        - x (torch.Tensor): The clips with shape (batch_size, 8, n_frames).
+        - lengths (torch.Tensor): The number of valid frames of each clip (only with the 'gap' and 'attention' heads). Default is None.
+
+        Returns:
+        - torch.Tensor: The probabilities with shape (num_members, batch_size, 1).
+        '''
+        params = {name: getattr(self, f'param_{index}') for index, name in enumerate(self.param_names)}
+        buffers = {name: getattr(self, f'buffer_{index}') for index, name in enumerate(self.buffer_names)}
+
+        def member(member_params, member_buffers):
+            return functional_call(self.base[0], (member_params, member_buffers), (x, lengths))
+
+        if not self.vectorized:
+            return torch.stack([member({name: value[i] for name, value in params.items()}, {name: value[i] for name, value in buffers.items()}) for i in range(self.num_members)])
+        return torch.vmap(member)(params, buffers)
+
+    def forward(self, x, lengths=None):
+        return self.member_scores(x, lengths).mean(dim=0)
+
+
+# Save the fold models of a cross-validation as an ensemble
+def save_ensemble(members:list, head:str, save_path:str) -> str:
+    '''
+    Saves the weights of the fold models in a single file, loadable with load_ensemble (or load_classifier).
+
+    Arguments:
+    - members (list): The state_dict of each fold model.
+    - head (str): The head of the models.
+    - save_path (str): The output file (e.g. 'ensemble.pth' next to best_model.pth).
+
+    Returns:
+    - str: The path of the saved file.
+    '''
+    torch.save({'head': head, 'members': [{name: value.cpu() for name, value in member.items()} for member in members]}, save_path)
+    return save_path
+
+# Load an ensemble saved by save_ensemble
+def load_ensemble(ensemble_path:str, device=torch.device('cpu'), vectorized:bool=True) -> EnsembleClassifier:
+    '''
+    Loads the fold models saved by save_ensemble into an EnsembleClassifier in evaluation mode.
+
+    Arguments:
+    - ensemble_path (str): The path of the ensemble file.
+    - device (torch.device): The inference device. Default is CPU.
+    - vectorized (bool): Evaluate the members in one vectorized forward pass. Default is True.
+
+    Returns:
+    - EnsembleClassifier: The ensemble.
+    '''
+    checkpoint = torch.load(ensemble_path, map_location='cpu')
+    return EnsembleClassifier(checkpoint['members'], checkpoint['head'], vectorized).to(device).eval()
@@ -0,0 +1,210 @@
+import sys
+import os
+import json
+import warnings
+import numpy as np
+import torch
+import torch.nn as nn
+
+# Add 'code' directory to PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.classifier.classifier import NystClassifier
+from nyst.classifier.benchmark import measure_latency
+
+# Batch sizes of the latency table
+LATENCY_BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+# INT8 dynamic quantization of the linear layers
+def quantize_classifier(model:nn.Module) -> nn.Module:
+    '''
+    Quantizes the weights of the linear layers to INT8 (dynamic quantization: the activations are quantized on the fly
+    at every forward pass). The convolutions stay in float32; with the 'flatten' head the 76,800 -> 2048 linear layer
+    holds most of the weights and of the inference time.
+
+    Arguments:
+    - model (nn.Module): The trained classifier in evaluation mode (CPU).
+
+    Returns:
+    - nn.Module: The quantized copy of the model.
+    '''
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+# TorchScript artifact of a model
+def export_torchscript(model:nn.Module, path:str, example_inputs:torch.Tensor) -> str:
+    '''
+    Traces the fixed-length forward pass of the model and saves it as a TorchScript file, loadable with torch.jit.load
+    (or load_classifier) without the model source code.
+
+    Arguments:
+    - model (nn.Module): The model in evaluation mode.
+    - path (str): The output .pt file.
+    - example_inputs (torch.Tensor): A batch of clips (n, 8, n_frames) used for the tracing.
+
+    Returns:
+    - str: The path of the saved file.
+    '''
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        traced = torch.jit.trace(model, example_inputs)
+    torch.jit.save(traced, path)
+    return path
+
+# ONNX artifact of a model
+def export_onnx(model:nn.Module, path:str, example_inputs:torch.Tensor) -> str:
+    '''
+    Exports the fixed-length forward pass of the float32 model to ONNX with a dynamic batch dimension
+    (input 'clips', output 'probability'). The export needs the optional onnx package.
+
+    Arguments:
+    - model (nn.Module): The float32 model in evaluation mode.
+    - path (str): The output .onnx file.
+    - example_inputs (torch.Tensor): A batch of clips (n, 8, n_frames).
+
+    Returns:
+    - str: The path of the saved file, or None if the export is not available.
+    '''
+    try:
+        torch.onnx.export(model, (example_inputs,), path, input_names=['clips'], output_names=['probability'],
+                          dynamic_axes={'clips': {0: 'batch'}, 'probability': {0: 'batch'}}, dynamo=False)
+    except Exception as e:
+        print(f"ONNX export skipped: {e}")
+        return None
+    return path
+
+# Compare the probabilities of the exported models with the original one
+def parity_report(reference:nn.Module, models:dict, signals:np.ndarray, labels:np.ndarray, threshold:float=0.5, batch_size:int=256) -> dict:
+    '''
+    Scores the same clips with the original model and with each exported variant.
+
+    Arguments:
+    - reference (nn.Module): The original float32 model.
+    - models (dict): The variants to compare, by name.
+    - signals (np.ndarray): The normalized clips (n_clips, 8, n_frames).
+    - labels (np.ndarray): The labels of the clips.
+    - threshold (float): The probability threshold of a positive prediction. Default is 0.5.
+    - batch_size (int): The clips of each forward pass. Default is 256.
+
+    Returns:
+    - dict: For the reference and each variant: the accuracy and, for the variants, the accuracy difference, the
+    largest and mean absolute probability difference and the fraction of clips with the same prediction.
+    '''
+    inputs = torch.as_tensor(signals, dtype=torch.float32)
+    labels = np.asarray(labels, dtype=float).reshape(-1)
+
+    # Probabilities of all the clips
+    def scores(model):
+        with torch.no_grad():
+            return torch.cat([model(inputs[start:start + batch_size]).reshape(-1) for start in range(0, len(inputs), batch_size)]).numpy()
+
+    reference_scores = scores(reference)
+    reference_acc = float(np.mean((reference_scores >= threshold) == labels))
+    report = {'reference': {'accuracy': reference_acc, 'n_clips': len(labels)}}
+
+    for name, model in models.items():
+        model_scores = scores(model)
+        accuracy = float(np.mean((model_scores >= threshold) == labels))
+        report[name] = {
+            'accuracy': accuracy,
+            'accuracy_delta': accuracy - reference_acc,
+            'max_prob_diff': float(np.max(np.abs(model_scores - reference_scores))),
+            'mean_prob_diff': float(np.mean(np.abs(model_scores - reference_scores))),
+            'prediction_agreement': float(np.mean((model_scores >= threshold) == (reference_scores >= threshold)))
+        }
+
+    return report
+
+# Latency of each model for each batch size
+def latency_table(models:dict, batch_sizes=LATENCY_BATCH_SIZES, input_dim:int=300, repeats:int=20) -> dict:
+    '''
+    Measures the median CPU inference latency of each model for each batch size.
+
+    Arguments:
+    - models (dict): The models, by name.
+    - batch_sizes (tuple): The batch sizes. Default is LATENCY_BATCH_SIZES (1 to 256).
+    - input_dim (int): The number of frames of each clip. Default is 300.
+    - repeats (int): The number of timed forward passes. Default is 20.
+
+    Returns:
+    - dict: For each model, the median latency in milliseconds for each batch size.
+    '''
+    return {name: {batch_size: measure_latency(model, batch_size, input_dim, repeats=repeats)['p50_ms'] for batch_size in batch_sizes} for name, model in models.items()}
+
+# Clips of the held-out patients of a dataset
+def held_out_clips(dataset, patients:list) -> tuple:
+    '''
+    Selects the clips of the given patients of a CustomDataset. They are held out only if the model has been trained
+    without them (training_net with holdout_patients, saved in holdout_patients.json next to the model).
+
+    Arguments:
+    - dataset (CustomDataset): The dataset (fixed-length clips).
+    - patients (list): The held-out patients.
+
+    Returns:
+    - tuple: The normalized clips, their labels and the list of the held-out patients.
+    '''
+    clip_patients = np.asarray(dataset.fil_data['patients']).reshape(-1).astype(str)
+    mask = np.isin(clip_patients, [str(patient) for patient in patients])
+    return np.asarray(dataset.fil_norm_data)[mask], np.asarray(dataset.fil_data['labels'], dtype=float)[mask], list(patients)
+
+# Export a trained classifier for serving
+def export_classifier(model_path:str, output_dir:str=None, head:str='flatten', signals:np.ndarray=None, labels:np.ndarray=None, batch_sizes=LATENCY_BATCH_SIZES, threshold:float=0.5, onnx:bool=True, held_out:bool=False) -> dict:
+    '''
+    Exports the trained classifier (best_model.pth) for serving: a TorchScript float32 model, a TorchScript INT8
+    dynamically quantized model and, if the onnx package is installed, an ONNX model. It writes 'export_report.json'
+    with the artifact sizes, the latency table and, if clips are given, the parity report. The probability differences
+    of the parity report are meaningful on any clips; its accuracies are in-sample unless the clips come from patients
+    excluded from the training (held_out).
+
+    Arguments:
+    - model_path (str): The path of the model weights.
+    - output_dir (str): The folder of the artifacts. Default is None (the folder of the model, next to normalization_stats.json).
+    - head (str): The head the model has been trained with. Default is 'flatten'.
+    - signals (np.ndarray): Normalized clips for the parity report (e.g. of the held-out patients). Default is None.
+    - labels (np.ndarray): The labels of the clips. Default is None.
+    - batch_sizes (tuple): The batch sizes of the latency table. Default is LATENCY_BATCH_SIZES.
+    - threshold (float): The probability threshold of a positive prediction. Default is 0.5.
+    - onnx (bool): Also export the ONNX model. Default is True.
+    - held_out (bool): The clips come from patients excluded from the training. Default is False (in-sample clips).
+
+    Returns:
+    - dict: The content of the report.
+    '''
+    output_dir = output_dir or os.path.dirname(os.path.abspath(model_path))
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Original and quantized models (CPU)
+    model = NystClassifier(head=head)
+    model.load_state_dict(torch.load(model_path, map_location='cpu'))
+    model.eval()
+    quantized = quantize_classifier(model)
+    example_inputs = torch.randn(2, model.num_channels, model.input_dim)
+
+    # Artifacts
+    artifacts = {
+        'torchscript_fp32': export_torchscript(model, os.path.join(output_dir, 'classifier_fp32.pt'), example_inputs),
+        'torchscript_int8': export_torchscript(quantized, os.path.join(output_dir, 'classifier_int8.pt'), example_inputs),
+    }
+    if onnx:
+        artifacts['onnx_fp32'] = export_onnx(model, os.path.join(output_dir, 'classifier_fp32.onnx'), example_inputs)
+    artifacts = {name: path for name, path in artifacts.items() if path is not None}
+
+    # The exported files are compared as they will be served
+    exported = {name: torch.jit.load(path) for name, path in artifacts.items() if path.endswith('.pt')}
+
+    report = {
+        'model_path': model_path,
+        'head': head,
+        'artifacts': {name: {'path': path, 'size_mb': os.path.getsize(path) / 2**20} for name, path in artifacts.items()},
+        'state_dict_size_mb': os.path.getsize(model_path) / 2**20,
+        'latency_ms': latency_table({'eager_fp32': model, **exported}, batch_sizes, model.input_dim)
+    }
+    if signals is not None and labels is not None:
+        report['parity_clips'] = 'held-out' if held_out else 'in-sample'
+        report['parity'] = parity_report(model, exported, signals, labels, threshold)
+
+    with open(os.path.join(output_dir, 'export_report.json'), 'w') as f:
+        json.dump(report, f, indent=4)
+
+    return report
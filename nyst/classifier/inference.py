@@ -0,0 +1,337 @@
+import sys
+import os
+import json
+import time
+import multiprocessing
+import numpy as np
+import torch
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Add 'code' directory to PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.classifier.classifier import NystClassifier
+from nyst.classifier.precision import autocast, compile_model
+from nyst.classifier.ensemble import EnsembleClassifier
+from nyst.analysis import FirstSpeedExtractor
+from nyst.dataset.preprocess_function import resample_block
+from nyst.dataset.utils_function import apply_normalization_stats, load_normalization_stats, normalization_stats_path
+
+# Supported video file extensions
+VIDEO_EXTENSIONS = ['.mp4', '.mkv', '.avi', '.mov']
+
+# Feature extraction pipeline of the worker process (one per process, the models stay loaded between videos)
+_worker_pipeline = None
+
+
+# List the videos to be scored
+def list_videos(inputs) -> list:
+    '''
+    Collects the videos to be scored from a folder, a single video or a list of both.
+
+    Arguments:
+    - inputs (str or list): A folder, a video path or a list of folders/video paths.
+
+    Returns:
+    - list: The sorted video paths.
+    '''
+    if isinstance(inputs, str):
+        inputs = [inputs]
+
+    videos = []
+    for path in inputs:
+        if os.path.isdir(path):
+            videos += [os.path.join(path, video) for video in sorted(os.listdir(path)) if os.path.splitext(video)[1].lower() in VIDEO_EXTENSIONS]
+        elif os.path.isfile(path):
+            videos.append(path)
+        else:
+            raise FileNotFoundError(f'Video or folder not found: {path}')
+
+    return videos
+
+# Load the trained classifier
+def load_classifier(model_path:str, head:str='flatten', device=torch.device('cpu'), compile:bool=False) -> NystClassifier:
+    '''
+    Loads the weights saved by the training (best_model.pth) into a NystClassifier in evaluation mode.
+    The TorchScript artifacts written by nyst.classifier.export (e.g. the INT8 classifier_int8.pt) are loaded as they are
+    (recognized by their content, not by the extension: state_dict checkpoints can also be .pt files), and the fold ensembles saved by the training (ensemble.pth) are loaded into an EnsembleClassifier (head of the ensemble file).
+
+    Arguments:
+    - model_path (str): The path of the model weights (or of a TorchScript artifact).
+    - head (str): The head the model has been trained with. Default is 'flatten'.
+    - device (torch.device): The inference device. Default is CPU.
+    - compile (bool): Compile the model with torch.compile (eager model if the compilation fails). Default is False.
+
+    Returns:
+    - NystClassifier: The trained model.
+    '''
+    # TorchScript artifact: torch.jit.load fails on the files saved with torch.save
+    try:
+        return torch.jit.load(model_path, map_location=device).eval()
+    except RuntimeError:
+        pass
+
+    # Fold ensemble (all the members run in one vectorized forward pass) or single model
+    state = torch.load(model_path, map_location=device)
+    if 'members' in state:
+        model = EnsembleClassifier(state['members'], state['head'])
+    else:
+        model = NystClassifier(head=head)
+        model.load_state_dict(state)
+    model = model.to(device).eval()
+    if compile:
+        return compile_model(model, torch.zeros(1, model.num_channels, model.input_dim, device=device))
+    return model
+
+# Split the pupil positions of a video into overlapping clips
+def video_clips(left_positions, right_positions, fps:float, clip_duration:float=10, overlapping:float=8, frames:int=300, method:str='cubic', speed_extractor=None) -> tuple:
+    '''
+    Splits the pupil positions of a whole video into overlapping clips, as the labelling step does, computes the
+    speeds of each clip and resamples the 8 signals to the number of frames of the classifier.
+
+    Arguments:
+    - left_positions (np.ndarray): The (x, y) positions of the left pupil with shape (n_frames, 2).
+    - right_positions (np.ndarray): The (x, y) positions of the right pupil with shape (n_frames, 2).
+    - fps (float): The frame rate of the video.
+    - clip_duration (float): The duration of each clip in seconds. Default is 10.
+    - overlapping (float): The overlap between consecutive clips in seconds. Default is 8.
+    - frames (int): The number of frames of each resampled clip. Default is 300.
+    - method (str): The resampling method (see nyst.dataset.preprocess_function.RESAMPLING_METHODS). Default is 'cubic'.
+    - speed_extractor (FirstSpeedExtractor): The speed extractor. Default is None (a new one is created).
+
+    Returns:
+    - tuple:
+        - np.ndarray: The clips with shape (n_clips * n_time_resolutions, 8, frames), not normalized.
+        - list: For each clip, a dictionary with the clip index, its first and last frame and the speed time resolution.
+    '''
+    speed_extractor = speed_extractor or FirstSpeedExtractor()
+    left_positions, right_positions = np.asarray(left_positions, dtype=float), np.asarray(right_positions, dtype=float)
+    n_frames = len(left_positions)
+
+    # Clip boundaries (same rule of the labelling step, the last incomplete clip is dropped)
+    clip_frames = max(round(clip_duration * fps), 1)
+    step = max(clip_frames - round(overlapping * fps), 1)
+    starts = [0] if n_frames <= clip_frames else range(0, n_frames - clip_frames + 1, step)
+
+    signals, clips_info = [], []
+    for clip_idx, start in enumerate(starts):
+        end = min(start + clip_frames, n_frames)
+        left, right = left_positions[start:end], right_positions[start:end]
+
+        # Speeds computed on the clip only, for each time resolution (one sample per resolution as in the dataset)
+        left_speed, right_speed = speed_extractor.apply(left, fps), speed_extractor.apply(right, fps)
+        for resolution in left_speed:
+            signals.append(np.concatenate([left.T, right.T, left_speed[resolution].T, right_speed[resolution].T]))
+            clips_info.append({'clip': clip_idx, 'start_frame': int(start), 'end_frame': int(end), 'resolution': resolution})
+
+    # All the clips of a video have the same length: one resampling call for the whole video
+    signals = resample_block(np.stack(signals), frames, method)
+
+    return signals, clips_info
+
+# Score the clips in batches
+def score_clips(model:torch.nn.Module, clips:np.ndarray, batch_size:int=256, device=torch.device('cpu'), precision:str='fp32') -> np.ndarray:
+    '''
+    Computes the nystagmus probability of the normalized clips, in batches of batch_size clips.
+
+    Arguments:
+    - model (nn.Module): The trained classifier in evaluation mode.
+    - clips (np.ndarray): The normalized clips with shape (n_clips, 8, n_frames).
+    - batch_size (int): The number of clips of each forward pass. Default is 256.
+    - device (torch.device): The device of the model. Default is CPU.
+    - precision (str): The precision of the forward pass, 'fp32' or 'bf16' (autocast). Default is 'fp32'.
+
+    Returns:
+    - np.ndarray: The probability of each clip, with shape (n_clips,).
+    '''
+    inputs = torch.as_tensor(clips, dtype=torch.float32)
+    scores = []
+
+    with torch.no_grad(), autocast(device, precision):
+        for start in range(0, len(inputs), batch_size):
+            scores.append(model(inputs[start:start + batch_size].to(device)).float().reshape(-1).cpu())
+
+    return torch.cat(scores).numpy() if scores else np.zeros(0, dtype=np.float32)
+
+# Aggregate the clip scores of a video
+def aggregate_scores(scores:np.ndarray, clips_info:list, threshold:float=0.5) -> dict:
+    '''
+    Aggregates the scores of the overlapping clips of a video into a per-video verdict. The scores of the different
+    speed time resolutions of a clip are averaged first, then the video score is the mean over the clips.
+
+    Arguments:
+    - scores (np.ndarray): The probability of each clip (one per clip and time resolution).
+    - clips_info (list): The clip information returned by video_clips.
+    - threshold (float): The probability threshold of a positive verdict. Default is 0.5.
+
+    Returns:
+    - dict: The video score, the maximum clip score, the fraction of positive clips, the verdict (0/1) and the score of each clip.
+    '''
+    clip_ids = np.array([info['clip'] for info in clips_info])
+    clip_scores = np.bincount(clip_ids, weights=scores) / np.bincount(clip_ids)
+    score = float(np.mean(clip_scores))
+
+    return {
+        'score': score,
+        'max_clip_score': float(np.max(clip_scores)),
+        'positive_clip_fraction': float(np.mean(clip_scores >= threshold)),
+        'verdict': int(score >= threshold),
+        'clip_scores': [float(clip_score) for clip_score in clip_scores],
+    }
+
+# Create the feature extraction pipeline of a worker process
+def _init_worker(use_daemon:bool=False):
+    global _worker_pipeline
+    from nyst.pipeline import FirstPipeline, connect_pipeline
+    # In the current process the pipeline daemon (if running) avoids loading the models again
+    _worker_pipeline = connect_pipeline() if use_daemon else FirstPipeline()
+
+# Extract the pupil positions of a video in a worker process
+def _extract_video(video_path:str, idx:int) -> dict:
+    if _worker_pipeline is None:
+        _init_worker(use_daemon=True)
+
+    start = time.perf_counter()
+    output_dict = _worker_pipeline.run(video_path, os.path.dirname(video_path), idx, annotate=False)
+
+    return {
+        'video': video_path,
+        'fps': output_dict['fps'],
+        'left': np.asarray(output_dict['position']['left'], dtype=float),
+        'right': np.asarray(output_dict['position']['right'], dtype=float),
+        'extraction_s': time.perf_counter() - start
+    }
+
+# Extract the videos, one process per worker
+def _extracted_videos(videos:list, workers:int=1):
+    # Single worker: extraction in the current process
+    if workers <= 1:
+        for idx, video in enumerate(videos):
+            try:
+                yield _extract_video(video, idx), None
+            except Exception as e:
+                yield {'video': video}, e
+        return
+
+    # Spawned processes, so that every worker initializes its own models
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker) as executor:
+        futures = {executor.submit(_extract_video, video, idx): video for idx, video in enumerate(videos)}
+        for future in as_completed(futures):
+            try:
+                yield future.result(), None
+            except Exception as e:
+                yield {'video': futures[future]}, e
+
+# Headless batched inference over a set of videos
+def run_inference(inputs, model_path:str, output_file:str, head:str='flatten', workers:int=1, batch_size:int=256, clip_duration:float=10, overlapping:float=8, threshold:float=0.5, stats_file:str=None, frames:int=300, method:str='cubic', device=None, precision:str='fp32', compile:bool=False) -> dict:
+    '''
+    Scores a set of videos with the trained classifier: the pupil positions are extracted by FirstPipeline (in parallel
+    over `workers` processes), every video is split into overlapping clips, the clips are normalized with the training-time
+    statistics and scored in batches, and the clip scores are aggregated into a per-video verdict.
+    The results and the timing are saved in a JSON file.
+
+    Arguments:
+    - inputs (str or list): A folder, a video path or a list of folders/video paths.
+    - model_path (str): The path of the model weights (best_model.pth).
+    - output_file (str): The path of the JSON results file.
+    - head (str): The head the model has been trained with. Default is 'flatten'.
+    - workers (int): The number of feature extraction processes. Default is 1.
+    - batch_size (int): The number of clips of each forward pass. Default is 256.
+    - clip_duration (float): The duration of each clip in seconds. Default is 10.
+    - overlapping (float): The overlap between consecutive clips in seconds. Default is 8.
+    - threshold (float): The probability threshold of a positive verdict. Default is 0.5.
+    - stats_file (str): The normalization statistics saved by the training. Default is None ('normalization_stats.json' next to the model).
+    - frames (int): The number of frames of each clip given to the model. Default is 300.
+    - method (str): The resampling method of the clips. Default is 'cubic'.
+    - device (torch.device): The inference device. Default is None (GPU if available).
+    - precision (str): The precision of the forward pass, 'fp32' or 'bf16' (autocast). Default is 'fp32'.
+    - compile (bool): Compile the model with torch.compile. Default is False.
+
+    Returns:
+    - dict: The content of the results file.
+    '''
+    start_total = time.perf_counter()
+    device = device or torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+
+    # Model and training-time normalization statistics
+    model = load_classifier(model_path, head, device, compile)
+    std_per_column = load_normalization_stats(stats_file or normalization_stats_path(model_path))
+    speed_extractor = FirstSpeedExtractor()
+
+    videos = list_videos(inputs)
+    results, failed = [], []
+    scoring_s = 0.0
+    n_clips = 0
+
+    # Clips waiting to be scored: they are scored together once a full batch is available
+    pending = []
+    def flush(force=False):
+        nonlocal scoring_s, n_clips
+        if not pending or (not force and sum(len(item['clips']) for item in pending) < batch_size):
+            return
+
+        start = time.perf_counter()
+        scores = score_clips(model, np.concatenate([item['clips'] for item in pending]), batch_size, device, precision)
+        scoring_s += time.perf_counter() - start
+
+        # Split the scores back to their videos
+        offsets = np.cumsum([len(item['clips']) for item in pending])[:-1]
+        for item, video_scores in zip(pending, np.split(scores, offsets)):
+            results.append({
+                'video': item['video'],
+                'n_clips': len(set(info['clip'] for info in item['clips_info'])),
+                'extraction_s': item['extraction_s'],
+                **aggregate_scores(video_scores, item['clips_info'], threshold)
+            })
+            n_clips += len(item['clips'])
+        pending.clear()
+
+    for extracted, error in _extracted_videos(videos, workers):
+        if error is not None:
+            print(f"Failed to process {extracted['video']}: {error}")
+            failed.append({'video': extracted['video'], 'error': str(error)})
+            continue
+
+        try:
+            clips, clips_info = video_clips(extracted['left'], extracted['right'], extracted['fps'], clip_duration, overlapping, frames, method, speed_extractor)
+        except Exception as e:
+            print(f"Failed to split {extracted['video']} into clips: {e}")
+            failed.append({'video': extracted['video'], 'error': str(e)})
+            continue
+
+        pending.append({
+            'video': extracted['video'],
+            'clips': apply_normalization_stats(clips, std_per_column),
+            'clips_info': clips_info,
+            'extraction_s': extracted['extraction_s']
+        })
+        flush()
+
+    flush(force=True)
+
+    total_s = time.perf_counter() - start_total
+    output = {
+        'config': {
+            'model_path': model_path, 'head': head, 'workers': workers, 'batch_size': batch_size, 'clip_duration': clip_duration,
+            'overlapping': overlapping, 'threshold': threshold, 'frames': frames, 'method': method, 'device': str(device),
+            'precision': precision, 'compile': compile
+        },
+        'timing': {
+            'total_s': total_s,
+            'extraction_s': float(sum(result['extraction_s'] for result in results)),
+            'scoring_s': scoring_s,
+            'videos_per_s': len(results) / total_s if total_s > 0 else 0.0,
+            'clips_per_s': n_clips / scoring_s if scoring_s > 0 else 0.0
+        },
+        'videos': sorted(results, key=lambda result: result['video']),
+        'failed': failed
+    }
+
+    # Save the results
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with open(output_file, 'w') as f:
+        json.dump(output, f, indent=4)
+
+    print(f"\n{len(results)} videos scored ({len(failed)} failed) in {total_s:.1f} s, results saved to {output_file}")
+
+    return output
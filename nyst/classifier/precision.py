@@ -0,0 +1,63 @@
+import warnings
+import torch
+
+# Numerical precisions of the forward pass: float32 or bfloat16 autocast (weights and optimizer state stay in float32)
+PRECISIONS = ['fp32', 'bf16']
+
+
+# Autocast context of a precision
+def autocast(device, precision:str='fp32'):
+    '''
+    Returns the autocast context of the forward pass: with 'bf16' the matrix multiplications and convolutions run in
+    bfloat16 (AMX/AVX512-BF16 units on recent Xeons, tensor cores on GPU) and the reductions in float32. Only the
+    forward pass goes inside the context: the loss is computed on the float32 outputs after it (CUDA autocast refuses
+    BCELoss as unsafe).
+
+    Arguments:
+    - device (torch.device): The device of the model.
+    - precision (str): 'fp32' (no autocast) or 'bf16'. Default is 'fp32'.
+
+    Returns:
+    - torch.autocast: The context manager (disabled for 'fp32').
+    '''
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unsupported precision: {precision}. Choose one of {PRECISIONS}")
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=precision == 'bf16')
+
+# Native bfloat16 support of the CPU
+def cpu_bf16_supported() -> bool:
+    '''
+    Checks if the oneDNN kernels of the CPU have native bfloat16 support (without it bf16 autocast is emulated and slower).
+
+    Returns:
+    - bool: True if bfloat16 is supported natively.
+    '''
+    is_supported = getattr(torch.ops.mkldnn, '_is_mkldnn_bf16_supported', None)
+    return bool(is_supported()) if is_supported is not None else False
+
+# Compiled forward of a model
+def compile_model(model:torch.nn.Module, example_inputs:torch.Tensor=None) -> torch.nn.Module:
+    '''
+    Compiles the model with torch.compile. The compiled module shares the parameters of the model, so the training and
+    the state_dict keep using the original model. If example_inputs are given, the compilation is done immediately and
+    the eager model is returned (with a warning) if it fails, e.g. without a C++ compiler.
+
+    Arguments:
+    - model (nn.Module): The model.
+    - example_inputs (torch.Tensor): A batch to compile the model with. Default is None (compiled at the first call).
+
+    Returns:
+    - nn.Module: The compiled model, or the model itself if the compilation failed.
+    '''
+    compiled = torch.compile(model)
+    if example_inputs is None:
+        return compiled
+
+    try:
+        with torch.no_grad():
+            compiled(example_inputs)
+    except Exception as e:
+        warnings.warn(f'torch.compile failed, running in eager mode: {e}')
+        return model
+
+    return compiled
@@ -0,0 +1,266 @@
+import sys
+import os
+import json
+import time
+import queue
+import threading
+import numpy as np
+import torch
+from collections import deque
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Add 'code' directory to PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.classifier.inference import load_classifier, video_clips, aggregate_scores
+from nyst.classifier.precision import autocast
+from nyst.dataset.utils_function import apply_normalization_stats, load_normalization_stats, normalization_stats_path
+
+
+class MicroBatcher:
+    '''
+    Coalesces the clips of concurrent requests into micro-batches: a batch is run as soon as it contains max_batch_size
+    clips or max_wait_ms milliseconds after its first request, whichever comes first. A single thread runs the model.
+
+    Attributes:
+    - model (nn.Module): The classifier in evaluation mode.
+    - max_batch_size (int): The maximum number of clips of a forward pass.
+    - max_wait_ms (float): The maximum time a request waits for other requests to be batched with.
+    - device (torch.device): The device of the model.
+    - precision (str): The precision of the forward pass, 'fp32' or 'bf16' (autocast).
+    '''
+    def __init__(self, model:torch.nn.Module, max_batch_size:int=64, max_wait_ms:float=5, device=torch.device('cpu'), history:int=10000, precision:str='fp32'):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.device = device
+        self.precision = precision
+        self.requests = queue.Queue()
+
+        # Metrics
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=history) # End-to-end latency of the last requests (ms)
+        self.batch_sizes = deque(maxlen=history) # Clips of the last batches
+        self.n_requests = 0
+        self.n_clips = 0
+        self.n_batches = 0
+        self.compute_s = 0.0
+        self.start_time = time.time()
+
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    # Submit the clips of a request
+    def submit(self, clips:np.ndarray) -> Future:
+        '''
+        Queues the normalized clips of a request.
+
+        Arguments:
+        - clips (np.ndarray): The normalized clips with shape (n_clips, 8, n_frames).
+
+        Returns:
+        - Future: Resolved with the probability of each clip (np.ndarray with shape (n_clips,)).
+        '''
+        future = Future()
+        self.requests.put((np.asarray(clips, dtype=np.float32), future, time.perf_counter()))
+        return future
+
+    # Collect the requests of a micro-batch and run the model
+    def loop(self) -> None:
+        while True:
+            batch = [self.requests.get()]
+            n_clips = len(batch[0][0])
+            deadline = time.perf_counter() + self.max_wait_ms / 1000
+
+            # Wait for other requests until the batch is full or the deadline expires
+            while n_clips < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                n_clips += len(request[0])
+
+            self.run_batch(batch)
+
+    # Score a micro-batch and resolve the futures of its requests
+    def run_batch(self, batch:list) -> None:
+        start = time.perf_counter()
+        try:
+            inputs = torch.from_numpy(np.concatenate([clips for clips, _, _ in batch])).to(self.device)
+            with torch.no_grad(), autocast(self.device, self.precision):
+                scores = self.model(inputs).float().reshape(-1).cpu().numpy()
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        end = time.perf_counter()
+        offsets = np.cumsum([len(clips) for clips, _, _ in batch])[:-1]
+        for (_, future, submitted), request_scores in zip(batch, np.split(scores, offsets)):
+            future.set_result(request_scores)
+
+        # Update the metrics
+        with self.lock:
+            self.latencies.extend((end - submitted) * 1000 for _, _, submitted in batch)
+            self.batch_sizes.append(len(scores))
+            self.n_requests += len(batch)
+            self.n_clips += len(scores)
+            self.n_batches += 1
+            self.compute_s += end - start
+
+    # Latency and throughput metrics
+    def metrics(self) -> dict:
+        '''
+        Returns the latency and throughput metrics of the service.
+
+        Returns:
+        - dict: The request/clip/batch counters, the end-to-end latency percentiles of the last requests (ms),
+        the mean batch size, the throughput since the start and the fraction of time spent running the model.
+        '''
+        with self.lock:
+            latencies = np.array(self.latencies)
+            batch_sizes = np.array(self.batch_sizes)
+            uptime = time.time() - self.start_time
+            return {
+                'uptime_s': uptime,
+                'requests': self.n_requests,
+                'clips': self.n_clips,
+                'batches': self.n_batches,
+                'queue_depth': self.requests.qsize(),
+                'mean_batch_size': float(batch_sizes.mean()) if len(batch_sizes) else 0.0,
+                'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+                'latency_p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+                'latency_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+                'requests_per_s': self.n_requests / uptime,
+                'clips_per_s': self.n_clips / uptime,
+                'model_utilization': self.compute_s / uptime,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms
+            }
+
+
+class _ScoringHandler(BaseHTTPRequestHandler):
+    # JSON response
+    def send_json(self, status:int, content:dict) -> None:
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # No log line for every request
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        elif self.path == '/metrics':
+            self.send_json(200, self.server.service.batcher.metrics())
+        else:
+            self.send_json(404, {'error': f'Unknown path: {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self.send_json(404, {'error': f'Unknown path: {self.path}'})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            response = self.server.service.predict(request)
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+
+        self.send_json(200, response)
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128 # Pending connections (the default of 5 drops connections under concurrent load)
+
+
+class ScoringService:
+    '''
+    Local HTTP service scoring eye-position traces with a trained NystClassifier (standard library HTTP server).
+
+    Endpoints:
+    - POST /predict: JSON body with either
+        - 'traces': one (8, n_frames) trace or a list of them, with the signals in the order of SIGNAL_COLUMNS (not normalized,
+        unless 'normalized' is true). The response contains the probability of each trace.
+        - 'left', 'right' and 'fps': the raw (n_frames, 2) pupil positions of a video, split into overlapping clips as in
+        the inference phase ('clip_duration' and 'overlapping' in seconds are optional). The response contains the
+        per-video score and verdict and the score of each clip.
+    - GET /metrics: the latency and throughput metrics of the micro-batcher.
+    - GET /health: liveness check.
+
+    Attributes:
+    - model (nn.Module): The classifier.
+    - std_per_column (np.ndarray): The training-time normalization statistics.
+    - batcher (MicroBatcher): The micro-batcher running the model.
+    '''
+    def __init__(self, model_path:str, head:str='flatten', stats_file:str=None, max_batch_size:int=64, max_wait_ms:float=5, threshold:float=0.5, frames:int=300, device=None, precision:str='fp32', compile:bool=False):
+        self.device = device or torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+        self.model = load_classifier(model_path, head, self.device, compile)
+        self.std_per_column = load_normalization_stats(stats_file or normalization_stats_path(model_path))
+        self.threshold = threshold
+        self.frames = frames
+        self.batcher = MicroBatcher(self.model, max_batch_size, max_wait_ms, self.device, precision=precision)
+
+    # Score a request
+    def predict(self, request:dict) -> dict:
+        '''
+        Scores the traces or the raw positions of a request (see the class documentation for the format).
+
+        Arguments:
+        - request (dict): The decoded JSON body.
+
+        Returns:
+        - dict: The response.
+        '''
+        if 'traces' in request:
+            traces = np.asarray(request['traces'], dtype=np.float32)
+            if traces.ndim == 2:
+                traces = traces[None]
+            if traces.ndim != 3 or traces.shape[1] != len(self.std_per_column) or traces.shape[2] != self.frames:
+                raise ValueError(f'The traces must have shape ({len(self.std_per_column)}, {self.frames}) or (n, {len(self.std_per_column)}, {self.frames}), got {traces.shape}')
+            if not np.isfinite(traces).all():
+                raise ValueError('The traces contain NaN or infinite values')
+
+            clips = traces if request.get('normalized', False) else apply_normalization_stats(traces, self.std_per_column)
+            scores = self.batcher.submit(clips).result()
+            return {'probabilities': [float(score) for score in scores], 'verdicts': [int(score >= self.threshold) for score in scores]}
+
+        # Raw positions of a video
+        clips, clips_info = video_clips(request['left'], request['right'], float(request['fps']), request.get('clip_duration', 10), request.get('overlapping', 8), self.frames)
+        scores = self.batcher.submit(apply_normalization_stats(clips, self.std_per_column)).result()
+        return aggregate_scores(scores, clips_info, self.threshold)
+
+    # Start the HTTP server
+    def serve_forever(self, host:str='127.0.0.1', port:int=8080) -> None:
+        '''
+        Serves the requests until Ctrl+C. Every connection is handled by its own thread, the model by the micro-batcher.
+
+        Arguments:
+        - host (str): The address to listen on. Default is '127.0.0.1' (local only).
+        - port (int): The port. Default is 8080.
+        '''
+        self.server = _HTTPServer((host, port), _ScoringHandler)
+        self.server.service = self
+        print(f"Scoring service listening on http://{host}:{self.server.server_port}")
+
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
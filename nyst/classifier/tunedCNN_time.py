@@ -4,15 +4,75 @@ import torch
 #Activation functions list:
 Activation_list = [nn.ReLU(inplace=True), nn.Tanh()]
 
+# Heads available to turn the convolutional feature maps into the 256 features of the output network
+HEADS = ['flatten', 'gap', 'attention', 'strided']
+
+# Heads which do not depend on the number of frames of the input
+VARIABLE_LENGTH_HEADS = ['gap', 'attention']
+
+
+class AttentionPooling1d(nn.Module):
+    '''
+    Attention pooling over time: a 1x1 convolution scores every time step, the scores are normalised with a
+    softmax along the time axis and the feature maps are averaged with these weights.
+    '''
+    def __init__(self, num_channels):
+        super(AttentionPooling1d, self).__init__()
+        self.score = nn.Conv1d(in_channels=num_channels, out_channels=1, kernel_size=1)
+
+    def forward(self, input, mask=None): # batch_size, num_channels, time
+        scores = self.score(input)
+        # Padded time steps get no weight
+        if mask is not None:
+            scores = scores.masked_fill(~mask[:, None, :], float('-inf'))
+        weights = torch.softmax(scores, dim=-1)
+        return torch.sum(input * weights, dim=-1)
+
+
+# Batch normalization of zero-padded clips
+def masked_batch_norm(batch_norm:nn.BatchNorm1d, input:torch.Tensor, mask:torch.Tensor) -> torch.Tensor:
+    '''
+    Training-mode BatchNorm1d whose batch statistics (and running statistics) are computed over the valid time steps
+    only, so that the normalisation does not depend on the padding length of the batch.
+
+    Arguments:
+    - batch_norm (nn.BatchNorm1d): The layer (its affine parameters and running statistics are used).
+    - input (torch.Tensor): The feature maps with shape (batch_size, num_channels, time).
+    - mask (torch.Tensor): The valid time steps with shape (batch_size, time).
+
+    Returns:
+    - torch.Tensor: The normalised feature maps.
+    '''
+    weights = mask[:, None, :].to(input.dtype)
+    count = weights.sum()
+    mean = torch.sum(input * weights, dim=(0, 2)) / count
+    var = torch.sum((input - mean[None, :, None]) ** 2 * weights, dim=(0, 2)) / count
+
+    # Running statistics updated as nn.BatchNorm1d does (unbiased variance)
+    if batch_norm.track_running_stats:
+        with torch.no_grad():
+            batch_norm.num_batches_tracked += 1
+            momentum = batch_norm.momentum if batch_norm.momentum is not None else 1.0 / float(batch_norm.num_batches_tracked)
+            batch_norm.running_mean.mul_(1 - momentum).add_(momentum * mean.detach())
+            batch_norm.running_var.mul_(1 - momentum).add_(momentum * var.detach() * count / torch.clamp(count - 1, min=1))
+
+    output = (input - mean[None, :, None]) / torch.sqrt(var[None, :, None] + batch_norm.eps)
+    if batch_norm.affine:
+        output = output * batch_norm.weight[None, :, None] + batch_norm.bias[None, :, None]
+    return output
+
 
 class CNNfeatureExtractorTime(nn.Module):
-    def __init__(self, input_dim, num_channels, nf, index_activation_middle_layer=0, index_activation_last_layer=-1):
+    def __init__(self, input_dim, num_channels, nf, index_activation_middle_layer=0, index_activation_last_layer=-1, head='flatten'):
         super(CNNfeatureExtractorTime, self).__init__()
         self.input_dim = input_dim
         self.num_channels = num_channels # Number of desire channels 
         self.nf = nf # Numbe filters
         self.index_activation_middle_layer = index_activation_middle_layer # Index for selecting the activation function of middle layers
         self.index_activation_last_layer = index_activation_last_layer # Index for selecting the activation function of last layer
+        self.head = head # Head turning the last feature maps into the output features
+        head_layers = self.build_head()
+        self.num_head_layers = len(head_layers) # Number of layers of the head at the end of self.main
         
 
         
@@ -52,13 +112,119 @@ class CNNfeatureExtractorTime(nn.Module):
             nn.Conv1d(in_channels=self.nf*8, out_channels=self.nf*16, kernel_size=3, stride=1, padding=1, bias=True),
             nn.BatchNorm1d(self.nf*16),
             Activation_list[self.index_activation_last_layer],
-            nn.Flatten(),  # Flatten the output before passing to fully connected layers
             
-            #Last layer - fully connected
-            nn.Linear(in_features=int(self.nf*16*self.input_dim/4), out_features=2048),
-            nn.Linear(in_features=2048, out_features=256)
+            # Head - from the (nf*16, input_dim/4) feature maps to 256 features
+            *head_layers
 
         )
 
-    def forward(self, input):
-        return self.main(input)
+    def build_head(self):
+        '''
+        Builds the layers of the selected head:
+        - 'flatten': flatten + fully connected layers (nf*16*input_dim/4 -> 2048 -> 256), about 157M weights with the default sizes.
+        - 'gap': global average pooling over time + fully connected layer (nf*16 -> 256).
+        - 'attention': attention pooling over time + fully connected layer (nf*16 -> 256).
+        - 'strided': two strided convolutions reducing channels and time + fully connected layer (nf*input_dim/16 -> 256).
+
+        Returns:
+        - list: The layers of the head.
+        '''
+        if self.head == 'flatten':
+            return [
+                nn.Flatten(),  # Flatten the output before passing to fully connected layers
+
+                #Last layer - fully connected
+                nn.Linear(in_features=int(self.nf*16*self.input_dim/4), out_features=2048),
+                nn.Linear(in_features=2048, out_features=256)
+            ]
+        elif self.head == 'gap':
+            return [
+                nn.AdaptiveAvgPool1d(1), # Average of each feature map over time
+                nn.Flatten(),
+                nn.Linear(in_features=self.nf*16, out_features=256)
+            ]
+        elif self.head == 'attention':
+            return [
+                AttentionPooling1d(self.nf*16), # Weighted average of each feature map over time
+                nn.Linear(in_features=self.nf*16, out_features=256)
+            ]
+        elif self.head == 'strided':
+            # Each strided convolution halves the time steps (rounding up)
+            time_steps = int(self.input_dim/4)
+            for _ in range(2):
+                time_steps = (time_steps - 1) // 2 + 1
+
+            return [
+                nn.Conv1d(in_channels=self.nf*16, out_channels=self.nf*4, kernel_size=3, stride=2, padding=1, bias=True),
+                nn.BatchNorm1d(self.nf*4),
+                Activation_list[self.index_activation_middle_layer],
+                nn.Conv1d(in_channels=self.nf*4, out_channels=self.nf, kernel_size=3, stride=2, padding=1, bias=True),
+                nn.BatchNorm1d(self.nf),
+                Activation_list[self.index_activation_middle_layer],
+                nn.Flatten(),
+                nn.Linear(in_features=self.nf*time_steps, out_features=256)
+            ]
+        else:
+            raise ValueError(f"Unsupported head: {self.head}. Choose one of {HEADS}")
+
+    def forward(self, input, lengths=None):
+        '''
+        Extracts the features of a batch of clips.
+
+        Arguments:
+        - input (torch.Tensor): The signals with shape (batch_size, num_channels, n_frames), zero-padded if the clips have different lengths.
+        - lengths (torch.Tensor): The number of valid frames of each clip (only with the 'gap' and 'attention' heads).
+        If None, all the frames are considered valid.
+
+        Returns:
+        - torch.Tensor: The features with shape (batch_size, 256).
+        '''
+        if lengths is None:
+            return self.main(input)
+
+        if self.head not in VARIABLE_LENGTH_HEADS:
+            raise ValueError(f"The '{self.head}' head requires {self.input_dim} frames, use one of {VARIABLE_LENGTH_HEADS} for variable-length inputs")
+
+        # Convolutional feature maps (time reduced by the two pooling layers), with the padded time steps zeroed after
+        # every layer and excluded from the batch normalisation statistics: the valid features of a clip are the same
+        # whatever the padding of its batch
+        features = self.masked_features(input, lengths.to(input.device))
+        steps = torch.clamp(torch.div(lengths.to(features.device), 4, rounding_mode='floor'), min=1)
+        mask = torch.arange(features.shape[-1], device=features.device)[None, :] < steps[:, None]
+
+        # Pooling over the valid time steps only
+        if self.head == 'gap':
+            pooled = torch.sum(features * mask[:, None, :], dim=-1) / steps[:, None]
+        else:
+            pooled = self.main[-2](features, mask)
+
+        return self.main[-1](pooled)
+
+    def masked_features(self, input, lengths):
+        '''
+        Runs the convolutional layers (without the head) on zero-padded clips, keeping the padded time steps at zero.
+
+        Arguments:
+        - input (torch.Tensor): The signals with shape (batch_size, num_channels, n_frames).
+        - lengths (torch.Tensor): The number of valid frames of each clip.
+
+        Returns:
+        - torch.Tensor: The feature maps with shape (batch_size, nf*16, n_frames/4).
+        '''
+        steps = lengths
+        mask = torch.arange(input.shape[-1], device=input.device)[None, :] < steps[:, None]
+        features = input * mask[:, None, :]
+
+        for layer in self.main[:-self.num_head_layers]:
+            if isinstance(layer, nn.MaxPool1d):
+                features = layer(features)
+                steps = torch.div(steps, 2, rounding_mode='floor') # Pooling windows entirely inside the clip
+            elif isinstance(layer, nn.BatchNorm1d) and layer.training:
+                features = masked_batch_norm(layer, features, mask)
+            else:
+                features = layer(features)
+
+            mask = torch.arange(features.shape[-1], device=features.device)[None, :] < steps[:, None]
+            features = features * mask[:, None, :]
+
+        return features
@@ -0,0 +1,77 @@
+import numpy as np
+
+
+# Names of the signal channels, in the order they are stored in the binary dataset
+SIGNAL_COLUMNS = ['left_position X', 'left_position Y', 'right_position X', 'right_position Y',
+                  'left_speed X', 'left_speed Y', 'right_speed X', 'right_speed Y']
+
+
+# Check if a path points to a binary dataset file
+def is_binary_dataset(path:str) -> bool:
+    '''
+    Checks whether the given path refers to a binary signal dataset (.npz) rather than a CSV file.
+
+    Arguments:
+    - path (str): The path of the dataset file.
+
+    Returns:
+    - bool: True if the path has the binary dataset extension, False otherwise.
+    '''
+    return str(path).lower().endswith('.npz')
+
+# Save the signals into the binary dataset format
+def save_binary_dataset(path:str, signals, videos, resolutions, labels=None, lengths=None) -> None:
+    '''
+    Saves a signal dataset into a typed binary file (uncompressed .npz), so that it can be reloaded
+    without any string parsing.
+
+    The file contains:
+    - 'signals' (float32, n x 8 x T): the signals of each clip, padded with NaN up to the longest clip.
+    - 'lengths' (int32, n): the number of valid frames of each clip.
+    - 'video' (str, n), 'resolution' (int64, n), 'label' (float32, n, NaN if missing).
+    - 'columns' (str, 8): the names of the signal channels.
+
+    Arguments:
+    - path (str): The path of the output .npz file.
+    - signals (np.ndarray): The signals array with shape (n_clips, 8, n_frames).
+    - videos (array-like): The video name of each clip.
+    - resolutions (array-like): The speed time resolution of each clip.
+    - labels (array-like): The label of each clip. Defaults to None (all NaN).
+    - lengths (array-like): The number of valid frames of each clip. Defaults to None (all n_frames).
+
+    Returns:
+    - None: The dataset is written to the given path.
+    '''
+    # Typed arrays of the dataset
+    signals = np.ascontiguousarray(signals, dtype=np.float32)
+    n_clips = signals.shape[0]
+
+    # Default values for the optional fields
+    if labels is None:
+        labels = np.full(n_clips, np.nan)
+    if lengths is None:
+        lengths = np.full(n_clips, signals.shape[-1])
+
+    # Open the file handle directly so that numpy does not append a second extension
+    with open(path, 'wb') as f:
+        np.savez(f,
+                 signals=signals,
+                 lengths=np.asarray(lengths, dtype=np.int32),
+                 video=np.asarray(videos, dtype=str),
+                 resolution=np.asarray(resolutions, dtype=np.int64),
+                 label=np.asarray(labels, dtype=np.float32),
+                 columns=np.asarray(SIGNAL_COLUMNS, dtype=str))
+
+# Load the signals from the binary dataset format
+def load_binary_dataset(path:str) -> dict:
+    '''
+    Loads a signal dataset written by save_binary_dataset.
+
+    Arguments:
+    - path (str): The path of the .npz file.
+
+    Returns:
+    - dict: A dictionary with the keys 'signals', 'lengths', 'video', 'resolution', 'label' and 'columns'.
+    '''
+    with np.load(path, allow_pickle=False) as npz:
+        return {key: npz[key] for key in npz.files}
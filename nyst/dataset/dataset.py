@@ -11,23 +11,33 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from nyst.dataset.signal_augmentation import *
 from nyst.dataset.preprocess_function import *
+from nyst.dataset.binary_dataset import is_binary_dataset, load_binary_dataset
 
 
 
 
 class CustomDataset(Dataset):
-    def __init__(self, new_csv_file='D:/nyst_labelled_videos/merged_data.csv'):
+    def __init__(self, new_csv_file='D:/nyst_labelled_videos/merged_data.csv', variable_length:bool=False):
         
-        # Load the CSV file
-        self.data = pd.read_csv(new_csv_file)
+        # Load the binary dataset (already parsed signals) or the CSV file
+        if is_binary_dataset(new_csv_file):
+            binary_data = load_binary_dataset(new_csv_file)
+            self.data = pd.DataFrame({key: binary_data[key] for key in ['video', 'resolution', 'label']})
+            signals = binary_data['signals']
+            # Remove the NaN padding of the clips shorter than the longest one
+            if (binary_data['lengths'] != signals.shape[-1]).any():
+                signals = [list(signal[:, :length]) for signal, length in zip(signals, binary_data['lengths'])]
+        else:
+            self.data = pd.read_csv(new_csv_file)
+            signals = None
         print('CUSTOMED DATASET LOADED...\n')
         
         # Exctract data into a dictionary
-        self.extr_data = self.exctraction_values(self.data)
+        self.extr_data = self.exctraction_values(self.data, signals)
         print('\n\t ---> Data extraction step COMPLETED\n')
 
-        # Filter the invalid data             
-        self.fil_data, self.invalid_video_info = self.filtering_invalid_data(self.extr_data)
+        # Filter the invalid data (with variable_length the clips are kept whatever their number of frames)
+        self.fil_data, self.invalid_video_info = self.filtering_invalid_data(self.extr_data, frames_video=None if variable_length else 300)
         print('\n\t ---> Filtering invalid data step COMPLETED\n')
 
         # Normalization signals            
@@ -57,7 +67,7 @@ class CustomDataset(Dataset):
         return signal, label
 
     # Extract the input/label info from the csv file
-    def exctraction_values(self, merged_data):
+    def exctraction_values(self, merged_data, signals=None):
         '''
         Preprocesses the merged data to extract relevant features such as signals, resolutions,
         patient information, samples, and labels.
@@ -65,6 +75,8 @@ class CustomDataset(Dataset):
         Arguments:
         - merged_data (pandas.DataFrame): The dataframe containing the merged data. It is expected
         to contain columns related to positions, speeds, video information, resolutions, and labels.
+        - signals (np.ndarray): The already parsed signals (n_samples, 8, n_frames) loaded from a binary dataset.
+        If None, the signals are parsed from the signal columns of merged_data.
 
         Returns:
         - dict: A dictionary containing the extracted features:
@@ -74,14 +86,15 @@ class CustomDataset(Dataset):
             - 'samples': A numpy array with detailed sample information including patient ID, video number, and resolution.
             - 'labels': A numpy array of labels associated with each data entry.
         '''
-        # Extract signaks
-        signals_str = merged_data[['left_position X', 'left_position Y', 
-                            'right_position X', 'right_position Y',
-                            'left_speed X', 'left_speed Y', 
-                            'right_speed X', 'right_speed Y']].values
-        
-        # Convert strings into lists of float
-        signals = [[parse_float_list(signal) for signal in row] for row in signals_str]
+        if signals is None:
+            # Extract signaks
+            signals_str = merged_data[['left_position X', 'left_position Y', 
+                                'right_position X', 'right_position Y',
+                                'left_speed X', 'left_speed Y', 
+                                'right_speed X', 'right_speed Y']].values
+            
+            # Convert strings into lists of float
+            signals = [[parse_float_list(signal) for signal in row] for row in signals_str]
 
         # Resolutions extraction
         resolutions = merged_data['resolution'].to_numpy().reshape(-1, 1)
@@ -112,14 +125,16 @@ class CustomDataset(Dataset):
         }
 
     # Funzione aggiornata per il filtraggio dei dati
-    def filtering_invalid_data(self, dictionary_input:dict, frames_video:int = 300, zero_threshold:float = 0.2):
+    def filtering_invalid_data(self, dictionary_input:dict, frames_video:int = 300, zero_threshold:float = 0.2, min_frames:int = 4):
         '''
         Filters out invalid data/videos based on signal dimensions and zero-speed thresholds, and also removes 
         entries associated with the same patient, video, and clip number.
 
         Arguments:
         - dictionary_input (dict): A dictionary containing the input data.
-        - frames_video (int): The expected number of frames in each signal. Defaults to 300.
+        - frames_video (int): The expected number of frames in each signal. Defaults to 300. If None, clips of any length
+        are accepted as long as all their signals have the same number of frames (at least min_frames).
+        - min_frames (int): The minimum number of frames of a clip when frames_video is None. Defaults to 4.
         - zero_threshold (float): The threshold for filtering out signals with excessive zero speeds. Defaults to 0.2 (20%).
 
         Returns:
@@ -146,7 +161,10 @@ class CustomDataset(Dataset):
             speeds = [parse_float_list(speed) if isinstance(speed, str) else speed for speed in row[4:]]
             
             # Check that the size of the signals meet the threshold
-            dimension_signal = all([len(signal) == frames_video for signal in row])
+            if frames_video is None:
+                dimension_signal = len(set(len(signal) for signal in row)) == 1 and len(row[0]) >= min_frames
+            else:
+                dimension_signal = all([len(signal) == frames_video for signal in row])
             
             # Check whether zero speeds in the list meets the threshold
             zero_exceeds_threshold = any((np.sum(np.array(speed) == 0.0)) / len(speed) > zero_threshold for speed in speeds)
@@ -157,7 +175,9 @@ class CustomDataset(Dataset):
 
                 # Append invalid video info with reason
                 reason = ""
-                if not dimension_signal:
+                if not dimension_signal and frames_video is None:
+                    reason = f"Dimensioni del segnale non valide (segnali di lunghezza diversa o meno di {min_frames} frame)"
+                elif not dimension_signal:
                     reason = f"Dimensioni del segnale non valide (attese {frames_video} frame)"
                 elif zero_exceeds_threshold:
                     reason = f"Velocità zero in più del {zero_threshold*100}% dei frame"
@@ -184,9 +204,12 @@ class CustomDataset(Dataset):
             else:
                 filtered_data[key] = value[valid_indices]
 
-        # Signals list of lists to Multidimensional numpy array
+        # Signals list of lists to Multidimensional numpy array (clips of different lengths are kept as a list of (8, n_frames) arrays)
         try:
-            filtered_data['signals'] = np.array(filtered_data['signals'])
+            if len(set(len(row[0]) for row in filtered_data['signals'])) <= 1:
+                filtered_data['signals'] = np.array(filtered_data['signals'])
+            else:
+                filtered_data['signals'] = [np.array(row, dtype=float) for row in filtered_data['signals']]
         except Exception as e:
             print(f"Error while converting signals to numpy array: {e}")
         
@@ -204,7 +227,23 @@ class CustomDataset(Dataset):
 
         Returns:
         - list of lists: I segnali normalizzati, con la media traslata a zero per ogni feature.
+        Se i campioni hanno lunghezze diverse (lista di array (8, n_frames)) viene restituita una lista con la stessa struttura.
         '''
+        # Campioni di lunghezza diversa: stessa normalizzazione, con la deviazione standard calcolata su tutti i frame
+        if isinstance(signals, list):
+            # Media traslata a zero per ciascuna feature di ciascun campione
+            normalized_signals = [np.array(signal, dtype=float) - np.mean(signal, axis=1, keepdims=True) for signal in signals]
+
+            # Deviazione standard per ciascuna feature considerando tutti i frame di tutti i campioni
+            std_per_column = np.std(np.concatenate(normalized_signals, axis=1), axis=1)
+            if np.any(std_per_column <= 0):
+                raise ValueError(f'Check the std of the {np.flatnonzero(std_per_column <= 0)} column')
+
+            # Salva la deviazione standard per normalizzare i dati in fase di inferenza
+            self.normalization_std = std_per_column
+
+            return [signal / std_per_column[:, None] for signal in normalized_signals]
+
         # Deep copy of signals
         normalized_signals = np.array(copy.deepcopy(signals))
 
@@ -226,6 +265,9 @@ class CustomDataset(Dataset):
         
         # Calcolo delle deviazioni standard per ciascuna feature
         std_per_column = self.calculate_standard_deviation(normalized_signals)
+
+        # Salva la deviazione standard per normalizzare i dati in fase di inferenza
+        self.normalization_std = std_per_column
         
         # Dividi per la deviazione standard calcolata per quella feature
         for idx, std in enumerate(std_per_column):
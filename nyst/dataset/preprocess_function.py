@@ -1,13 +1,173 @@
 import numpy as np 
-import json
 import sys
 import os
-from scipy.interpolate import  splrep, splev, CubicSpline
+from functools import lru_cache
+from scipy.interpolate import splrep, splev, CubicSpline
+from scipy.signal import resample, resample_poly
 
 # Add the 'code' directory to PYTHONPATH
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from nyst.dataset.signal_augmentation import *
+from nyst.dataset.utils_function import parse_signal_column
+from nyst.dataset.binary_dataset import SIGNAL_COLUMNS, save_binary_dataset
+
+# Resampling methods supported by the batched engine
+RESAMPLING_METHODS = ['linear', 'cubic', 'spline', 'polyphase', 'fft']
+
+# Resampling matrix of the linear interpolation methods
+@lru_cache(maxsize=None)
+def resampling_matrix(input_frames:int, frames:int, method:str='cubic', order:int=2) -> np.ndarray:
+    '''
+    Builds the (frames x input_frames) matrix that maps a signal of input_frames samples to the resampled
+    signal of frames samples. Linear, natural cubic spline and spline interpolation on a fixed grid are
+    linear in the signal values, so the matrix is computed once per length (interpolating the identity)
+    and cached; resampling a whole block of signals is then a single matrix product.
+
+    Arguments:
+    - input_frames (int): The number of frames of the original signals.
+    - frames (int): The target number of frames.
+    - method (str): One of 'linear', 'cubic' (natural cubic spline) or 'spline' (B-spline of the given order).
+    - order (int): The order of the spline when method is 'spline'.
+
+    Returns:
+    - np.ndarray: The resampling matrix with shape (frames, input_frames).
+    '''
+    # Evenly spaced values between 0 and 1 for the original and the target signals
+    x_original = np.linspace(0, 1, input_frames)
+    x_new = np.linspace(0, 1, frames)
+
+    # Identity signals: the interpolation of each one is a column of the matrix
+    identity = np.eye(input_frames)
+
+    if method == 'linear':
+        matrix = np.stack([np.interp(x_new, x_original, basis) for basis in identity], axis=1)
+    elif method == 'cubic':
+        # Cubic spline with natural boundary conditions evaluated on all the identity signals at once
+        matrix = CubicSpline(x_original, identity, axis=0, bc_type='natural')(x_new)
+    elif method == 'spline':
+        # Spline knots only depend on the grid (s=0), so the spline is linear in the signal values
+        matrix = np.stack([splev(x_new, splrep(x_original, basis, k=order)) for basis in identity], axis=1)
+    else:
+        raise ValueError(f'Invalid linear resampling method: {method}')
+
+    return matrix
+
+# Resample a block of signals sharing the same length
+def resample_block(block:np.ndarray, frames:int=300, method:str='cubic', order:int=2) -> np.ndarray:
+    '''
+    Resamples a block of signals with the same number of frames along the last axis in a single vectorized call.
+
+    Arguments:
+    - block (np.ndarray): The signals with shape (..., input_frames), e.g. (n_clips, 8, input_frames).
+    - frames (int): The target number of frames. Default is 300.
+    - method (str): The resampling method, one of RESAMPLING_METHODS. Default is 'cubic'.
+        - 'linear', 'cubic', 'spline': interpolation over [0, 1] (first and last samples are kept).
+        - 'polyphase': polyphase FIR filtering (scipy.signal.resample_poly), anti-aliased when downsampling.
+        - 'fft': Fourier resampling (scipy.signal.resample), which assumes periodic signals.
+    - order (int): The order of the spline when method is 'spline'. Default is 2.
+
+    Returns:
+    - np.ndarray: The resampled signals with shape (..., frames).
+    '''
+    input_frames = block.shape[-1]
+
+    # Nothing to do if the signals already have the target length
+    if input_frames == frames:
+        return block.copy()
+
+    if method in ['linear', 'cubic', 'spline']:
+        return block @ resampling_matrix(input_frames, frames, method, order).T
+    elif method == 'polyphase':
+        # Reduce the resampling ratio to the smallest up/down factors
+        gcd = np.gcd(input_frames, frames)
+        return resample_poly(block, frames // gcd, input_frames // gcd, axis=-1)[..., :frames]
+    elif method == 'fft':
+        return resample(block, frames, axis=-1)
+    else:
+        raise ValueError(f'Invalid resampling method: {method}. Choose one of {RESAMPLING_METHODS}')
+
+# Resample signals of different lengths grouping them by length
+def resample_signals(values:np.ndarray, lengths:np.ndarray, frames:int=300, method:str='cubic', order:int=2) -> tuple:
+    '''
+    Resamples a set of signals of different lengths to the target number of frames. The signals are grouped by
+    their original length and every group is resampled as a single (n_signals, input_frames) block.
+
+    Arguments:
+    - values (np.ndarray): The flat array with the values of all the signals, one after the other.
+    - lengths (np.ndarray): The number of frames of each signal.
+    - frames (int): The target number of frames. Default is 300.
+    - method (str): The resampling method, one of RESAMPLING_METHODS. Default is 'cubic'.
+    - order (int): The order of the spline when method is 'spline'. Default is 2.
+
+    Returns:
+    - tuple:
+        - np.ndarray: The resampled signals with shape (n_signals, frames). Signals that are too short to be
+          resampled are filled with NaN.
+        - np.ndarray: A boolean array with True for the signals that have been resampled (or already had the target length).
+    '''
+    lengths = np.asarray(lengths)
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    output = np.full((len(lengths), frames), np.nan)
+    valid = np.zeros(len(lengths), dtype=bool)
+
+    # Minimum number of frames required by the interpolation
+    min_frames = order + 1 if method == 'spline' else 2
+
+    # Process all the signals with the same original length together
+    for input_frames in np.unique(lengths):
+        if input_frames < min_frames and input_frames != frames:
+            continue
+
+        # Gather the block of signals with this length
+        group = np.flatnonzero(lengths == input_frames)
+        block = values[offsets[group, None] + np.arange(input_frames)]
+
+        output[group] = resample_block(block, frames, method, order)
+        valid[group] = True
+
+    return output, valid
+
+# Resample all the signal columns of a DataFrame
+def resample_dataframe(data, frames:int=300, method:str='cubic', order:int=2) -> tuple:
+    '''
+    Parses and resamples all the signal columns of the DataFrame to the target number of frames.
+
+    Arguments:
+    - data (pandas.DataFrame): The input DataFrame containing the signal columns.
+    - frames (int): The target number of frames. Default is 300.
+    - method (str): The resampling method, one of RESAMPLING_METHODS. Default is 'cubic'.
+    - order (int): The order of the spline when method is 'spline'. Default is 2.
+
+    Returns:
+    - tuple:
+        - np.ndarray: The resampled signals with shape (n_clips, 8, frames).
+        - np.ndarray: A boolean array (n_clips, 8) with True for the signals that have been resampled.
+    '''
+    # Parse all the columns and resample every signal of every column in a single pass
+    parsed = [parse_signal_column(data[column]) for column in SIGNAL_COLUMNS]
+    values = np.concatenate([column_values for column_values, _ in parsed])
+    lengths = np.concatenate([column_lengths for _, column_lengths in parsed])
+
+    signals, valid = resample_signals(values, lengths, frames, method, order)
+
+    # Column-major order of the signals: (8, n_clips) -> (n_clips, 8)
+    n_clips = len(data)
+    signals = signals.reshape(len(SIGNAL_COLUMNS), n_clips, frames).transpose(1, 0, 2)
+    valid = valid.reshape(len(SIGNAL_COLUMNS), n_clips).T
+
+    return signals, valid
+
+# Write the resampled signals back into the DataFrame
+def _replace_signal_columns(data, signals:np.ndarray, valid:np.ndarray):
+    '''
+    Replaces the signal columns of the DataFrame with the resampled signals, leaving unchanged the signals that could not be resampled.
+    '''
+    for j, column in enumerate(SIGNAL_COLUMNS):
+        original = data[column].tolist()
+        data[column] = [signals[i, j] if valid[i, j] else original[i] for i in range(len(data))]
+
+    return data
 
 # Preprocess function using spline interpolation
 def preprocess_interpolation(data, frames=300, order=2):
@@ -24,28 +184,10 @@ def preprocess_interpolation(data, frames=300, order=2):
     Returns:
     - pandas.DataFrame: The preprocessed DataFrame with the interpolated signals.
     '''
-    # Nested function to interpolate a single signal
-    def interpolate_signal(signal, target_frames=frames, interpolation_order=order):
-        # Create an array of evenly spaced values between 0 and 1 for the original signal
-        x_original = np.linspace(0, 1, len(signal))
+    # Resample all the signals with the batched engine
+    signals, valid = resample_dataframe(data, frames, method='spline', order=order)
 
-        # Create an array of evenly spaced values between 0 and 1 for the target number of frames
-        x_new = np.linspace(0, 1, target_frames)
-
-        # Create a spline representation of the original signal using the specified interpolation order
-        tck = splrep(x_original, signal, k=interpolation_order)
-
-        # Evaluate the spline at the new x-values to get the interpolated signal
-        return splev(x_new, tck)
-
-    # Iterate through each signal column in the DataFrame
-    for column in ['left_position X', 'left_position Y', 'right_position X', 'right_position Y',
-                'left_speed X', 'left_speed Y', 'right_speed X', 'right_speed Y']:
-        
-        # Apply the interpolation function to each signal in the column
-        data[column] = data[column].apply(lambda x: interpolate_signal(json.loads(x)) if len(json.loads(x)) != frames else x)
-    
-    return data   # Return the DataFrame with the interpolated signals
+    return _replace_signal_columns(data, signals, valid)   # Return the DataFrame with the interpolated signals
 
 # Cubic Interpolation for Signal Data
 def cubic_interpolation(data, frames=300):
@@ -61,26 +203,34 @@ def cubic_interpolation(data, frames=300):
     Returns:
     - pandas.DataFrame: The preprocessed DataFrame with the interpolated signals.
     '''
-    
-    # Nested function to interpolate a single signal using cubic spline interpolation
-    def interpolate_signal(signal, target_frames=frames):
-        # Create an array of evenly spaced values between 0 and 1 for the original signal
-        x_original = np.linspace(0, 1, len(signal))  
-
-        # Create an array of evenly spaced values between 0 and 1 for the target number of frames
-        x_new = np.linspace(0, 1, target_frames)   
-
-        # # Generate a cubic spline with natural boundary conditions (smooth at boundaries)  
-        cubic_spline = CubicSpline(x_original, signal, bc_type='natural')  
-        
-        return cubic_spline(x_new) # Evaluate the cubic spline at the new x-values to get the interpolated signal
-
-    # Iterate through each signal column in the DataFrame
-    for column in ['left_position X', 'left_position Y', 'right_position X', 'right_position Y',
-                   'left_speed X', 'left_speed Y', 'right_speed X', 'right_speed Y']:
-        
-        # Apply the interpolation function to each signal in the column
-        data[column] = data[column].apply(lambda x: interpolate_signal(json.loads(x)) if len(json.loads(x)) != frames else x)
-    
-    return data  # Return the DataFrame with the interpolated signals
+    # Resample all the signals with the batched engine (natural cubic spline)
+    signals, valid = resample_dataframe(data, frames, method='cubic')
+
+    return _replace_signal_columns(data, signals, valid)  # Return the DataFrame with the interpolated signals
+
+# Resample the signals and save them directly in the binary dataset format
+def resample_to_binary(data, output_file:str, frames:int=300, method:str='cubic', order:int=2) -> list:
+    '''
+    Resamples all the signals of the DataFrame and writes them straight into the binary dataset format
+    (see nyst.dataset.binary_dataset), skipping the CSV serialization of the resampled lists.
+
+    Arguments:
+    - data (pandas.DataFrame): The input DataFrame containing the 'video', 'resolution', 'label' and signal columns.
+    - output_file (str): The path of the output .npz file.
+    - frames (int): The target number of frames. Default is 300.
+    - method (str): The resampling method, one of RESAMPLING_METHODS. Default is 'cubic'.
+    - order (int): The order of the spline when method is 'spline'. Default is 2.
+
+    Returns:
+    - list: The videos of the clips that have been discarded because at least one signal could not be resampled.
+    '''
+    signals, valid = resample_dataframe(data, frames, method, order)
+
+    # Keep only the clips with all the signals resampled
+    keep = valid.all(axis=1)
+    discarded = data['video'][~keep].tolist()
+
+    labels = data['label'][keep] if 'label' in data else None
+    save_binary_dataset(output_file, signals[keep], data['video'][keep], data['resolution'][keep], labels)
 
+    return discarded
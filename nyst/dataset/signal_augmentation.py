@@ -7,6 +7,7 @@ import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from nyst.dataset.utils_function import *
+from nyst.dataset.binary_dataset import load_binary_dataset, save_binary_dataset
 
 # Function to invert signals directions to augment data 
 def augment_data(data, csv_file):
@@ -100,3 +101,28 @@ def augment_data(data, csv_file):
 
 
         
+
+# Function to invert signals directions of a binary dataset
+def augment_binary_data(binary_file):
+    """
+    Augments a binary dataset (see nyst.dataset.binary_dataset) by appending the flipped copy of every clip,
+    i.e. the same operation of augment_data applied directly to the signals array.
+
+    Args:
+        binary_file (str): The path of the .npz dataset to augment in place.
+
+    Returns:
+        None: The augmented dataset is written back to the same file.
+    """
+    data = load_binary_dataset(binary_file)
+
+    # Modify the video names by appending '-r' before the file extension
+    flipped_videos = [f"{base_name}-r{ext}" for base_name, ext in map(os.path.splitext, data['video'])]
+
+    # Append the negated signals after the original ones
+    save_binary_dataset(binary_file,
+                        np.concatenate([data['signals'], -data['signals']]),
+                        np.concatenate([data['video'], flipped_videos]),
+                        np.concatenate([data['resolution'], data['resolution']]),
+                        np.concatenate([data['label'], data['label']]),
+                        np.concatenate([data['lengths'], data['lengths']]))
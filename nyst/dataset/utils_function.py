@@ -1,7 +1,15 @@
 import numpy as np
 import re
 import json
+import warnings
 import pandas as pd
+import os
+
+from nyst.dataset.binary_dataset import SIGNAL_COLUMNS, is_binary_dataset, save_binary_dataset
+
+
+# Characters separating the values of a signal stored as a string
+_SIGNAL_SEPARATORS = str.maketrans(',[]()', '     ')
 
 
 # Function to replace spaces within lists with commas
@@ -78,79 +86,282 @@ def parse_float_list(string_value):
     else:
         print(f"Warning: Expected string but got {type(string_value)}. Returning empty list.")
         return []
-    
+
+# Converts a whole column of list-like signals into a flat float array in a single pass
+def parse_signal_column(column):
+    """
+    Parses all the cells of a signal column at once. String cells (e.g. '[1.0, 2.0, nan]' or '[1. 2. nan]')
+    are joined and tokenized in one pass instead of calling json.loads on every cell, while cells that are
+    already lists or NumPy arrays are used as they are.
+
+    Args:
+        column (pandas.Series or list): The column cells, as strings, lists or NumPy arrays.
+
+    Returns:
+        tuple:
+            - np.ndarray: The flat float64 array with the values of all the cells, one after the other.
+            - np.ndarray: The number of values of each cell (int64), to split the flat array back into cells.
+
+    Raises:
+        ValueError: If a cell contains a token that is not a number.
+    """
+    cells = list(column)
+    lengths = np.zeros(len(cells), dtype=np.int64)
+    chunks = []
+
+    # Indices of the string cells, which are tokenized together
+    str_idx = [i for i, cell in enumerate(cells) if isinstance(cell, str)]
+
+    if len(str_idx) > 0:
+        # Join all the string cells using a delimiter which never appears in the signals
+        joined = ';'.join(cells[i] for i in str_idx)
+        # Drop any numpy scalar wrapper such as 'np.float64(...)'
+        if 'np.' in joined:
+            joined = re.sub(r'np\.\w+\(', ' ', joined)
+        # Missing values written as None or null become nan, brackets and commas become spaces
+        joined = joined.replace('None', 'nan').replace('null', 'nan').translate(_SIGNAL_SEPARATORS)
+
+        # Count the tokens of each cell on the raw bytes: a token starts where a non-space follows a space
+        raw = np.frombuffer(joined.encode(), dtype=np.uint8)
+        is_delimiter = raw == ord(';')
+        in_token = (raw > ord(' ')) & ~is_delimiter
+        token_start = np.flatnonzero(in_token & ~np.concatenate(([False], in_token[:-1])))
+        cell_end = np.append(np.flatnonzero(is_delimiter), raw.size)
+        lengths[str_idx] = np.diff(np.searchsorted(token_start, cell_end), prepend=0)
+
+        # Convert all the tokens with a single call
+        str_values = np.zeros(0)
+        if lengths[str_idx].sum() > 0:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', DeprecationWarning)
+                str_values = np.fromstring(joined.replace(';', ' '), sep=' ')
+
+        # A token that is not a number stops the conversion early
+        if str_values.size != lengths[str_idx].sum():
+            raise ValueError('Signal column contains non numeric values')
+    else:
+        str_values = np.zeros(0)
+
+    # Reassemble the values in the original cell order
+    str_offsets = np.concatenate(([0], np.cumsum(lengths[str_idx])))
+    str_pos = {i: k for k, i in enumerate(str_idx)}
+    for i, cell in enumerate(cells):
+        if i in str_pos:
+            k = str_pos[i]
+            chunks.append(str_values[str_offsets[k]:str_offsets[k + 1]])
+        else:
+            # Missing cells (None or a NaN scalar) are treated as empty signals
+            missing = cell is None or (np.isscalar(cell) and pd.isna(cell))
+            values = np.asarray([] if missing else cell, dtype=np.float64).ravel()
+            lengths[i] = values.size
+            chunks.append(values)
+
+    values = np.concatenate(chunks) if chunks else np.zeros(0)
+
+    return values, lengths
+
+# Locates the malformed cells of a signal column
+def _find_malformed_cells(cells, offset=0):
+    """
+    Splits the cells in halves until the cells that cannot be parsed are isolated, so that a few malformed
+    cells only cost a logarithmic number of bulk parses.
+
+    Returns:
+        list: The (index, reason) tuples of the malformed cells.
+    """
+    try:
+        parse_signal_column(cells)
+        return []
+    except ValueError as e:
+        if len(cells) == 1:
+            return [(offset, str(e))]
+
+    half = len(cells) // 2
+    return _find_malformed_cells(cells[:half], offset) + _find_malformed_cells(cells[half:], offset + half)
+
+# Parses all the signal columns of a DataFrame, isolating the malformed rows
+def normalize_signal_columns(data, columns=SIGNAL_COLUMNS):
+    """
+    Parses all the signal columns of the dataset at once with parse_signal_column. When a column contains
+    malformed cells, only that column falls back to a per-cell pass to locate them; the rows with at least
+    one malformed signal are excluded and reported in a side table.
+
+    Args:
+        data (pandas.DataFrame): The dataset containing the signal columns (and the 'video' column).
+        columns (list): The names of the signal columns to parse. Defaults to SIGNAL_COLUMNS.
+
+    Returns:
+        tuple:
+            - np.ndarray: A boolean mask with True for the valid rows of the dataset.
+            - dict: For each column, the tuple (values, lengths) of the valid rows as returned by parse_signal_column.
+            - pandas.DataFrame: The malformed cells, with columns 'video', 'column' and 'reason'.
+    """
+    valid = np.ones(len(data), dtype=bool)
+    malformed = []
+    parsed = {}
+
+    for column in columns:
+        try:
+            parsed[column] = parse_signal_column(data[column])
+        except ValueError:
+            # Locate the malformed cells of the column by bisection
+            for i, reason in _find_malformed_cells(list(data[column])):
+                valid[i] = False
+                malformed.append({'video': data['video'].iloc[i], 'column': column, 'reason': reason})
+
+    # Parse again only the valid rows if some rows have been excluded
+    if not valid.all():
+        valid_data = data[valid]
+        parsed = {column: parse_signal_column(valid_data[column]) for column in columns}
+
+    return valid, parsed, pd.DataFrame(malformed, columns=['video', 'column', 'reason'])
+
 # Function to save data into a csv
 def save_csv(data, csv_file):
     """
-    Processes and saves the data into a CSV file. The function replaces spaces in list representations with commas,
-    cleans up multiple commas, converts strings into lists of floats, and saves the modified data.
+    Processes and saves the data into a CSV file. All the signal columns are parsed in bulk (spaces and multiple
+    commas are handled by the tokenizer), the malformed rows are excluded and written in a side table
+    ('<csv_file>_malformed.csv'), and the cleaned signals are saved as lists of floats.
+    If csv_file has the .npz extension the cleaned data is saved in the binary dataset format instead.
 
     Args:
         data (pandas.DataFrame): The dataset containing the signal data to be processed.
-        csv_file (str): The path to the CSV file where the processed data will be saved.
+        csv_file (str): The path to the CSV (or .npz) file where the processed data will be saved.
 
     Returns:
-        None: The function saves the processed data to a CSV file without returning anything.
+        pandas.DataFrame: The malformed cells that have been excluded, with columns 'video', 'column' and 'reason'.
     """
-    new_dataset = []
-    
-    # Loop through each row in the data
-    for _, row in data.iterrows():
-        try:
-            # Replace spaces in lists with commas
-            row['left_position X'] = replace_spaces_with_commas(row['left_position X'])
-            row['left_position Y'] = replace_spaces_with_commas(row['left_position Y'])
-            row['right_position X'] = replace_spaces_with_commas(row['right_position X'])
-            row['right_position Y'] = replace_spaces_with_commas(row['right_position Y'])
-            row['left_speed X'] = replace_spaces_with_commas(row['left_speed X'])
-            row['left_speed Y'] = replace_spaces_with_commas(row['left_speed Y'])
-            row['right_speed X'] = replace_spaces_with_commas(row['right_speed X'])
-            row['right_speed Y'] = replace_spaces_with_commas(row['right_speed Y'])
-
-            # Replace multiple commas
-            row['left_position X'] = clean_comma_issues(row['left_position X'])
-            row['left_position Y'] = clean_comma_issues(row['left_position Y'])
-            row['right_position X'] = clean_comma_issues(row['right_position X'])
-            row['right_position Y'] = clean_comma_issues(row['right_position Y'])
-            row['left_speed X'] = clean_comma_issues(row['left_speed X'])
-            row['left_speed Y'] = clean_comma_issues(row['left_speed Y'])
-            row['right_speed X'] = clean_comma_issues(row['right_speed X'])
-            row['right_speed Y'] = clean_comma_issues(row['right_speed Y'])
-
-            # Convert strings to Python lists of floats
-            left_pos_x = np.array(parse_float_list(row['left_position X']))
-            left_pos_y = np.array(parse_float_list(row['left_position Y']))
-            right_pos_x = np.array(parse_float_list(row['right_position X']))
-            right_pos_y = np.array(parse_float_list(row['right_position Y']))
-            left_speed_x = np.array(parse_float_list(row['left_speed X']))
-            left_speed_y = np.array(parse_float_list(row['left_speed Y']))
-            right_speed_x = np.array(parse_float_list(row['right_speed X']))
-            right_speed_y = np.array(parse_float_list(row['right_speed Y']))
-
-            # Create a new row with the processed signals
-            flipped_row = {
-                'video': row['video'],
-                'resolution': row['resolution'],
-                'left_position X': left_pos_x.tolist(),
-                'left_position Y': left_pos_y.tolist(),
-                'right_position X': right_pos_x.tolist(),
-                'right_position Y': right_pos_y.tolist(),
-                'left_speed X': left_speed_x.tolist(),
-                'left_speed Y': left_speed_y.tolist(),
-                'right_speed X': right_speed_x.tolist(),
-                'right_speed Y': right_speed_y.tolist(),
-                'label': row['label']
-            }
-
-            # Append the processed row to the list 
-            new_dataset.append(flipped_row)
-
-        except (ValueError, SyntaxError) as e:
-            print(f"Error processing row {row['video']}: {e}")
-            continue 
-
-    # Convert the list of processed rows into a DataFrame
-    new_dataset_df = pd.DataFrame(new_dataset)
+    # Parse and clean all the signal columns
+    valid, parsed, malformed = normalize_signal_columns(data)
+    valid_data = data[valid]
+
+    # Report the malformed rows in a side table
+    if len(malformed) > 0:
+        malformed_file = os.path.splitext(csv_file)[0] + '_malformed.csv'
+        malformed.to_csv(malformed_file, index=False)
+        print(f"{malformed['video'].nunique()} malformed rows excluded, see {malformed_file}")
+
+    # Save the cleaned signals in the binary dataset format
+    if is_binary_dataset(csv_file):
+        lengths = np.stack([parsed[column][1] for column in SIGNAL_COLUMNS], axis=1)
+        signals = np.full((len(valid_data), len(SIGNAL_COLUMNS), lengths.max(initial=0)), np.nan)
+
+        # Scatter the flat values of each column into the padded signals array
+        frame_mask = np.arange(signals.shape[-1]) < lengths[:, :, None]
+        for j, column in enumerate(SIGNAL_COLUMNS):
+            signals[:, j][frame_mask[:, j]] = parsed[column][0]
+
+        labels = valid_data['label'] if 'label' in valid_data else None
+        save_binary_dataset(csv_file, signals, valid_data['video'], valid_data['resolution'], labels, lengths.min(axis=1, initial=signals.shape[-1]))
+        return malformed
+
+    # Create the new dataset with the processed signals (no split points, and no rows, if every row is malformed)
+    new_dataset_df = pd.DataFrame({'video': valid_data['video'].to_numpy(), 'resolution': valid_data['resolution'].to_numpy()})
+    for column in SIGNAL_COLUMNS:
+        values, lengths = parsed[column]
+        new_dataset_df[column] = [str(signal.tolist()) for signal in np.split(values, np.cumsum(lengths)[:-1])] if len(valid_data) > 0 else []
+    if 'label' in valid_data:
+        new_dataset_df['label'] = valid_data['label'].to_numpy()
 
     # Save the processed data to the specified CSV file
     new_dataset_df.to_csv(csv_file, mode='w', index=False)
+
+    return malformed
+
+# Path of the normalization statistics saved next to a model
+def normalization_stats_path(model_path):
+    """
+    Returns the path of the normalization statistics file associated with a model checkpoint.
+
+    Args:
+        model_path (str): The path of the model weights (e.g. best_model.pth).
+
+    Returns:
+        str: The path of 'normalization_stats.json' in the same folder of the model.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(model_path)), 'normalization_stats.json')
+
+# Save the training-time normalization statistics
+def save_normalization_stats(stats_file, std_per_column, columns=SIGNAL_COLUMNS):
+    """
+    Saves the per-feature standard deviations computed on the training set, needed to normalize new clips in the same way.
+
+    Args:
+        stats_file (str): The path of the JSON file.
+        std_per_column (array-like): The standard deviation of each feature (after the per-clip mean removal).
+        columns (list): The names of the features. Default is SIGNAL_COLUMNS.
+    """
+    with open(stats_file, 'w') as f:
+        json.dump({'columns': list(columns), 'std': [float(std) for std in std_per_column]}, f, indent=4)
+
+# Load the training-time normalization statistics
+def load_normalization_stats(stats_file):
+    """
+    Loads the per-feature standard deviations saved by save_normalization_stats.
+
+    Args:
+        stats_file (str): The path of the JSON file.
+
+    Returns:
+        numpy.ndarray: The standard deviation of each feature, with shape (n_features,).
+    """
+    with open(stats_file, 'r') as f:
+        return np.array(json.load(f)['std'], dtype=float)
+
+# Normalize new clips with the training-time statistics
+def apply_normalization_stats(signals, std_per_column):
+    """
+    Normalizes the clips as CustomDataset.normalization_signals does, but with the standard deviations of the training set:
+    the mean of each feature is removed within each clip and the result is divided by the training standard deviation.
+
+    Args:
+        signals (numpy.ndarray): The clips with shape (n_clips, n_features, n_frames).
+        std_per_column (numpy.ndarray): The training standard deviation of each feature.
+
+    Returns:
+        numpy.ndarray: The normalized clips (float32), with the same shape of signals.
+    """
+    signals = np.asarray(signals, dtype=np.float32)
+    centred = signals - signals.mean(axis=-1, keepdims=True)
+    return centred / np.asarray(std_per_column, dtype=np.float32)[:, None]
+
+# Path of the held-out patients file of a model
+def holdout_patients_path(model_path):
+    """
+    Returns the path of the held-out patients file associated with a model checkpoint.
+
+    Args:
+        model_path (str): The path of the model weights (e.g. best_model.pth).
+
+    Returns:
+        str: The path of 'holdout_patients.json' in the same folder of the model.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(model_path)), 'holdout_patients.json')
+
+# Save the patients excluded from the training
+def save_holdout_patients(holdout_file, patients):
+    """
+    Saves the patients whose clips have been excluded from the training (and from the cross-validation) of a model.
+
+    Args:
+        holdout_file (str): The path of the JSON file.
+        patients (list): The IDs of the held-out patients (empty if every patient has been used).
+    """
+    with open(holdout_file, 'w') as f:
+        json.dump({'patients': [str(patient) for patient in patients]}, f, indent=4)
+
+# Load the patients excluded from the training
+def load_holdout_patients(holdout_file):
+    """
+    Loads the held-out patients saved by save_holdout_patients.
+
+    Args:
+        holdout_file (str): The path of the JSON file.
+
+    Returns:
+        list: The IDs of the held-out patients (empty if the file does not exist).
+    """
+    if not os.path.exists(holdout_file):
+        return []
+    with open(holdout_file, 'r') as f:
+        return json.load(f)['patients']
@@ -0,0 +1,102 @@
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader, Sampler, Subset
+
+
+class VariableLengthDataset(Dataset):
+    '''
+    Dataset of clips with a different number of frames. Each item is the tuple (signal, length, label), where
+    signal is a float32 tensor (8, length); batches are built by pad_collate.
+
+    Attributes:
+    - signals: The list of signals, each one with shape (8, n_frames).
+    - lengths: The number of frames of each clip.
+    - labels: The labels tensor with shape (n_samples, 1).
+    '''
+    def __init__(self, signals, labels):
+        self.signals = [torch.as_tensor(np.asarray(signal, dtype=np.float32)) for signal in signals]
+        self.lengths = np.array([signal.shape[-1] for signal in self.signals])
+        self.labels = torch.as_tensor(np.asarray(labels, dtype=np.float32)).reshape(-1, 1)
+
+    # Return the number of samples in the dataset
+    def __len__(self):
+        return len(self.signals)
+
+    # Return the signal, its length and the label
+    def __getitem__(self, idx):
+        return self.signals[idx], self.lengths[idx], self.labels[idx]
+
+
+# Pad the clips of a batch to the longest one
+def pad_collate(batch):
+    '''
+    Collates a list of (signal, length, label) items into a zero-padded batch.
+
+    Arguments:
+    - batch (list): The items returned by VariableLengthDataset.
+
+    Returns:
+    - tuple:
+        - torch.Tensor: The padded signals with shape (batch_size, 8, max_length).
+        - torch.Tensor: The number of valid frames of each clip (int64).
+        - torch.Tensor: The labels with shape (batch_size, 1).
+    '''
+    signals, lengths, labels = zip(*batch)
+    lengths = torch.as_tensor(np.array(lengths), dtype=torch.long)
+
+    # Copy each clip at the beginning of the padded batch
+    inputs = torch.zeros(len(signals), signals[0].shape[0], int(lengths.max()))
+    for i, signal in enumerate(signals):
+        inputs[i, :, :signal.shape[-1]] = signal
+
+    return inputs, lengths, torch.stack(labels)
+
+
+class LengthBucketBatchSampler(Sampler):
+    '''
+    Batch sampler grouping clips with similar lengths, so that little padding is needed in each batch.
+    The indices are sorted by length and split into batches; the order of the batches (and of the clips
+    with the same length) is shuffled at every epoch if shuffle is True.
+    '''
+    def __init__(self, lengths, batch_size:int, shuffle:bool=True):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def __iter__(self):
+        # Random tie-breaking between clips of the same length, then stable sort by length
+        order = np.random.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        order = order[np.argsort(self.lengths[order], kind='stable')]
+
+        batches = [order[i:i + self.batch_size].tolist() for i in range(0, len(order), self.batch_size)]
+        if self.shuffle:
+            batches = [batches[i] for i in np.random.permutation(len(batches))]
+
+        return iter(batches)
+
+    def __len__(self):
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+
+# Create the data loader of a subset of a dataset
+def make_loader(dataset, indices, batch_size:int, shuffle:bool=False) -> DataLoader:
+    '''
+    Creates the DataLoader of the given subset, using length-bucketed batches and padding for a
+    VariableLengthDataset and plain batches for any other dataset (e.g. a TensorDataset).
+
+    Arguments:
+    - dataset (Dataset): The full dataset.
+    - indices (array-like): The indices of the subset.
+    - batch_size (int): The batch size.
+    - shuffle (bool): Whether to shuffle the samples at every epoch. Default is False.
+
+    Returns:
+    - DataLoader: The data loader of the subset.
+    '''
+    subset = Subset(dataset, indices)
+
+    if isinstance(dataset, VariableLengthDataset):
+        sampler = LengthBucketBatchSampler(dataset.lengths[np.asarray(indices)], batch_size, shuffle)
+        return DataLoader(subset, batch_sampler=sampler, collate_fn=pad_collate)
+
+    return DataLoader(subset, batch_size=batch_size, shuffle=shuffle)
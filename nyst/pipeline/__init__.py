@@ -1,5 +1,6 @@
 r"""init file for pipeline package."""
 
 from .first_pipeline import FirstPipeline
+from .server import FirstPipelineServer, FirstPipelineClient, connect_pipeline
 
-__all__ = ["FirstPipeline"]
\ No newline at end of file
+__all__ = ["FirstPipeline", "FirstPipelineServer", "FirstPipelineClient", "connect_pipeline"]
\ No newline at end of file
@@ -8,7 +8,7 @@ import traceback
 # Add the 'code' directory to the PYTHONPATH
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from nyst.roi import FirstRegionSelector, FirstEyeRoiDetector, FirstEyeRoiSegmenter, SegmenterThreshold
+from nyst.roi import FirstRegionSelector, FirstEyeRoiDetector, FirstEyeRoiSegmenter, SegmenterThreshold, mask_eye_frame
 from nyst.utils import FirstLatch
 from nyst.pupil import ThresholdingPupilDetector
 from nyst.analysis import FirstSpeedExtractor
@@ -16,19 +16,22 @@ from nyst.visualization import FirstFrameAnnotator
 from nyst.preprocessing import PreprocessingSignalsVideos
 
 class FirstPipeline:
-    def __init__(self):
+    def __init__(self, segmenter_input_sizes:tuple=None, motion_gate=None):
+        # segmenter_input_sizes: input size buckets of the segmenters (e.g. nyst.roi.INPUT_SIZE_BUCKETS), None for the fixed 448x448 input
+        # motion_gate: optional nyst.roi.SegmentationGate, reuses the masks of the previous frame when the eye crop has not changed
         self.region_selector = FirstRegionSelector()
         self.eye_roi_detector = FirstEyeRoiDetector("/repo/porri/nyst/yolo_models/best_yolo11m.pt")
         self.left_eye_roi_latch = FirstLatch()
         self.right_eye_roi_latch = FirstLatch()
         self.left_eye_center_latch = FirstLatch()
         self.right_eye_center_latch = FirstLatch()
-        self.eye_roi_segmenter = FirstEyeRoiSegmenter('/repo/porri/model.h5')
-        self.eye_segmenter_threshold = SegmenterThreshold('/repo/porri/eyes_seg_threshold.h5')
+        self.eye_roi_segmenter = FirstEyeRoiSegmenter('/repo/porri/model.h5', segmenter_input_sizes)
+        self.eye_segmenter_threshold = SegmenterThreshold('/repo/porri/eyes_seg_threshold.h5', segmenter_input_sizes)
         self.pupil_detector = ThresholdingPupilDetector(threshold=50)
         self.preprocess = PreprocessingSignalsVideos()
         self.frame_annotator = FirstFrameAnnotator()
         self.speed_extractor = FirstSpeedExtractor()
+        self.motion_gate = motion_gate
         
     def apply(self, frame, count_from_lastRoiupd:int, count:int, threshold:int=30, update_roi:bool=True) -> tuple:
         '''
@@ -114,16 +117,32 @@ class FirstPipeline:
         # cv2.imshow('Left eye box',left_eye_frame)
         # cv2.imshow('Right eye box',right_eye_frame)
        
-        # Apply segmentation to the eye frames ROI
-        left_eye_frame = self.eye_roi_segmenter.apply(left_eye_frame_roi)
-        right_eye_frame = self.eye_roi_segmenter.apply(right_eye_frame_roi)
-        # Show the segmented eye of the frames
-        # cv2.imshow('Left eye segmented',left_eye_frame)
-        # cv2.imshow('Right eye segmented',right_eye_frame)
-
-        # Apply segmentation for threshold to the eye frames ROI
-        left_relative_threshold_frame,_ = self.eye_segmenter_threshold.apply(left_eye_frame_roi)
-        right_relative_threshold_frame,_ = self.eye_segmenter_threshold.apply(right_eye_frame_roi)
+        # Motion gate: reuse the label masks of the previous frame for the eyes whose crop has not changed
+        eye_rois = {"l": left_eye_roi, "r": right_eye_roi}
+        eye_frames_roi = {"l": left_eye_frame_roi, "r": right_eye_frame_roi}
+        reused = {eye: self.motion_gate.reuse(eye, frame, eye_rois[eye], count) if self.motion_gate is not None else None for eye in eye_rois}
+        to_segment = [eye for eye in eye_rois if reused[eye] is None]
+
+        # Reused masks applied to the pixels of the current crop (only the segmentation is skipped)
+        segmented = {eye: (mask_eye_frame(eye_frames_roi[eye], masks[0]), masks[1]) for eye, masks in reused.items() if masks is not None}
+
+        if to_segment:
+            # Apply segmentation to the eye frames ROI (the eyes to segment in one forward pass)
+            eye_frames = self.eye_roi_segmenter.apply_batch([eye_frames_roi[eye] for eye in to_segment], return_masks=True)
+            # Show the segmented eye of the frames
+            # cv2.imshow('Left eye segmented',left_eye_frame)
+            # cv2.imshow('Right eye segmented',right_eye_frame)
+
+            # Apply segmentation for threshold to the eye frames ROI (the eyes to segment in one forward pass)
+            threshold_frames = [mask for mask,_ in self.eye_segmenter_threshold.apply_batch([eye_frames_roi[eye] for eye in to_segment])]
+
+            for eye, (eye_frame, eye_mask), threshold_frame in zip(to_segment, eye_frames, threshold_frames):
+                segmented[eye] = (eye_frame, threshold_frame)
+                if self.motion_gate is not None:
+                    self.motion_gate.store(eye, frame, eye_rois[eye], (eye_mask, threshold_frame))
+
+        left_eye_frame, left_relative_threshold_frame = segmented["l"]
+        right_eye_frame, right_relative_threshold_frame = segmented["r"]
         # Annotate threshold segmented frame
         # self.frame_annotator.apply_segmentation(left_eye_frame_roi, left_relative_threshold_frame, "Left")
         # self.frame_annotator.apply_segmentation(right_eye_frame_roi, right_relative_threshold_frame, "Right")
@@ -158,23 +177,32 @@ class FirstPipeline:
         
         return left_pupil_absolute_position, right_pupil_absolute_position, count_from_lastRoiupd
 
-    def run(self, video_path:str, output_path:str, idx:int) -> dict:
+    def run(self, video_path:str, output_path:str, idx:int, annotate:bool=True) -> dict:
         '''
         Processes a video to extract the absolute positions of the left and right eye pupils,
         annotates each frame, and calculates the speed of pupil movements.
 
         Arguments:
         - video_path (str): The path to the video file to be processed.
+        - output_path (str): The folder where the annotated video is saved.
+        - idx (int): The index of the video, used in the name of the annotated video.
+        - annotate (bool): Whether to write the annotated video. If False, the video is processed headless
+        (no annotated video and no OpenCV window calls). Default is True.
 
         Returns:
         - output_dict (dict): A dictionary containing the extracted positions and speed information for the left and right eye pupils.
         '''
+        # The masks of the previous video cannot be reused
+        if self.motion_gate is not None:
+            self.motion_gate.reset()
+
         # Initialize lists to store absolute positions of left and right eye pupils
         left_eye_absolute_positions = []
         right_eye_absolute_positions = []
 
         # Creare la cartella solo se non esiste già
-        os.makedirs(f"{output_path}/Annotated_videos", exist_ok=True)
+        if annotate:
+            os.makedirs(f"{output_path}/Annotated_videos", exist_ok=True)
 
         # Open the video file   
         cap = cv2.VideoCapture(video_path)
@@ -184,7 +212,8 @@ class FirstPipeline:
         resolution = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
    
         # Create a video writer object to save the annotated video
-        annotated_video_writer = cv2.VideoWriter(f"{output_path}/Annotated_videos/annotated_video_{idx}.mp4", cv2.VideoWriter_fourcc(*"mp4v"), fps, resolution)
+        if annotate:
+            annotated_video_writer = cv2.VideoWriter(f"{output_path}/Annotated_videos/annotated_video_{idx}.mp4", cv2.VideoWriter_fourcc(*"mp4v"), fps, resolution)
         count_from_lastRoiupd = 0
 
         # Read the first frame of the video
@@ -208,14 +237,15 @@ class FirstPipeline:
         right_eye_absolute_positions.append(right_pupil_absolute_position)
         
         # Annotate the frame with the pupil positions
-        annotated_frame = self.frame_annotator.apply(frame, left_pupil_absolute_position, right_pupil_absolute_position)
-        
-        # Display the annotated frame
-        #cv2.imshow("frame", annotated_frame)
-        #cv2.waitKey(1)
+        if annotate:
+            annotated_frame = self.frame_annotator.apply(frame, left_pupil_absolute_position, right_pupil_absolute_position)
+            
+            # Display the annotated frame
+            #cv2.imshow("frame", annotated_frame)
+            #cv2.waitKey(1)
 
-        # Write the annotated frame to the video writer
-        annotated_video_writer.write(annotated_frame)
+            # Write the annotated frame to the video writer
+            annotated_video_writer.write(annotated_frame)
 
         # Loop to process each frame of the video
         while True:
@@ -244,6 +274,10 @@ class FirstPipeline:
             right_eye_absolute_positions.append(right_pupil_absolute_position)
             print(left_pupil_absolute_position, right_pupil_absolute_position) #Print the positions
 
+            # Headless processing: no annotation and no window events
+            if not annotate:
+                continue
+
             # Annotate the frame with the pupil positions
             annotated_frame = self.frame_annotator.apply(frame, left_pupil_absolute_position, right_pupil_absolute_position)
 
@@ -258,9 +292,10 @@ class FirstPipeline:
             annotated_video_writer.write(annotated_frame)
 
         # Clean up and release resources
-        cv2.destroyAllWindows()
         cap.release()
-        annotated_video_writer.release()
+        if annotate:
+            cv2.destroyAllWindows()
+            annotated_video_writer.release()
 
         # Convert the positions lists to numpy arrays
         left_eye_absolute_positions_dirty = np.array(left_eye_absolute_positions)
@@ -282,6 +317,7 @@ class FirstPipeline:
         
         # Create the output dictionary with positions and speed information
         output_dict = {
+            "fps": fps,
             "position": {
                 "left": left_eye_absolute_positions,
                 "right": right_eye_absolute_positions
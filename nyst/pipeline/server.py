@@ -0,0 +1,396 @@
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import threading
+import traceback
+import socketserver
+import numpy as np
+
+# Add the 'code' directory to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Default path of the Unix socket of the pipeline daemon (can be overridden with the NYST_PIPELINE_SOCKET environment variable)
+DEFAULT_SOCKET = os.environ.get('NYST_PIPELINE_SOCKET', '/tmp/nyst_pipeline.sock')
+
+# Pipeline methods that can be executed by the daemon
+JOB_METHODS = ['run', 'videos_feature_extractor']
+
+
+# Convert the numpy values of a result into JSON values
+def _to_jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {str(key): _to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_jsonable(item) for item in value]
+    return value
+
+# Rebuild the output dictionary of FirstPipeline.run from its JSON version
+def _from_jsonable(output_dict:dict) -> dict:
+    return {
+        'fps': output_dict['fps'],
+        'position': {eye: np.array(positions, dtype=float) for eye, positions in output_dict['position'].items()},
+        'speed': {
+            int(resolution): {eye: np.array(speed, dtype=np.float32) for eye, speed in speeds.items()}
+            for resolution, speeds in output_dict['speed'].items()
+        }
+    }
+
+# Send a message as a JSON line
+def _send(stream, message:dict) -> None:
+    stream.write((json.dumps(message) + '\n').encode())
+    stream.flush()
+
+
+class _Job:
+    '''
+    Extraction job waiting in the daemon queue.
+
+    Attributes:
+    - job_id: The identifier of the job (the one given by the client, or a number assigned by the daemon).
+    - method (str): The FirstPipeline method to be executed (one of JOB_METHODS).
+    - kwargs (dict): The arguments of the method.
+    - events (queue.Queue): The queue where the worker puts the events to be streamed back to the client.
+    - cancelled (threading.Event): Set when the client has disconnected, the job is then skipped.
+    '''
+    def __init__(self, job_id:int, method:str, kwargs:dict):
+        self.job_id = job_id
+        self.method = method
+        self.kwargs = kwargs
+        self.events = queue.Queue()
+        self.cancelled = threading.Event()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    # Handle the requests of a client connection (one JSON line per request)
+    def handle(self):
+        daemon = self.server.pipeline_server
+        with daemon.clients_lock: # The handlers of the connections run in concurrent threads
+            daemon.clients += 1
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    command = request.get('command')
+                except ValueError as e:
+                    _send(self.wfile, {'event': 'error', 'message': f'Invalid request: {e}'})
+                    continue
+
+                if command == 'ping':
+                    _send(self.wfile, {'event': 'pong', 'ready': daemon.pipeline is not None})
+                elif command == 'stats':
+                    _send(self.wfile, {'event': 'stats', **daemon.stats()})
+                elif command == 'submit':
+                    self.stream_jobs(request.get('jobs', []))
+                elif command == 'shutdown':
+                    _send(self.wfile, {'event': 'shutdown'})
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                    return
+                else:
+                    _send(self.wfile, {'event': 'error', 'message': f'Unknown command: {command}'})
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with daemon.clients_lock:
+                daemon.clients -= 1
+
+    # Queue the jobs of a request and stream their results back as soon as they are completed
+    def stream_jobs(self, jobs:list):
+        daemon = self.server.pipeline_server
+        submitted = []
+
+        for job in jobs:
+            # The job_id of the request (if any) is echoed in every event of the job, also when it is rejected
+            if job.get('method') not in JOB_METHODS:
+                _send(self.wfile, {'event': 'error', 'job_id': job.get('job_id'), 'message': f"Unknown method: {job.get('method')}. Choose one of {JOB_METHODS}"})
+                continue
+            submitted.append(daemon.submit(job['method'], job.get('kwargs', {}), job.get('job_id')))
+            _send(self.wfile, {'event': 'queued', 'job_id': submitted[-1].job_id, 'queue_depth': daemon.jobs.qsize()})
+
+        try:
+            # The jobs are executed in order, so their events are streamed in order
+            for job in submitted:
+                while True:
+                    event = job.events.get()
+                    _send(self.wfile, event)
+                    if event['event'] in ['result', 'error']:
+                        break
+            _send(self.wfile, {'event': 'done'})
+        except (BrokenPipeError, ConnectionResetError):
+            # Client gone: the jobs not started yet are skipped
+            for job in submitted:
+                job.cancelled.set()
+            raise
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class FirstPipelineServer:
+    '''
+    Long-lived daemon keeping the FirstPipeline models (YOLO and the two segmentation networks) loaded and warm.
+    The jobs are received over a Unix socket, executed one at a time by a single worker thread (the models are
+    not shared between threads) and their results are streamed back to the client as JSON lines.
+
+    Attributes:
+    - socket_path (str): The path of the Unix socket.
+    - pipeline (FirstPipeline): The pipeline with the loaded models.
+    - jobs (queue.Queue): The jobs waiting to be executed.
+    '''
+    def __init__(self, socket_path:str=DEFAULT_SOCKET, warmup:bool=True, pipeline=None):
+        self.socket_path = socket_path
+        self.warmup_models = warmup
+        self.pipeline = pipeline
+        self.jobs = queue.Queue()
+        self.clients = 0
+        self.clients_lock = threading.Lock()
+        self.next_job_id = 0
+        self.job_lock = threading.Lock()
+        self.running_job = None
+        self.jobs_done = 0
+        self.jobs_failed = 0
+        self.busy_s = 0.0
+        self.load_s = 0.0
+        self.start_time = time.time()
+
+    # Load the models once
+    def load(self) -> None:
+        '''
+        Creates the FirstPipeline (loading all the models) and runs a forward pass of each network on a dummy input,
+        so that the first job does not pay the graph building and warmup time.
+        '''
+        start = time.perf_counter()
+
+        if self.pipeline is None:
+            from nyst.pipeline.first_pipeline import FirstPipeline
+            self.pipeline = FirstPipeline()
+
+        if self.warmup_models:
+            dummy_frame = np.zeros((480, 640, 3), dtype=np.uint8)
+            dummy_eye = np.zeros((64, 64, 3), dtype=np.uint8)
+            for warmup in [lambda: self.pipeline.eye_roi_detector.model.predict(dummy_frame, verbose=False),
+                           lambda: self.pipeline.eye_roi_segmenter.apply(dummy_eye),
+                           lambda: self.pipeline.eye_segmenter_threshold.apply(dummy_eye)]:
+                try:
+                    warmup()
+                except Exception as e:
+                    print(f"Warmup step failed: {e}")
+
+        self.load_s = time.perf_counter() - start
+        print(f"Pipeline models loaded in {self.load_s:.1f} s")
+
+    # Add a job to the queue (with the job_id of the request, or a new one)
+    def submit(self, method:str, kwargs:dict, job_id=None) -> _Job:
+        with self.job_lock:
+            job = _Job(self.next_job_id if job_id is None else job_id, method, kwargs)
+            self.next_job_id += 1
+        self.jobs.put(job)
+        return job
+
+    # Reset the state kept by the pipeline between frames, so that every job starts as with a new pipeline
+    def reset_state(self) -> None:
+        for latch in [self.pipeline.left_eye_roi_latch, self.pipeline.right_eye_roi_latch, self.pipeline.left_eye_center_latch, self.pipeline.right_eye_center_latch]:
+            latch.set(None)
+
+    # Execute the jobs one at a time
+    def worker(self) -> None:
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            if job.cancelled.is_set():
+                continue
+
+            self.running_job = job.job_id
+            job.events.put({'event': 'started', 'job_id': job.job_id})
+            start = time.perf_counter()
+
+            try:
+                self.reset_state()
+                result = getattr(self.pipeline, job.method)(**job.kwargs)
+                elapsed = time.perf_counter() - start
+                job.events.put({'event': 'result', 'job_id': job.job_id, 'elapsed_s': elapsed, 'result': _to_jsonable(result)})
+                self.jobs_done += 1
+            except Exception as e:
+                elapsed = time.perf_counter() - start
+                job.events.put({'event': 'error', 'job_id': job.job_id, 'elapsed_s': elapsed, 'message': str(e), 'traceback': traceback.format_exc()})
+                self.jobs_failed += 1
+
+            self.busy_s += elapsed
+            self.running_job = None
+
+    # Health and load statistics
+    def stats(self) -> dict:
+        '''
+        Returns the health and queue statistics of the daemon.
+
+        Returns:
+        - dict: Whether the models are loaded, the uptime, the model loading time, the number of connected clients,
+        the queue depth, the running job, the completed/failed jobs and the average job time.
+        '''
+        completed = self.jobs_done + self.jobs_failed
+        return {
+            'ready': self.pipeline is not None,
+            'pid': os.getpid(),
+            'uptime_s': time.time() - self.start_time,
+            'models_load_s': self.load_s,
+            'clients': self.clients,
+            'queue_depth': self.jobs.qsize(),
+            'running_job': self.running_job,
+            'jobs_done': self.jobs_done,
+            'jobs_failed': self.jobs_failed,
+            'mean_job_s': self.busy_s / completed if completed else 0.0,
+            'utilization': self.busy_s / max(time.time() - self.start_time, 1e-9)
+        }
+
+    # Start the daemon
+    def serve_forever(self) -> None:
+        '''
+        Loads the models, starts the worker thread and serves the clients until a 'shutdown' request (or Ctrl+C).
+        '''
+        # Only one daemon per socket
+        if os.path.exists(self.socket_path):
+            if FirstPipelineClient(self.socket_path).is_available():
+                raise RuntimeError(f'A pipeline daemon is already listening on {self.socket_path}')
+            os.remove(self.socket_path)
+
+        self.load()
+        worker = threading.Thread(target=self.worker, daemon=True)
+        worker.start()
+
+        server = _UnixServer(self.socket_path, _RequestHandler)
+        server.pipeline_server = self
+        print(f"Pipeline daemon listening on {self.socket_path}")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.jobs.put(None)
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            print("Pipeline daemon stopped")
+
+
+class FirstPipelineClient:
+    '''
+    Thin client of FirstPipelineServer. It exposes the same run and videos_feature_extractor methods of FirstPipeline,
+    executed by the daemon with the already loaded models.
+
+    Attributes:
+    - socket_path (str): The path of the Unix socket of the daemon.
+    - timeout (float): The connection timeout in seconds (None waits forever for the results).
+    '''
+    def __init__(self, socket_path:str=DEFAULT_SOCKET, timeout:float=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    # Open a connection to the daemon
+    def connect(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self.timeout)
+        connection.connect(self.socket_path)
+        return connection
+
+    # Send a request and iterate over the response events
+    def request(self, message:dict):
+        '''
+        Sends a request to the daemon and yields the events of the response.
+
+        Arguments:
+        - message (dict): The request.
+
+        Returns:
+        - generator: The response events (dict), until the last one of the request.
+        '''
+        with self.connect() as connection, connection.makefile('rwb') as stream:
+            _send(stream, message)
+            for line in stream:
+                event = json.loads(line)
+                yield event
+                if message['command'] != 'submit' or event['event'] in ['done', 'shutdown']:
+                    break
+
+    # Whether the daemon is running
+    def is_available(self) -> bool:
+        try:
+            return next(self.request({'command': 'ping'}))['event'] == 'pong'
+        except (OSError, ValueError, StopIteration):
+            return False
+
+    # Health and queue statistics of the daemon
+    def stats(self) -> dict:
+        stats = next(self.request({'command': 'stats'}))
+        stats.pop('event')
+        return stats
+
+    # Stop the daemon
+    def shutdown(self) -> None:
+        list(self.request({'command': 'shutdown'}))
+
+    # Submit several jobs and stream back their results
+    def submit(self, jobs:list):
+        '''
+        Submits a list of jobs and yields their outcome as soon as each one is completed. The job_id of each job is
+        its index in jobs: the outcomes are matched to the jobs by job_id, also when a job is rejected.
+
+        Arguments:
+        - jobs (list): The jobs, each one a (method, kwargs) tuple with method in JOB_METHODS.
+
+        Returns:
+        - generator: For each job, the tuple (job_id, result, error): the index of the job in jobs, the result of the
+        method (None if failed) and the error message (None if successful).
+        '''
+        message = {'command': 'submit', 'jobs': [{'job_id': job_id, 'method': method, 'kwargs': kwargs} for job_id, (method, kwargs) in enumerate(jobs)]}
+        for event in self.request(message):
+            if event['event'] == 'result':
+                yield event['job_id'], event['result'], None
+            elif event['event'] == 'error':
+                yield event.get('job_id'), None, event['message']
+
+    # Same interface of FirstPipeline.run
+    def run(self, video_path:str, output_path:str, idx:int, annotate:bool=True) -> dict:
+        kwargs = {'video_path': os.path.abspath(video_path), 'output_path': os.path.abspath(output_path), 'idx': idx, 'annotate': annotate}
+        for _, result, error in self.submit([('run', kwargs)]):
+            if error is not None:
+                raise RuntimeError(f'Pipeline daemon error: {error}')
+            return _from_jsonable(result)
+
+    # Same interface of FirstPipeline.videos_feature_extractor
+    def videos_feature_extractor(self, input_folder:str, output_path:str) -> None:
+        kwargs = {'input_folder': os.path.abspath(input_folder), 'output_path': os.path.abspath(output_path)}
+        for _, _, error in self.submit([('videos_feature_extractor', kwargs)]):
+            if error is not None:
+                raise RuntimeError(f'Pipeline daemon error: {error}')
+
+
+# Get a pipeline, served by the daemon if it is running
+def connect_pipeline(socket_path:str=DEFAULT_SOCKET):
+    '''
+    Returns a client of the pipeline daemon if it is listening on socket_path, otherwise a new FirstPipeline
+    (loading the models in the current process). Both expose run and videos_feature_extractor.
+
+    Arguments:
+    - socket_path (str): The path of the Unix socket of the daemon. Default is DEFAULT_SOCKET.
+
+    Returns:
+    - FirstPipelineClient or FirstPipeline: The pipeline.
+    '''
+    client = FirstPipelineClient(socket_path)
+    if client.is_available():
+        print(f"Using the pipeline daemon on {socket_path}")
+        return client
+
+    from nyst.pipeline.first_pipeline import FirstPipeline
+    return FirstPipeline()
@@ -1,8 +1,10 @@
 r"""init file for roi package."""
 
-from .roi_segmenter import FirstEyeRoiSegmenter, SegmenterThreshold
+from .roi_segmenter import FirstEyeRoiSegmenter, SegmenterThreshold, select_input_size, infer_staged, INPUT_SIZE_BUCKETS
+from .staging import InputStaging
+from .motion_gate import SegmentationGate, crop_signature, shift_mask, mask_eye_frame, trace_difference
 from .region_selector import FirstRegionSelector
 from .roi_detector import FirstEyeRoiDetector
 from .roi import FirstRoi
 
-__all__ = ["FirstEyeRoiSegmenter", "FirstRegionSelector", "FirstEyeRoiDetector", "FirstRoi", "SegmenterThreshold"]
\ No newline at end of file
+__all__ = ["FirstEyeRoiSegmenter", "FirstRegionSelector", "FirstEyeRoiDetector", "FirstRoi", "SegmenterThreshold", "select_input_size", "infer_staged", "InputStaging", "SegmentationGate", "crop_signature", "shift_mask", "mask_eye_frame", "trace_difference", "INPUT_SIZE_BUCKETS"]
\ No newline at end of file
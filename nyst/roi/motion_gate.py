@@ -0,0 +1,177 @@
+import cv2
+import numpy as np
+
+# Side of the downsampled grayscale crop compared between frames
+SIGNATURE_SIZE = 32
+
+
+# Cheap appearance signature of a region of the frame
+def crop_signature(frame, roi, size:int=SIGNATURE_SIZE) -> np.ndarray:
+    '''
+    Downsamples the grayscale region of the frame inside the ROI to a small square (area interpolation).
+
+    Arguments:
+    - frame: The BGR video frame.
+    - roi: The box (x1, y1, x2, y2) of the region.
+    - size (int): The side of the signature. Default is SIGNATURE_SIZE.
+
+    Returns:
+    - np.ndarray: The (size, size) uint8 signature, or None if the region is empty.
+    '''
+    region = frame[int(roi[1]):int(roi[3]), int(roi[0]):int(roi[2])]
+    if region.size == 0:
+        return None
+    return cv2.resize(cv2.cvtColor(region, cv2.COLOR_BGR2GRAY), (size, size), interpolation=cv2.INTER_AREA)
+
+# Move a mask computed on an old ROI into a new ROI
+def shift_mask(mask:np.ndarray, old_roi, new_roi, shape:tuple, fill:int=0) -> np.ndarray:
+    '''
+    Translates a mask of the crop at old_roi to the crop at new_roi (same content in frame coordinates); the pixels
+    not covered by the old crop are filled with the background value.
+
+    Arguments:
+    - mask (np.ndarray): The mask (or masked image) of the old crop.
+    - old_roi: The box (x1, y1, x2, y2) of the old crop.
+    - new_roi: The box (x1, y1, x2, y2) of the new crop.
+    - shape (tuple): The (height, width) of the new crop.
+    - fill (int): The background value. Default is 0.
+
+    Returns:
+    - np.ndarray: The mask of the new crop.
+    '''
+    dx, dy = int(old_roi[0]) - int(new_roi[0]), int(old_roi[1]) - int(new_roi[1])
+    shifted = np.full(tuple(shape[:2]) + mask.shape[2:], fill, dtype=mask.dtype)
+
+    # Overlap of the two crops, in the coordinates of each crop
+    height = min(shifted.shape[0], dy + mask.shape[0]) - max(0, dy)
+    width = min(shifted.shape[1], dx + mask.shape[1]) - max(0, dx)
+    if height > 0 and width > 0:
+        shifted[max(0, dy):max(0, dy) + height, max(0, dx):max(0, dx) + width] = mask[max(0, -dy):max(0, -dy) + height, max(0, -dx):max(0, -dx) + width]
+    return shifted
+
+# Mask the current pixels of an eye crop with a reused eye mask
+def mask_eye_frame(eye_frame_roi, eye_mask:np.ndarray, fill:int=255) -> np.ndarray:
+    '''
+    Builds the masked (RGB) eye frame of FirstEyeRoiSegmenter from the current crop and an eye mask: the pixels are the
+    ones of the current frame, only the background comes from the mask.
+
+    Arguments:
+    - eye_frame_roi: The current BGR crop of the eye.
+    - eye_mask (np.ndarray): The eye mask of the crop (1 on the eye), e.g. shifted with shift_mask.
+    - fill (int): The value of the background pixels. Default is 255.
+
+    Returns:
+    - np.ndarray: The masked RGB eye frame.
+    '''
+    eye_frame_masked = cv2.cvtColor(eye_frame_roi, cv2.COLOR_BGR2RGB)
+    eye_frame_masked[eye_mask == 0] = fill
+    return eye_frame_masked
+
+
+# Class that decides when the segmentation of an eye crop can be reused
+class SegmentationGate:
+    '''
+    Motion gate of the eye segmenters. For each eye it keeps the label masks of the last segmented frame (eye mask and
+    threshold label mask) and the signature (see crop_signature) of its ROI. On a new frame the same region of the frame
+    is compared with that signature: if the mean absolute difference is below the threshold the old masks are reused,
+    shifted by the ROI offset, instead of running the models. Only the masks are reused: the eye frame is rebuilt from
+    the pixels of the current crop (see mask_eye_frame). The reference is only updated by a real segmentation, so slow
+    drifts add up until they exceed the threshold, and a segmentation is forced every refresh_every frames anyway.
+
+    Attributes:
+    - threshold: The maximum mean absolute difference (gray levels) of a reused frame.
+    - refresh_every: The maximum number of consecutive frames served by one segmentation.
+    - size: The side of the signatures.
+    - fills: The background value of each mask (eye mask, threshold label mask).
+    - state: The reference of each eye.
+    - history: The decision of each frame and eye (frame index, eye, reused, difference).
+    '''
+    def __init__(self, threshold:float=3.0, refresh_every:int=10, size:int=SIGNATURE_SIZE, fills:tuple=(0, 0)):
+        self.threshold = threshold
+        self.refresh_every = refresh_every
+        self.size = size
+        self.fills = fills
+        self.reset()
+
+    def reset(self):
+        # New video: no reference and no statistics
+        self.state = {}
+        self.history = []
+
+    def reuse(self, eye:str, frame, roi, count:int=None):
+        '''
+        Returns the masks of the last segmentation of the eye, shifted to the new ROI, if the region of the frame has
+        not changed since then.
+
+        Arguments:
+        - eye (str): The eye ("l" or "r").
+        - frame: The current BGR video frame.
+        - roi: The current box (x1, y1, x2, y2) of the eye.
+        - count (int): The index of the frame, stored in the history. Default is None.
+
+        Returns:
+        - tuple: The reused masks (eye mask, threshold label mask), or None if the eye has to be segmented.
+        '''
+        state = self.state.get(eye)
+        difference = None
+        if state is not None and state['age'] + 1 < self.refresh_every:
+            signature = crop_signature(frame, state['roi'], self.size)
+            if signature is not None:
+                difference = float(cv2.absdiff(signature, state['signature']).mean())
+
+        if difference is None or difference > self.threshold:
+            self.history.append((count, eye, False, difference))
+            return None
+
+        state['age'] += 1
+        self.history.append((count, eye, True, difference))
+        shape = (int(roi[3]) - int(roi[1]), int(roi[2]) - int(roi[0]))
+        return tuple(shift_mask(mask, state['roi'], roi, shape, fill) for mask, fill in zip(state['masks'], self.fills))
+
+    def store(self, eye:str, frame, roi, masks:tuple):
+        '''
+        Saves the masks of a new segmentation of the eye as the reference of the next frames.
+
+        Arguments:
+        - eye (str): The eye ("l" or "r").
+        - frame: The current BGR video frame.
+        - roi: The current box (x1, y1, x2, y2) of the eye.
+        - masks (tuple): The label masks of the segmenters (eye mask, threshold label mask).
+        '''
+        # Copies: the masks are also handed to the pupil detector
+        self.state[eye] = {'roi': np.array(roi, copy=True), 'signature': crop_signature(frame, roi, self.size), 'masks': tuple(np.copy(mask) for mask in masks), 'age': 0}
+
+    def stats(self) -> dict:
+        '''
+        Summarizes the decisions of the gate since the last reset.
+
+        Returns:
+        - dict: The number of gated crops, the number of reused ones and the skip rate, overall ('all') and per eye.
+        '''
+        stats = {}
+        for eye in [None] + sorted({entry[1] for entry in self.history}):
+            decisions = [entry[2] for entry in self.history if eye is None or entry[1] == eye]
+            key = 'all' if eye is None else eye
+            stats[key] = {'crops': len(decisions), 'reused': int(sum(decisions)), 'skip_rate': float(np.mean(decisions)) if decisions else 0.0}
+        return stats
+
+
+# Difference between two pupil traces
+def trace_difference(reference, gated) -> dict:
+    '''
+    Compares the pupil positions of the same video processed without and with the motion gate.
+
+    Arguments:
+    - reference: The (n_frames, 2) positions without the gate.
+    - gated: The (n_frames, 2) positions with the gate.
+
+    Returns:
+    - dict: The mean, 95th percentile and maximum distance in pixels (frames with a position in both traces).
+    '''
+    reference, gated = np.asarray(reference, dtype=float), np.asarray(gated, dtype=float)
+    n_frames = min(len(reference), len(gated))
+    distances = np.linalg.norm(reference[:n_frames] - gated[:n_frames], axis=1)
+    distances = distances[np.isfinite(distances)]
+    if len(distances) == 0:
+        return {'frames': 0, 'mean_px': None, 'p95_px': None, 'max_px': None}
+    return {'frames': int(len(distances)), 'mean_px': float(distances.mean()), 'p95_px': float(np.percentile(distances, 95)), 'max_px': float(distances.max())}
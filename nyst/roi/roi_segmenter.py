@@ -5,8 +5,48 @@ import tensorflow as tf
 import os
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"  # Specifica la seconda GPU
 
-from nyst.seg_eyes.deeplab_mdl_def import DynamicUpsample
+from nyst.seg_eyes.deeplab_mdl_def import load_deeplab, bgr_input_model
 from nyst.seg_eyes.utils import plot_predictions, infer, decode_segmentation_masks
+from nyst.roi.staging import InputStaging
+from nyst.visualization.segmentation import palette_lut, colorize_mask
+
+# Input sizes of the adaptive segmenters (the model is fully convolutional, any multiple of 32 can be used)
+INPUT_SIZE_BUCKETS = (128, 192, 256, 448)
+
+
+# Input size of the segmenter for a crop
+def select_input_size(crop_shape, buckets=INPUT_SIZE_BUCKETS, upscale:float=1.0) -> int:
+    '''
+    Selects the smallest input size of the buckets that is at least upscale times the longest side of the crop (the
+    largest bucket for bigger crops), so that small eye boxes are not upscaled to the full model resolution.
+
+    Arguments:
+    - crop_shape (tuple): The shape of the crop (height, width, ...).
+    - buckets (tuple): The available input sizes. Default is INPUT_SIZE_BUCKETS.
+    - upscale (float): The minimum ratio between the input size and the longest side of the crop. Default is 1.0.
+
+    Returns:
+    - int: The side of the square input of the model.
+    '''
+    target = upscale * max(crop_shape[:2])
+    for size in sorted(buckets):
+        if size >= target:
+            return size
+    return max(buckets)
+
+# Label masks of a staged batch
+def infer_staged(bgr_model, batch:np.ndarray) -> np.ndarray:
+    '''
+    Predicts the label masks of a staged BGR batch (see InputStaging) in one forward pass, reading the buffer as it is.
+
+    Arguments:
+    - bgr_model: The model with the BGR input (see bgr_input_model).
+    - batch (np.ndarray): The staged crops with shape (batch, height, width, 3).
+
+    Returns:
+    - np.ndarray: The label masks with shape (batch, height, width).
+    '''
+    return np.argmax(bgr_model.predict_on_batch(batch), axis=-1)
 
 # Class that defines a method to calculate the ROI boxes of each eye separately.
 class FirstEyeRoiSegmenter:
@@ -15,16 +55,26 @@ class FirstEyeRoiSegmenter:
 
     Attributes:
     - model: The deep learning model used for segmentation.
+    - bgr_model: The same model with the BGR input used on the staged crops.
+    - staging: The reusable input buffers of the model.
     - COLORMAP: A dictionary that maps class names to BGR color values.
+    - input_sizes: The input size buckets (None: the fixed width x height of apply).
+    - upscale: The minimum ratio between the input size and the longest side of the crop.
     '''
-    def __init__(self, model_name:str):
+    def __init__(self, model_name:str, input_sizes:tuple=None, upscale:float=1.0):
         '''
         Initializes the FirstEyeRoiSegmenter with the specified model.
 
         Arguments:
         - model_name: The filename of the pre-trained model to be loaded.
+        - input_sizes (tuple): The input size buckets, e.g. INPUT_SIZE_BUCKETS (default: None, fixed input size).
+        - upscale (float): The minimum ratio between the input size and the longest side of the crop (default: 1.0).
         '''
-        self.model = keras.models.load_model(model_name, custom_objects={'DynamicUpsample': DynamicUpsample})
+        self.input_sizes = input_sizes
+        self.upscale = upscale
+        self.model = load_deeplab(model_name) # Any backbone (ResNet50 or mobile checkpoints)
+        self.bgr_model = bgr_input_model(self.model) # Channel order handled by the first layer
+        self.staging = InputStaging()
         self.COLORMAP  = {
     "background": [0, 0, 0],  # BGR for background
     "eyes": [1, 1, 1],  # BGR for eyes
@@ -41,36 +91,63 @@ class FirstEyeRoiSegmenter:
         - print_eye (bool): Boolean flag indicating whether to print the segmented eye (default: False).
         - width (int): The width to resize the frame for model input (default: 448).
         - height (int): The height to resize the frame for model input (default: 448).
+        With input_sizes the width and the height are replaced by the bucket of the crop size (see select_input_size).
 
         Returns:
         - A masked version of the original frame where the eye region is segmented.
         """
-        
-        # Resize the frame to the input size of the model
-        original_size = (frame.shape[1], frame.shape[0])
-        eye_frame = cv2.resize(frame, (width, height))
+        return self.apply_batch([frame], print_eye, width, height)[0]
 
-        # Convert the frame to RGB
-        eye_frame = cv2.cvtColor(eye_frame, cv2.COLOR_BGR2RGB)
+    def apply_batch(self, frames:list, print_eye:bool=False, width:int=448, height:int=448, return_masks:bool=False) -> list:
+        """
+        Applies the segmentation model to several eye frames (e.g. the left and right eye) in one forward pass.
+        The frames are resized into the reusable input buffer of the model and masked in a reusable work buffer: only
+        the returned masked frames are allocated.
+
+        Arguments:
+        - frames (list): The input image frames to be processed.
+        - print_eye (bool): Boolean flag indicating whether to print the segmented eyes (default: False).
+        - width (int): The width to resize the frames for model input (default: 448).
+        - height (int): The height to resize the frames for model input (default: 448).
+        - return_masks (bool): Boolean flag indicating whether to return the eye mask of each frame too (default: False).
+        With input_sizes the width and the height are replaced by the bucket of the largest crop (see select_input_size).
+
+        Returns:
+        - A list with the masked (RGB) version of each frame where the eye region is segmented.
+          With return_masks, a list with the masked frame and the eye mask (1 on the eye, at the frame size) of each frame.
+        """
+
+        # Adaptive input size: the bucket of the crop sizes instead of the fixed width x height
+        if self.input_sizes:
+            width = height = max(select_input_size(frame.shape, self.input_sizes, self.upscale) for frame in frames)
+
+        # Resize the frames into the input buffer and predict the segmentation masks
+        batch = self.staging.stage(frames, width, height)
+        prediction_masks = infer_staged(self.bgr_model, batch)
 
-        # Predict the segmentation mask
-        image_tensor = np.array(eye_frame)
-        prediction_mask = infer(self.model, image_tensor)
-        
         # To do: Eliminazione blob piccoli, verifichiamo area occhio del detetcted box
 
-        # Create a masked version of the eye frame
-        eye_frame_masked = eye_frame.copy()
-        eye_frame_masked[prediction_mask == 0] = np.array( [255,255,255])
-        
-        # Resize the masked frame back to the original size
-        eye_frame_masked = cv2.resize(eye_frame_masked, original_size)
+        eye_frames_masked = []
+        for frame, eye_frame, prediction_mask in zip(frames, batch, prediction_masks):
+            # Create a masked (RGB) version of the eye frame in the work buffer
+            eye_frame_masked = cv2.cvtColor(eye_frame, cv2.COLOR_BGR2RGB, dst=self.staging.scratch(width, height))
+            eye_frame_masked[prediction_mask == 0] = 255
+
+            # Resize the masked frame back to the original size (the only new array)
+            eye_frame_masked = cv2.resize(eye_frame_masked, (frame.shape[1], frame.shape[0]))
 
-        # Optional: Print the segmented eye
-        if print_eye:
-            plot_predictions(eye_frame, self.COLORMAP, self.model)
+            # Eye mask at the original size (e.g. to mask the next frames of the same crop)
+            if return_masks:
+                eye_mask = cv2.resize((prediction_mask != 0).astype(np.uint8), (frame.shape[1], frame.shape[0]), interpolation=cv2.INTER_NEAREST)
+                eye_frames_masked.append((eye_frame_masked, eye_mask))
+            else:
+                eye_frames_masked.append(eye_frame_masked)
 
-        return eye_frame_masked
+            # Optional: Print the segmented eye
+            if print_eye:
+                plot_predictions(cv2.cvtColor(eye_frame, cv2.COLOR_BGR2RGB), self.COLORMAP, self.model)
+
+        return eye_frames_masked
     
 
 
@@ -80,15 +157,23 @@ class SegmenterThreshold:
 
     Attributes:
     - model: The deep learning model used for segmentation.
+    - bgr_model: The same model with the BGR input used on the staged crops.
+    - staging: The reusable input buffers of the model.
     - COLORMAP: A dictionary that maps class names to BGR color values.
+    - input_sizes: The input size buckets (None: the fixed width x height of apply).
+    - upscale: The minimum ratio between the input size and the longest side of the crop.
     '''
-    def __init__(self, model_name:str):
+    def __init__(self, model_name:str, input_sizes:tuple=None, upscale:float=1.0):
         '''
         Initializes the FirstEyeRoiSegmenter with the specified model.
 
         Arguments:
         - model_name: The filename of the pre-trained model to be loaded.
+        - input_sizes (tuple): The input size buckets, e.g. INPUT_SIZE_BUCKETS (default: None, fixed input size).
+        - upscale (float): The minimum ratio between the input size and the longest side of the crop (default: 1.0).
         '''
+        self.input_sizes = input_sizes
+        self.upscale = upscale
         self.label = {
         "background":0,
         "pupil":1,
@@ -96,7 +181,9 @@ class SegmenterThreshold:
         "iris":3
         }
 
-        self.model = keras.models.load_model(model_name, custom_objects={'DynamicUpsample': DynamicUpsample})
+        self.model = load_deeplab(model_name) # Any backbone (ResNet50 or mobile checkpoints)
+        self.bgr_model = bgr_input_model(self.model) # Channel order handled by the first layer
+        self.staging = InputStaging()
         self.COLORMAP  = {
             "background": (0, 0, 0),
             "pupil": (255, 0, 0),
@@ -106,52 +193,65 @@ class SegmenterThreshold:
         # Convert color values from BGR to RGB
         self.COLORMAP = {key: [color[2], color[1], color[0]] for key, color in self.COLORMAP.items()}
 
+        # Palette of each class (only that class colored), used to colorize the masks with one lookup
+        self.class_luts = {key: palette_lut([color if name == key else (0, 0, 0) for name, color in self.COLORMAP.items()]) for key in self.COLORMAP}
+
     def apply(self, frame, print_eye:bool=False, width:int=448, height:int=448):
         """
         Applies the segmentation model to the given frame to isolate the eye/iris/pupil regions.
+        The label mask is resized once to the frame size and each class is colorized from it with a palette lookup.
 
         Arguments:
         - frame: The input image frame to be processed.
         - print_eye (bool): Boolean flag indicating whether to print the segmented eye (default: False).
         - width (int): The width to resize the frame for model input (default: 448).
         - height (int): The height to resize the frame for model input (default: 448).
+        With input_sizes the width and the height are replaced by the bucket of the crop size (see select_input_size).
 
         Returns:
         - A dictionary masked version of the original frame where the eye region is segmented.
         """
+        return self.apply_batch([frame], print_eye, width, height)[0]
 
-        # Masks frame list 
-        masks_dict = {} 
+    def apply_batch(self, frames:list, print_eye:bool=False, width:int=448, height:int=448) -> list:
+        """
+        Applies the segmentation model to several eye frames (e.g. the left and right eye) in one forward pass, with
+        the frames resized into the reusable input buffer of the model.
 
-        # Resize the frame to the input size of the model
-        original_size = (frame.shape[1], frame.shape[0])
-        eye_frame = cv2.resize(frame, (width, height))
+        Arguments:
+        - frames (list): The input image frames to be processed.
+        - print_eye (bool): Boolean flag indicating whether to print the segmented eyes (default: False).
+        - width (int): The width to resize the frames for model input (default: 448).
+        - height (int): The height to resize the frames for model input (default: 448).
+        With input_sizes the width and the height are replaced by the bucket of the largest crop (see select_input_size).
+
+        Returns:
+        - A list with the label mask and the dictionary of colored masks of each frame, at the frame size.
+        """
 
-        # Convert the frame to RGB
-        eye_frame = cv2.cvtColor(eye_frame, cv2.COLOR_BGR2RGB)
+        # Adaptive input size: the bucket of the crop sizes instead of the fixed width x height
+        if self.input_sizes:
+            width = height = max(select_input_size(frame.shape, self.input_sizes, self.upscale) for frame in frames)
 
-        # Predict the segmentation mask
-        image_tensor = np.array(eye_frame)
-        prediction_mask = infer(self.model, image_tensor)  # Assuming output shape is (height, width)
+        # Resize the frames into the input buffer and predict the segmentation masks
+        batch = self.staging.stage(frames, width, height)
+        prediction_masks = infer_staged(self.bgr_model, batch)
 
-        # Create a masked version of the eye frame
-        eye_frame_masked = np.zeros_like(eye_frame)
+        results = []
+        for frame, prediction_mask in zip(frames, prediction_masks):
+            # Resize the label mask back to the original size (once, before the colorization)
+            prediction_mask = cv2.resize(prediction_mask.astype(np.uint8), (frame.shape[1], frame.shape[0]), interpolation=cv2.INTER_NEAREST)
 
-        # Apply the color map to the mask
-        for class_id, color in self.COLORMAP.items():
-            class_mask = (prediction_mask == class_id)
-            eye_frame_masked[class_mask] = color
-            # Resize the masked frame back to the original size
-            eye_frame_relative_threshold_masked = cv2.resize(eye_frame_masked, original_size, interpolation=cv2.INTER_NEAREST)
-            masks_dict[class_id] = eye_frame_relative_threshold_masked
+            # Colored mask of each class at the original size
+            masks_dict = {class_name: colorize_mask(prediction_mask, lut) for class_name, lut in self.class_luts.items()}
 
-        prediction_mask = cv2.resize(prediction_mask, original_size, interpolation=cv2.INTER_NEAREST)
+            # Optional: Visualize the segmented eye
+            if print_eye:
+                self._plot_segmented_frame(frame, masks_dict)
 
-        # Optional: Visualize the segmented eye
-        if print_eye:
-            self._plot_segmented_frame(frame, masks_dict)        
+            results.append((prediction_mask, masks_dict))
 
-        return prediction_mask, masks_dict
+        return results
     
     def apply_segmentation(self, frame, mask, pos, alpha=0.3):
         """
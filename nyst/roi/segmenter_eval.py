@@ -0,0 +1,152 @@
+import os
+import time
+from glob import glob
+import cv2
+import numpy as np
+
+from nyst.roi.roi_segmenter import INPUT_SIZE_BUCKETS, select_input_size
+
+
+# Intersection over union of each class
+def class_iou(prediction:np.ndarray, target:np.ndarray, n_classes:int) -> np.ndarray:
+    '''
+    Computes the IoU of each class between two label masks of the same size with one confusion matrix.
+
+    Arguments:
+    - prediction (np.ndarray): The predicted label mask.
+    - target (np.ndarray): The ground truth label mask.
+    - n_classes (int): The number of classes.
+
+    Returns:
+    - np.ndarray: The IoU of each class (NaN for the classes absent from both masks).
+    '''
+    confusion = np.bincount(target.astype(np.int64).ravel() * n_classes + prediction.astype(np.int64).ravel(), minlength=n_classes ** 2).reshape(n_classes, n_classes)
+    intersection = np.diag(confusion)
+    union = confusion.sum(axis=0) + confusion.sum(axis=1) - intersection
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return intersection / union
+
+# Centre of the pupil of a label mask
+def pupil_centre(mask:np.ndarray, pupil_label:int=1):
+    '''
+    Computes the centroid of the pupil pixels of a label mask.
+
+    Returns:
+    - tuple: The (x, y) centre, or None if the mask has no pupil pixels.
+    '''
+    moments = cv2.moments((mask == pupil_label).astype(np.uint8), binaryImage=True)
+    if moments['m00'] == 0:
+        return None
+    return moments['m10'] / moments['m00'], moments['m01'] / moments['m00']
+
+# Evaluation set: eye images and label masks
+def load_eye_crops(images_dir:str, masks_dir:str, crop_size:int=None, limit:int=None) -> list:
+    '''
+    Loads the eye images (BGR) and their label masks, in sorted order. With crop_size the pairs are downscaled so that
+    their longest side is crop_size, to reproduce the size of the eye boxes of the detector.
+
+    Returns:
+    - list: The (image, mask) pairs.
+    '''
+    images = sorted(glob(os.path.join(images_dir, '*')))[:limit]
+    masks = sorted(glob(os.path.join(masks_dir, '*')))[:limit]
+
+    pairs = []
+    for image_path, mask_path in zip(images, masks):
+        image = cv2.imread(image_path)
+        mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+        if crop_size is not None:
+            scale = crop_size / max(image.shape[:2])
+            size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+            mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+        pairs.append((image, mask))
+    return pairs
+
+# Accuracy and latency of a segmentation function for each input size
+def evaluate_segmentation(segment, pairs:list, input_sizes:list, n_classes:int=4, pupil_label:int=1) -> list:
+    '''
+    Runs segment on the eye crops with each input size selection and compares the masks at the crop size with the
+    ground truth.
+
+    Arguments:
+    - segment (callable): segment(image, size) returns the label mask of the BGR crop at the crop size.
+    - pairs (list): The (image, mask) pairs (see load_eye_crops).
+    - input_sizes (list): The (name, selection) input sizes, selection(image) returns the input size of a crop.
+    - n_classes (int): The number of classes. Default is 4.
+    - pupil_label (int): The label of the pupil (None if the model has no pupil class). Default is 1.
+
+    Returns:
+    - list: One dictionary for each input size: mean IoU of each class and over the classes, mean and median pupil
+    centre error (pixels of the crop), pupil miss rate and mean, median and 95th percentile latency (ms per crop).
+    '''
+    results = []
+    for name, input_size in input_sizes:
+        # Warm-up (the model is traced again for every new input shape)
+        if pairs:
+            segment(pairs[0][0], input_size(pairs[0][0]))
+
+        ious, errors, misses, timings, sizes = [], [], 0, [], []
+        for image, target in pairs:
+            size = input_size(image)
+            start = time.perf_counter()
+            prediction = segment(image, size)
+            timings.append(time.perf_counter() - start)
+            sizes.append(size)
+
+            ious.append(class_iou(prediction, target, n_classes))
+            target_centre = pupil_centre(target, pupil_label) if pupil_label is not None else None
+            if target_centre is not None:
+                predicted_centre = pupil_centre(prediction, pupil_label)
+                if predicted_centre is None:
+                    misses += 1
+                else:
+                    errors.append(np.hypot(predicted_centre[0] - target_centre[0], predicted_centre[1] - target_centre[1]))
+
+        class_ious = np.nanmean(np.array(ious), axis=0)
+        n_pupils = len(errors) + misses
+        timings = np.array(timings) * 1000
+        results.append({
+            'input_size': name,
+            'mean_input_size': float(np.mean(sizes)),
+            'mIoU': float(np.nanmean(class_ious)),
+            **{f'IoU_{label}': float(iou) for label, iou in enumerate(class_ious)},
+            'pupil_error_mean_px': float(np.mean(errors)) if errors else float('nan'),
+            'pupil_error_median_px': float(np.median(errors)) if errors else float('nan'),
+            'pupil_miss_rate': misses / n_pupils if n_pupils else 0.0,
+            'latency_ms': float(np.mean(timings)),
+            'latency_p50_ms': float(np.percentile(timings, 50)),
+            'latency_p95_ms': float(np.percentile(timings, 95))
+        })
+
+    return results
+
+# Input size selections: each bucket and the adaptive selection
+def input_size_selections(buckets=INPUT_SIZE_BUCKETS, upscale:float=1.0) -> list:
+    input_sizes = [(str(size), lambda image, size=size: size) for size in buckets]
+    input_sizes.append(('adaptive', lambda image: select_input_size(image.shape, buckets, upscale)))
+    return input_sizes
+
+# Accuracy and latency of the segmenter for each input size
+def evaluate_input_sizes(segmenter, pairs:list, buckets=INPUT_SIZE_BUCKETS, n_classes:int=4, pupil_label:int=1, upscale:float=1.0) -> list:
+    '''
+    Runs the segmenter on the eye crops at each input size of the buckets and with the adaptive selection
+    (select_input_size), see evaluate_segmentation.
+
+    Arguments:
+    - segmenter (SegmenterThreshold): The segmenter (its fixed input size is used, the adaptive selection is done here).
+    - pairs (list): The (image, mask) pairs (see load_eye_crops).
+    - buckets (tuple): The input sizes. Default is INPUT_SIZE_BUCKETS.
+    - n_classes (int): The number of classes. Default is 4.
+    - pupil_label (int): The label of the pupil. Default is 1.
+    - upscale (float): The upscale of the adaptive selection. Default is 1.0.
+
+    Returns:
+    - list: One dictionary of results for each input size and for 'adaptive'.
+    '''
+    # Fixed input size of the segmenter: the size is passed to apply for every crop
+    adaptive_sizes, segmenter.input_sizes = getattr(segmenter, 'input_sizes', None), None
+    try:
+        return evaluate_segmentation(lambda image, size: segmenter.apply(image, width=size, height=size)[0], pairs, input_size_selections(buckets, upscale), n_classes, pupil_label)
+    finally:
+        segmenter.input_sizes = adaptive_sizes
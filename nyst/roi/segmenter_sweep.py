@@ -0,0 +1,216 @@
+import os
+import json
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+
+from nyst.roi.roi_segmenter import INPUT_SIZE_BUCKETS
+from nyst.roi.segmenter_eval import load_eye_crops, evaluate_segmentation, input_size_selections
+
+# Inference backends of the sweep and their precisions
+BACKEND_PRECISIONS = {
+    'keras': ['fp32', 'bf16'],  # model.predict, as in the segmenters
+    'call': ['fp32', 'bf16'],  # model(batch) without the predict overhead
+    'tflite': ['fp32', 'fp16', 'int8']  # TFLite interpreter (fp16 weights or int8 dynamic range quantization)
+}
+
+
+# Segmentation model with the precision of the sweep configuration
+def load_segmentation_model(model_path:str, precision:str='fp32'):
+    '''
+    Loads a segmentation checkpoint (model.h5, eyes_seg_threshold.h5). With 'bf16' the model is cloned with the
+    mixed_bfloat16 policy (bfloat16 computations, float32 weights).
+
+    Arguments:
+    - model_path (str): The Keras checkpoint.
+    - precision (str): 'fp32' or 'bf16'. Default is 'fp32'.
+
+    Returns:
+    - keras.Model: The model.
+    '''
+    import keras
+    from nyst.seg_eyes.deeplab_mdl_def import load_deeplab, CUSTOM_OBJECTS
+
+    model = load_deeplab(model_path)
+    if precision != 'bf16':
+        return model
+
+    # Every layer but the input is rebuilt with the mixed policy
+    def mixed_layer(layer):
+        if isinstance(layer, keras.layers.InputLayer):
+            return layer.__class__.from_config(layer.get_config())
+        return layer.__class__.from_config({**layer.get_config(), 'dtype': 'mixed_bfloat16'})
+
+    with keras.utils.custom_object_scope(CUSTOM_OBJECTS):
+        mixed = keras.models.clone_model(model, clone_function=mixed_layer)
+    mixed.set_weights(model.get_weights())
+    return mixed
+
+# Prediction function of a backend
+def make_predictor(model, backend:str='keras', precision:str='fp32', num_threads:int=None):
+    '''
+    Returns the function that computes the logits (1, H, W, n_classes) of a (1, H, W, 3) batch with the backend.
+
+    Arguments:
+    - model (keras.Model): The model.
+    - backend (str): 'keras', 'call' or 'tflite'. Default is 'keras'.
+    - precision (str): The precision of the backend (see BACKEND_PRECISIONS). Default is 'fp32'.
+    - num_threads (int): The threads of the TFLite interpreter. Default is None.
+
+    Returns:
+    - callable: The prediction function.
+    '''
+    if precision not in BACKEND_PRECISIONS.get(backend, []):
+        raise ValueError(f"Unsupported backend/precision: {backend}/{precision}")
+
+    if backend == 'keras':
+        return lambda batch: model.predict(batch, verbose=0)
+    if backend == 'call':
+        return lambda batch: np.asarray(model(batch, training=False))
+
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]  # Dynamic resize of DynamicUpsample
+    if precision in ('fp16', 'int8'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if precision == 'fp16':
+        converter.target_spec.supported_types = [tf.float16]
+    interpreter = tf.lite.Interpreter(model_content=converter.convert(), num_threads=num_threads)
+    input_index = interpreter.get_input_details()[0]['index']
+    output_index = interpreter.get_output_details()[0]['index']
+    allocated = {'shape': None}
+
+    def predict(batch):
+        # The tensors are reallocated only when the input size changes
+        if allocated['shape'] != batch.shape:
+            interpreter.resize_tensor_input(input_index, batch.shape)
+            interpreter.allocate_tensors()
+            allocated['shape'] = batch.shape
+        interpreter.set_tensor(input_index, batch.astype(np.float32))
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index)
+
+    return predict
+
+# Label mask of a crop, with the preprocessing of SegmenterThreshold.apply
+def segment_crop(predict, image:np.ndarray, size:int) -> np.ndarray:
+    eye_frame = cv2.cvtColor(cv2.resize(image, (size, size)), cv2.COLOR_BGR2RGB)
+    prediction_mask = np.argmax(predict(eye_frame[np.newaxis].astype(np.float32))[0], axis=-1).astype(np.uint8)
+    return cv2.resize(prediction_mask, (image.shape[1], image.shape[0]), interpolation=cv2.INTER_NEAREST)
+
+# Threads of the TensorFlow runtime of a sweep process (set before the runtime is initialized)
+def _init_sweep_worker(num_threads):
+    import tensorflow as tf
+    if num_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+# Results of one configuration (model, backend, precision, threads) for every crop size and input size
+def sweep_configuration(model_path:str, backend:str, precision:str, num_threads:int, images_dir:str, masks_dir:str, crop_sizes=(None,), buckets=INPUT_SIZE_BUCKETS, upscale:float=1.0, limit:int=None) -> list:
+    model = load_segmentation_model(model_path, precision if backend != 'tflite' else 'fp32')
+    predict = make_predictor(model, backend, precision, num_threads)
+    n_classes = model.output_shape[-1]
+
+    results = []
+    for crop_size in crop_sizes:
+        pairs = load_eye_crops(images_dir, masks_dir, crop_size, limit)
+
+        # Eye/background models (model.h5) are compared with the union of the eye classes and have no pupil
+        if n_classes < 4:
+            pairs = [(image, (mask > 0).astype(np.uint8)) for image, mask in pairs]
+
+        for result in evaluate_segmentation(lambda image, size: segment_crop(predict, image, size), pairs, input_size_selections(buckets, upscale), n_classes, 1 if n_classes >= 4 else None):
+            results.append({'model': os.path.basename(model_path), 'backend': backend, 'precision': precision, 'threads': num_threads or 0, 'crop_size': crop_size or 'original', **result})
+
+    return results
+
+# Non-dominated results
+def pareto_front(results:list, objectives:list) -> list:
+    '''
+    Flags the results that are not dominated by any other result (no other result is at least as good on every
+    objective and better on one). Missing or NaN values are the worst values.
+
+    Arguments:
+    - results (list): The result dictionaries.
+    - objectives (list): The (key, 'min' or 'max') objectives.
+
+    Returns:
+    - list: True for the results on the Pareto front.
+    '''
+    def costs(result):
+        values = []
+        for key, direction in objectives:
+            value = result.get(key, float('nan'))
+            value = float('inf') if value is None or np.isnan(value) else (value if direction == 'min' else -value)
+            values.append(value)
+        return np.array(values)
+
+    points = [costs(result) for result in results]
+    return [not any(np.all(other <= point) and np.any(other < point) for other in points) for point in points]
+
+# Markdown report of the sweep
+def sweep_report(results:list) -> str:
+    columns = ['model', 'backend', 'precision', 'threads', 'input_size', 'mIoU', 'pupil_error_mean_px', 'latency_p50_ms', 'latency_p95_ms', 'pareto_iou', 'pareto_pupil']
+    lines = ['# Segmenter accuracy vs latency sweep', '']
+    for crop_size in dict.fromkeys(result['crop_size'] for result in results):
+        rows = sorted((result for result in results if result['crop_size'] == crop_size and (result['pareto_iou'] or result['pareto_pupil'])), key=lambda result: result['latency_p50_ms'])
+        lines += [f'## Crop size: {crop_size} (Pareto configurations, by latency)', '', '| ' + ' | '.join(columns) + ' |', '|' + '---|' * len(columns)]
+        lines += ['| ' + ' | '.join(f'{result[column]:.4g}' if isinstance(result[column], float) else str(result[column]) for column in columns) + ' |' for result in rows]
+        lines.append('')
+    return '\n'.join(lines)
+
+# Sweep of all the candidate configurations
+def run_sweep(models:list, images_dir:str, masks_dir:str, output_dir:str, backends=('keras',), precisions=('fp32',), threads=(None,), crop_sizes=(None,), buckets=INPUT_SIZE_BUCKETS, upscale:float=1.0, limit:int=None) -> dict:
+    '''
+    Evaluates every configuration (checkpoint x backend x precision x thread count, each one in a fresh process so that
+    the thread count of the TensorFlow runtime applies) on the held-out crops, at every input size bucket and with the
+    adaptive selection. It writes 'sweep_results.json' with all the results and 'sweep_report.md' with the Pareto
+    configurations of latency vs mIoU ('pareto_iou') and of latency vs pupil centre error ('pareto_pupil') for each crop size.
+
+    Arguments:
+    - models (list): The segmentation checkpoints.
+    - images_dir (str): The folder of the held-out eye images.
+    - masks_dir (str): The folder of their label masks.
+    - output_dir (str): The folder of the report.
+    - backends (tuple): The backends (see BACKEND_PRECISIONS). Default is ('keras',).
+    - precisions (tuple): The precisions (the ones not supported by a backend are skipped). Default is ('fp32',).
+    - threads (tuple): The thread counts (None: TensorFlow default). Default is (None,).
+    - crop_sizes (tuple): The longest side the crops are downscaled to (None: original size). Default is (None,).
+    - buckets (tuple): The input sizes. Default is INPUT_SIZE_BUCKETS.
+    - upscale (float): The upscale of the adaptive selection. Default is 1.0.
+    - limit (int): The maximum number of crops. Default is None.
+
+    Returns:
+    - dict: The results of all the configurations (with the Pareto flags) under 'results', and the failed configurations
+    with their error under 'failures' (the content of 'sweep_results.json').
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    configurations = [(model, backend, precision, num_threads) for model, backend, precision, num_threads in itertools.product(models, backends, precisions, threads) if precision in BACKEND_PRECISIONS[backend]]
+
+    results, failures = [], []
+    for model, backend, precision, num_threads in configurations:
+        print(f"Sweeping {os.path.basename(model)} - {backend} - {precision} - {num_threads or 'default'} threads")
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'), initializer=_init_sweep_worker, initargs=(num_threads,)) as executor:
+            try:
+                results += executor.submit(sweep_configuration, model, backend, precision, num_threads, images_dir, masks_dir, crop_sizes, buckets, upscale, limit).result()
+            except Exception as e:
+                print(f"\tFailed: {e}")
+                failures.append({'model': os.path.basename(model), 'backend': backend, 'precision': precision, 'threads': num_threads or 0, 'error': str(e)})
+
+    # Pareto fronts of each crop size (the configurations are compared on the same crops)
+    for crop_size in dict.fromkeys(result['crop_size'] for result in results):
+        subset = [result for result in results if result['crop_size'] == crop_size]
+        for flag, objectives in [('pareto_iou', [('latency_p50_ms', 'min'), ('mIoU', 'max')]), ('pareto_pupil', [('latency_p50_ms', 'min'), ('pupil_error_mean_px', 'min')])]:
+            for result, on_front in zip(subset, pareto_front(subset, objectives)):
+                result[flag] = on_front
+
+    sweep = {'results': results, 'failures': failures}
+    with open(os.path.join(output_dir, 'sweep_results.json'), 'w') as f:
+        json.dump(sweep, f, indent=4)
+    with open(os.path.join(output_dir, 'sweep_report.md'), 'w') as f:
+        f.write(sweep_report(results))
+
+    return sweep
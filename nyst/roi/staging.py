@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+
+# Class that owns the reusable input buffers of a segmentation model
+class InputStaging:
+    '''
+    Staging area of the inputs of a segmentation model. For each input size it keeps a contiguous uint8 buffer of shape
+    (batch, height, width, 3): the eye crops are resized directly into their slot (cv2.resize with dst=), so the model
+    reads the buffer as it is and no array is allocated per crop. The channel order is left as BGR (the model reverses
+    it in its first layer, see bgr_input_model).
+
+    Attributes:
+    - buffers: The input buffers, by (batch, height, width).
+    - scratch_buffers: The single-image work buffers, by (height, width).
+    '''
+    def __init__(self):
+        self.buffers = {}
+        self.scratch_buffers = {}
+
+    def buffer(self, batch:int, width:int, height:int) -> np.ndarray:
+        '''
+        Returns the input buffer of a batch and input size, allocated on first use.
+
+        Arguments:
+        - batch (int): The number of crops.
+        - width (int): The input width of the model.
+        - height (int): The input height of the model.
+
+        Returns:
+        - np.ndarray: The buffer with shape (batch, height, width, 3).
+        '''
+        key = (batch, height, width)
+        if key not in self.buffers:
+            self.buffers[key] = np.empty((batch, height, width, 3), dtype=np.uint8)
+        return self.buffers[key]
+
+    def stage(self, crops:list, width:int, height:int) -> np.ndarray:
+        '''
+        Resizes the crops into the slots of the input buffer.
+
+        Arguments:
+        - crops (list): The BGR eye crops (views of the frame are fine, they are only read).
+        - width (int): The input width of the model.
+        - height (int): The input height of the model.
+
+        Returns:
+        - np.ndarray: The staged batch with shape (len(crops), height, width, 3), valid until the next call with the same size.
+        '''
+        batch = self.buffer(len(crops), width, height)
+        for crop, slot in zip(crops, batch):
+            cv2.resize(crop, (width, height), dst=slot)
+        return batch
+
+    def scratch(self, width:int, height:int) -> np.ndarray:
+        '''
+        Returns a reusable (height, width, 3) uint8 work buffer, e.g. for the masking of a staged crop.
+
+        Arguments:
+        - width (int): The width of the buffer.
+        - height (int): The height of the buffer.
+
+        Returns:
+        - np.ndarray: The work buffer.
+        '''
+        key = (height, width)
+        if key not in self.scratch_buffers:
+            self.scratch_buffers[key] = np.empty((height, width, 3), dtype=np.uint8)
+        return self.scratch_buffers[key]
@@ -14,13 +14,62 @@ class DynamicUpsample(tf.keras.layers.Layer):
     def call(self, inputs, ref_tensor):
         return tf.image.resize(inputs, (tf.shape(ref_tensor)[1], tf.shape(ref_tensor)[2]), method=self.method)
 
-def DeeplabV3Plus(num_classes, filters_conv1=24, filters_conv2=24, filters_spp=128, filters_final=128, dilated_conv_rates =[1, 4, 8, 16]):
-    model_input = keras.Input(shape=(None, None, 3))
-    preprocessed = keras.applications.resnet50.preprocess_input(model_input)
-    resnet50 = keras.applications.ResNet50(weights="imagenet", include_top=False, input_tensor=preprocessed)
+    def get_config(self):
+        return {**super().get_config(), 'method': self.method}
+
+class ChannelReverse(tf.keras.layers.Layer):
+    # Reverses the channel order (BGR <-> RGB) inside the model, so OpenCV frames can be fed as they are read
+    def call(self, inputs):
+        return tf.reverse(inputs, axis=[-1])
+
+# Custom objects needed to load a segmentation checkpoint (any backbone)
+CUSTOM_OBJECTS = {'DynamicUpsample': DynamicUpsample, 'ChannelReverse': ChannelReverse}
+
+# Encoders of DeeplabV3Plus: keras.applications constructor and its arguments. The mobile encoders include their own
+# input preprocessing (RGB 0-255 input, as the ResNet50 one) and are much lighter on CPU than the 25M-parameter ResNet50;
+# the 'minimalistic' MobileNetV3 (no squeeze-excitation, no hard-swish) is the closest to an EfficientNet-lite.
+BACKBONES = {
+    'resnet50': (keras.applications.ResNet50, {}),
+    'mobilenetv3small': (keras.applications.MobileNetV3Small, {}),
+    'mobilenetv3large': (keras.applications.MobileNetV3Large, {}),
+    'mobilenetv3large_minimalistic': (keras.applications.MobileNetV3Large, {'minimalistic': True}),
+    'efficientnetb0': (keras.applications.EfficientNetB0, {}),
+}
+
+def feature_layer_indices(backbone, strides=(16, 4), probe_size=224):
+    """
+    Index in backbone.layers of the last layer at each output stride, found on a copy of the encoder with a fixed
+    input size (the encoder of the model has a dynamic input size).
+    """
+    constructor, kwargs = BACKBONES[backbone]
+    probe = constructor(weights=None, include_top=False, input_shape=(probe_size, probe_size, 3), **kwargs)
+    indices = []
+    for stride in strides:
+        indices.append(max(index for index, layer in enumerate(probe.layers)
+                           if not isinstance(layer.output, list) and len(layer.output.shape) == 4 and layer.output.shape[1] == probe_size // stride))
+    return indices
+
+def backbone_features(model_input, backbone='resnet50', weights="imagenet"):
+    """
+    High level (stride 16) and low level (stride 4) features of the encoder.
+    """
+    if backbone not in BACKBONES:
+        raise ValueError(f"Unsupported backbone: {backbone}. Choose one of {list(BACKBONES)}")
 
-    x = resnet50.get_layer("conv4_block6_2_relu").output
-    input_b = resnet50.get_layer("conv2_block3_2_relu").output
+    # ResNet50: original layers (same architecture of the existing checkpoints)
+    if backbone == 'resnet50':
+        preprocessed = keras.applications.resnet50.preprocess_input(model_input)
+        resnet50 = keras.applications.ResNet50(weights=weights, include_top=False, input_tensor=preprocessed)
+        return resnet50.get_layer("conv4_block6_2_relu").output, resnet50.get_layer("conv2_block3_2_relu").output
+
+    constructor, kwargs = BACKBONES[backbone]
+    encoder = constructor(weights=weights, include_top=False, input_tensor=model_input, **kwargs)
+    high_index, low_index = feature_layer_indices(backbone)
+    return encoder.layers[high_index].output, encoder.layers[low_index].output
+
+def DeeplabV3Plus(num_classes, filters_conv1=24, filters_conv2=24, filters_spp=128, filters_final=128, dilated_conv_rates =[1, 4, 8, 16], backbone='resnet50', weights="imagenet"):
+    model_input = keras.Input(shape=(None, None, 3))
+    x, input_b = backbone_features(model_input, backbone, weights)
 
     x1 = layers.GlobalAveragePooling2D()(x)
     x1 = layers.Reshape((1, 1, x.shape[-1]))(x1)
@@ -61,5 +110,19 @@ def DeeplabV3Plus(num_classes, filters_conv1=24, filters_conv2=24, filters_spp=1
     x = DynamicUpsample()(x, model_input)
 
     model_output = layers.Conv2D(num_classes, kernel_size=(1, 1), padding="same")(x)
-    model = keras.Model(inputs=model_input, outputs=model_output)
+    model = keras.Model(inputs=model_input, outputs=model_output, name=f"deeplabv3plus_{backbone}")
     return model
+
+def load_deeplab(model_path, compile=False):
+    """
+    Loads a DeeplabV3Plus checkpoint with any backbone (the architecture is saved in the checkpoint).
+    """
+    return keras.models.load_model(model_path, custom_objects=CUSTOM_OBJECTS, compile=compile)
+
+def bgr_input_model(model):
+    """
+    Wraps a model trained on RGB images so that it takes BGR images: the channel order is reversed by its first layer
+    instead of a cv2.cvtColor copy of every input. The wrapper shares the weights of the model.
+    """
+    bgr_input = keras.Input(shape=(None, None, 3))
+    return keras.Model(inputs=bgr_input, outputs=model(ChannelReverse()(bgr_input)), name=f"{model.name}_bgr")
@@ -1,14 +1,12 @@
 import os
 from glob import glob
-import pickle
 
 import keras
 from sklearn.model_selection import train_test_split
 
-from deeplab_mdl_def import DeeplabV3Plus
+from deeplab_mdl_def import DeeplabV3Plus, load_deeplab
 from utils import *
 
-from deeplab_mdl_def import DynamicUpsample
 
 import numpy as np
 from PIL import Image
@@ -27,6 +25,7 @@ IMAGE_SIZE = 448
 BATCH_SIZE = 16
 NUM_CLASSES = 4
 NUM_EPOCHS = 100
+BACKBONE = 'resnet50'  # Encoder of the model, one of BACKBONES (e.g. 'mobilenetv3large_minimalistic' for CPU inference)
 CALCULATE_CLASS_WEIGHTS = False
 RELOAD_TRAINED_MODEL= False
 DATA_DIR = "/repo/porri/Eyes Segmentation Dataset"
@@ -35,6 +34,12 @@ VAL_IMG_FRAC = 0.2
 TEST_IMG_FRAC = 0.1
 SUBSET = False
 SUBSET_SIZE = 240
+# Pre-decoded shards (written once for each split, then read instead of the PNG files)
+USE_SHARDS = True
+SHARD_FORMAT = 'tfrecord'  # 'tfrecord' or 'memmap'
+SHARD_SIZE = 256
+SHARD_IMAGE_SIZE = 512  # Same size of read_image (the random crop of augment is 512x512)
+SHARD_DIR = os.path.join(DATA_DIR, "Shards")
 COLORMAP = patch_colors_bgr_01 = {
     "background": [0, 0, 0],  # BGR
     "pupil": [1, 0, 0],   # BGR 
@@ -70,30 +75,36 @@ print("Val Masks: {} | expected: {}".format(len(val_masks), NUM_VAL_IMAGES))
 print("Test Images: {} | expected: {}".format(len(test_images), NUM_TEST_IMAGES))
 print("Test Masks: {} | expected: {}".format(len(test_masks), NUM_TEST_IMAGES))
 
-train_dataset = data_generator(train_images,train_masks, BATCH_SIZE)
-val_dataset = data_generator(val_images, val_masks, BATCH_SIZE)
-test_dataset = data_generator(test_images, test_masks, BATCH_SIZE)
+if USE_SHARDS:
+    # Convert each split only if its shards are missing or were written from other files
+    for split, images, masks in [('train', train_images, train_masks), ('val', val_images, val_masks), ('test', test_images, test_masks)]:
+        split_dir = os.path.join(SHARD_DIR, split)
+        if not shards_up_to_date(split_dir, images, masks, SHARD_IMAGE_SIZE, SHARD_FORMAT):
+            print(f"Writing {split} shards...")
+            write_shards(images, masks, split_dir, SHARD_IMAGE_SIZE, SHARD_SIZE, SHARD_FORMAT)
+
+    train_dataset = shard_data_generator(os.path.join(SHARD_DIR, 'train'), BATCH_SIZE)
+    val_dataset = shard_data_generator(os.path.join(SHARD_DIR, 'val'), BATCH_SIZE, augment_data=False, shuffle=False)
+    test_dataset = shard_data_generator(os.path.join(SHARD_DIR, 'test'), BATCH_SIZE, augment_data=False, shuffle=False)
+else:
+    train_dataset = data_generator(train_images,train_masks, BATCH_SIZE)
+    val_dataset = data_generator(val_images, val_masks, BATCH_SIZE)
+    test_dataset = data_generator(test_images, test_masks, BATCH_SIZE)
 test_dataset_no_resize = data_generator(test_images, test_masks, BATCH_SIZE, augment_data=False, resize_image=False)
 
-if CALCULATE_CLASS_WEIGHTS or not os.path.exists('class_weights.pkl'):
-    print("Calculating class weights...")
-    class_weights = read_masks_and_compute_weights(os.path.join(DATA_DIR, "Masks_g/"))
-    with open('class_weights.pkl', 'wb') as pickle_file:
-        pickle.dump(class_weights, pickle_file)
-else:
-    print("Reloading class weights pickle...")
-    with open('class_weights.pkl', 'rb') as pickle_file:
-        class_weights = pickle.load(pickle_file)
+# Class weights cached by the fingerprint of the mask files (computed again when the masks change)
+print("Computing (or reloading) class weights...")
+class_weights = cached_class_weights(os.path.join(DATA_DIR, "Masks_g/"), 'class_weights.json', recompute=CALCULATE_CLASS_WEIGHTS)
 
 print("All done, class weights:")
 print(class_weights)
 #mdlname = "deeplabv3plus_face_segmentation_augmentation_class_weights_latest_fixConv.h5"
 #mdlname = "eyes_seg.h5"
-mdlname = "eyes_seg_threshold.h5"
+mdlname = "eyes_seg_threshold.h5" if BACKBONE == 'resnet50' else f"eyes_seg_threshold_{BACKBONE}.h5"
 
 if not RELOAD_TRAINED_MODEL or not os.path.exists(mdlname):
     print("Training model...")
-    model = DeeplabV3Plus(num_classes=NUM_CLASSES)
+    model = DeeplabV3Plus(num_classes=NUM_CLASSES, backbone=BACKBONE)
     loss = keras.losses.SparseCategoricalCrossentropy(from_logits=True)
     # loss = focal_loss_multiclass(alpha=0.25, gamma=2.0)
     model.compile(
@@ -135,7 +146,7 @@ if not RELOAD_TRAINED_MODEL or not os.path.exists(mdlname):
     plt.show()
 else:
     print("Reloading model...")
-    model = keras.models.load_model(mdlname, custom_objects={'DynamicUpsample': DynamicUpsample})
+    model = load_deeplab(mdlname, compile=True)
 
 # test for different image sizes
 print("Evaluating model on images with different sizes")
@@ -0,0 +1,24 @@
+import os
+import argparse
+from glob import glob
+
+from utils import write_shards, SHARD_FORMATS
+
+# Conversion of an image/mask folder pair into pre-resized shards (see shard_data_generator)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert the segmentation images and masks into sharded TFRecord or uint8 memmap files.')
+    parser.add_argument('--images', required=True, help='Folder of the images')
+    parser.add_argument('--masks', required=True, help='Folder of the masks (same sorted order of the images)')
+    parser.add_argument('--output', required=True, help='Folder of the shards')
+    parser.add_argument('--image-size', type=int, default=512, help='Side of the resized images and masks')
+    parser.add_argument('--shard-size', type=int, default=256, help='Image/mask pairs of each shard')
+    parser.add_argument('--format', default='tfrecord', choices=SHARD_FORMATS, help='Shard format')
+    args = parser.parse_args()
+
+    images = sorted(glob(os.path.join(args.images, '*')))
+    masks = sorted(glob(os.path.join(args.masks, '*')))
+    if len(images) != len(masks):
+        raise ValueError(f"{len(images)} images but {len(masks)} masks")
+
+    info = write_shards(images, masks, args.output, args.image_size, args.shard_size, args.format)
+    print(f"{info['n_pairs']} pairs written in {info['n_shards']} {info['format']} shards to {args.output}")
@@ -1,42 +1,146 @@
 import cv2
 import os
+import json
+import argparse
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+# File della palette e degli istogrammi delle classi nella directory di output
+PALETTE_FILE = 'palette.json'
+HISTOGRAMS_FILE = 'class_histograms.json'
+
+# Tabella di lookup (256 livelli di grigio -> classe) di una palette
+def palette_lut(palette):
+    # I livelli di grigio non presenti nella palette diventano sfondo (classe 0)
+    lut = np.zeros(256, dtype=np.uint8)
+    lut[np.asarray(palette, dtype=np.intp)] = np.arange(len(palette), dtype=np.uint8)
+    return lut
 
 # Funzione per convertire un'immagine in scala di grigi e rimappare i livelli di grigio
-def convert_and_remap_gray(img):
+def convert_and_remap_gray(img, lut=None):
     # Converti l'immagine in scala di grigi
-    gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
     '''cv2.imshow("gray",gray_img)
     cv2.waitKey(100000)'''
-    unique_gray_levels = np.unique(gray_img)
-    
-    # Rimappa i livelli di grigio
-    remapped_gray_img = np.zeros_like(gray_img)
-    mapped_class = 0
-    for level in unique_gray_levels:
-        remapped_gray_img[gray_img == level] = mapped_class
-        mapped_class += 1
 
-    return remapped_gray_img
+    # Senza palette i livelli presenti nell'immagine vengono numerati in ordine crescente
+    if lut is None:
+        unique_gray_levels = np.flatnonzero(np.bincount(gray_img.ravel(), minlength=256))
+        lut = palette_lut(unique_gray_levels)
+
+    # Rimappa i livelli di grigio con un solo passaggio sulla tabella
+    return cv2.LUT(gray_img, lut)
+
+# Istogramma dei livelli di grigio di una maschera
+def gray_histogram(img_path):
+    gray_img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+    return np.bincount(gray_img.ravel(), minlength=256)
+
+# Elenco delle maschere di una directory (percorsi relativi)
+def list_masks(input_dir):
+    return sorted(os.path.relpath(os.path.join(root, file), input_dir) for root, dirs, files in os.walk(input_dir) for file in files if file.endswith('.png'))
+
+# Palette globale: tutti i livelli di grigio presenti nel dataset, in ordine crescente
+def build_palette(input_dir, workers=None):
+    masks = list_masks(input_dir)
+    histogram = np.zeros(256, dtype=np.int64)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for file_histogram in tqdm(executor.map(gray_histogram, [os.path.join(input_dir, mask) for mask in masks]), total=len(masks), desc="Building palette"):
+            histogram += file_histogram
+    return [int(level) for level in np.flatnonzero(histogram)]
+
+# Conversione di una maschera (saltata se l'output è più recente dell'input)
+def convert_file(img_path, output_path, palette, lut, force=False):
+    if not force and os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(img_path):
+        return None
+
+    img = cv2.imread(img_path)
+    gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    remapped_gray_img = convert_and_remap_gray(gray_img, lut)
+
+    # Livelli di grigio fuori dalla palette (convertiti in sfondo)
+    gray_counts = np.bincount(gray_img.ravel(), minlength=256)
+    known = np.zeros(256, dtype=bool)
+    known[palette] = True
+    unknown_levels = [int(level) for level in np.flatnonzero(gray_counts * ~known)]
+
+    # Crea la directory di destinazione se non esiste
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    # Salva l'immagine convertita
+    cv2.imwrite(output_path, remapped_gray_img)
+
+    # Istogramma delle classi della maschera
+    return np.bincount(remapped_gray_img.ravel(), minlength=len(palette)), unknown_levels
 
 # Funzione per ciclare attraverso le directory e convertire le immagini
-def process_images(input_dir, output_dir):
-    for root, dirs, files in os.walk(input_dir):
-        for file in files:
-            if file.endswith('.png'):  # Aggiungi altri formati di immagine se necessario
-                img_path = os.path.join(root, file)
-                img = cv2.imread(img_path)
-                remapped_gray_img = convert_and_remap_gray(img)
-
-                # Crea la directory di destinazione se non esiste
-                relative_path = os.path.relpath(root, input_dir)
-                output_subdir = os.path.join(output_dir, relative_path)
-                if not os.path.exists(output_subdir):
-                    os.makedirs(output_subdir)
-
-                # Salva l'immagine convertita
-                output_path = os.path.join(output_subdir, file)
-                cv2.imwrite(output_path, remapped_gray_img)
+def process_images(input_dir, output_dir, palette=None, workers=None, force=False):
+    '''
+    Converte tutte le maschere di input_dir in maschere di classi (0, 1, ...) con una palette globale, usando un pool
+    di thread e saltando le maschere già aggiornate.
+
+    Arguments:
+    - input_dir (str): La directory delle maschere originali.
+    - output_dir (str): La directory delle maschere convertite (con 'palette.json' e 'class_histograms.json').
+    - palette (list): I livelli di grigio delle classi, in ordine. Default None (quella salvata in output_dir, o tutti i livelli del dataset).
+    - workers (int): Il numero di thread. Default None (uno per core).
+    - force (bool): Converte anche le maschere già aggiornate. Default False.
+
+    Returns:
+    - dict: La palette, il numero di maschere convertite e saltate e l'istogramma delle classi del dataset.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    palette_path = os.path.join(output_dir, PALETTE_FILE)
+    histograms_path = os.path.join(output_dir, HISTOGRAMS_FILE)
+
+    # Palette salvata dalla conversione precedente
+    saved_palette = None
+    if os.path.exists(palette_path):
+        with open(palette_path) as f:
+            saved_palette = json.load(f)
+    palette = palette or saved_palette or build_palette(input_dir, workers)
+
+    # Con una palette diversa tutte le maschere vanno riconvertite
+    force = force or palette != saved_palette
+    with open(palette_path, 'w') as f:
+        json.dump(palette, f)
+    lut = palette_lut(palette)
+
+    # Istogrammi delle classi delle maschere già convertite
+    histograms = {}
+    if os.path.exists(histograms_path) and not force:
+        with open(histograms_path) as f:
+            histograms = json.load(f)
+
+    masks = list_masks(input_dir)
+    converted, skipped, unknown = 0, 0, {}
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        jobs = [executor.submit(convert_file, os.path.join(input_dir, mask), os.path.join(output_dir, mask), palette, lut, force) for mask in masks]
+        for mask, job in tqdm(zip(masks, jobs), total=len(masks), desc="Converting masks"):
+            result = job.result()
+            if result is None:
+                # Maschera già aggiornata: l'istogramma viene letto dall'output solo se manca
+                skipped += 1
+                if mask not in histograms:
+                    histograms[mask] = np.bincount(cv2.imread(os.path.join(output_dir, mask), cv2.IMREAD_GRAYSCALE).ravel(), minlength=len(palette)).tolist()
+                continue
+            converted += 1
+            class_counts, unknown_levels = result
+            histograms[mask] = class_counts.tolist()
+            if unknown_levels:
+                unknown[mask] = unknown_levels
+
+    with open(histograms_path, 'w') as f:
+        json.dump(histograms, f)
+
+    if unknown:
+        print(f"Attenzione: {len(unknown)} maschere con livelli di grigio fuori dalla palette (convertiti in sfondo), ad esempio {next(iter(unknown.items()))}")
+
+    # Istogramma delle classi del dataset
+    class_histogram = np.sum([histograms[mask][:len(palette)] for mask in masks], axis=0) if masks else np.zeros(len(palette), dtype=np.int64)
+
+    return {'palette': palette, 'converted': converted, 'skipped': skipped, 'class_histogram': [int(count) for count in class_histogram], 'unknown_levels': unknown}
 
 # Funzione per stampare i livelli di grigio presenti in un'immagine
 def print_gray_levels(img_path):
@@ -46,12 +150,22 @@ def print_gray_levels(img_path):
     for level in unique_gray_levels:
         print(level)
 
-# Definisci le directory di input e output
-input_directory = '/repo/porri/Eyes Segmentation Dataset/Masks'
-output_directory = '/repo/porri/Eyes Segmentation Dataset/Masks_g'
 
-# Esegui la conversione
-process_images(input_directory, output_directory)
+if __name__ == '__main__':
+    # Definisci le directory di input e output
+    parser = argparse.ArgumentParser(description='Converte le maschere in scala di grigi in maschere di classi con una palette globale.')
+    parser.add_argument('--input', default='/repo/porri/Eyes Segmentation Dataset/Masks', help='Directory delle maschere originali')
+    parser.add_argument('--output', default='/repo/porri/Eyes Segmentation Dataset/Masks_g', help='Directory delle maschere convertite')
+    parser.add_argument('--palette', type=int, nargs='+', default=None, help='Livelli di grigio delle classi, in ordine (default: tutti quelli del dataset)')
+    parser.add_argument('--workers', type=int, default=None, help='Numero di thread')
+    parser.add_argument('--force', action='store_true', help='Riconverte anche le maschere già aggiornate')
+    args = parser.parse_args()
+
+    # Esegui la conversione
+    report = process_images(args.input, args.output, args.palette, args.workers, args.force)
+    print(f"Maschere convertite: {report['converted']}, già aggiornate: {report['skipped']}")
+    for class_id, (level, count) in enumerate(zip(report['palette'], report['class_histogram'])):
+        print(f"Classe {class_id} (livello di grigio {level}): {count} pixel")
 
 '''
 # Esempio di utilizzo
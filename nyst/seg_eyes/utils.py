@@ -8,9 +8,13 @@ import matplotlib.pyplot as plt
 import cv2
 import tensorflow as tf
 import os
+import json
+import hashlib
+from glob import glob
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
-def read_image(image_path, mask=False, resize_img=True, new_image_size=512):
+def read_image(image_path, mask=False, resize_img=True, new_image_size=512, method='bilinear'):
     image = tf_io.read_file(image_path)
     if mask:
         n_channels= 1
@@ -19,7 +23,7 @@ def read_image(image_path, mask=False, resize_img=True, new_image_size=512):
     image = tf_image.decode_png(image, channels=n_channels)
     if resize_img:
         image.set_shape([None, None, n_channels])
-        image = tf_image.resize(images=image, size=[new_image_size, new_image_size])
+        image = tf_image.resize(images=image, size=[new_image_size, new_image_size], method=method)
 
     '''
     if mask:
@@ -121,6 +125,162 @@ def data_generator(image_list, mask_list, batch_size, augment_data=True, resize_
 
     return dataset
 
+# Shard files of a converted dataset
+SHARD_FORMATS = ['tfrecord', 'memmap']
+SHARD_INFO = 'shards.json'
+
+def decoded_pairs(image_list, mask_list, new_image_size=512):
+    """
+    Decodes and resizes the image/mask pairs in parallel (tf.data), as uint8 numpy arrays.
+    The images are resized as in read_image (bilinear), the masks with nearest neighbour so that they keep the class values.
+    """
+    def load(image_path, mask_path):
+        image = read_image(image_path, new_image_size=new_image_size)
+        mask = read_image(mask_path, mask=True, new_image_size=new_image_size, method='nearest')
+        return tf.cast(tf.round(tf.clip_by_value(image, 0.0, 255.0)), tf.uint8), tf.cast(mask, tf.uint8)
+
+    dataset = tf_data.Dataset.from_tensor_slices((image_list, mask_list))
+    dataset = dataset.map(load, num_parallel_calls=tf_data.AUTOTUNE).prefetch(tf_data.AUTOTUNE)
+    return dataset.as_numpy_iterator()
+
+def files_stats(filepaths):
+    # Size and modification time of each file: they change if a file is rewritten in place
+    return [[os.stat(filepath).st_size, os.stat(filepath).st_mtime_ns] for filepath in filepaths]
+
+def write_shards(image_list, mask_list, output_dir, new_image_size=512, shard_size=256, shard_format='tfrecord'):
+    """
+    Converts the image/mask pairs once into shards of pre-resized uint8 pairs, read by shard_data_generator.
+    Args:
+    - image_list, mask_list (list): The paths of the images and of the corresponding masks.
+    - output_dir (str): The folder of the shards (with the 'shards.json' description of the conversion).
+    - new_image_size (int): The side of the resized images and masks.
+    - shard_size (int): The number of pairs of each shard.
+    - shard_format (str): 'tfrecord' (one serialized tf.train.Example per pair) or 'memmap' (two .npy arrays per shard).
+
+    Returns:
+    - info (dict): The description of the shards.
+    """
+    if shard_format not in SHARD_FORMATS:
+        raise ValueError(f"Unsupported shard format: {shard_format}. Choose one of {SHARD_FORMATS}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Stats of the sources before the conversion (a file edited while converting makes the shards stale)
+    image_stats, mask_stats = files_stats(image_list), files_stats(mask_list)
+
+    n_pairs = len(image_list)
+    n_shards = max(1, -(-n_pairs // shard_size))
+    pairs = decoded_pairs(image_list, mask_list, new_image_size)
+
+    for shard in tqdm(range(n_shards), desc="Writing shards"):
+        shard_pairs = min(shard_size, n_pairs - shard * shard_size)
+        name = os.path.join(output_dir, f"shard-{shard:05d}-of-{n_shards:05d}")
+
+        if shard_format == 'tfrecord':
+            with tf.io.TFRecordWriter(name + '.tfrecord') as writer:
+                for _ in range(shard_pairs):
+                    image, mask = next(pairs)
+                    features = {
+                        'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[image.tobytes()])),
+                        'mask': tf.train.Feature(bytes_list=tf.train.BytesList(value=[mask.tobytes()]))
+                    }
+                    writer.write(tf.train.Example(features=tf.train.Features(feature=features)).SerializeToString())
+        else:
+            images = np.lib.format.open_memmap(name + '.images.npy', mode='w+', dtype=np.uint8, shape=(shard_pairs, new_image_size, new_image_size, 3))
+            masks = np.lib.format.open_memmap(name + '.masks.npy', mode='w+', dtype=np.uint8, shape=(shard_pairs, new_image_size, new_image_size, 1))
+            for i in range(shard_pairs):
+                images[i], masks[i] = next(pairs)
+            images.flush()
+            masks.flush()
+            del images, masks
+
+    # Description of the conversion (written last: a folder without it is an incomplete conversion)
+    info = {'format': shard_format, 'image_size': new_image_size, 'n_pairs': n_pairs, 'n_shards': n_shards,
+            'images': [str(path) for path in image_list], 'masks': [str(path) for path in mask_list],
+            'image_stats': image_stats, 'mask_stats': mask_stats}
+    with open(os.path.join(output_dir, SHARD_INFO), 'w') as f:
+        json.dump(info, f, indent=4)
+    return info
+
+def shards_up_to_date(shard_dir, image_list, mask_list, new_image_size=512, shard_format='tfrecord'):
+    """
+    Checks if shard_dir holds a complete conversion of the same pairs, size and format, with the source files unchanged
+    (same size and modification time) since the conversion.
+    """
+    info_path = os.path.join(shard_dir, SHARD_INFO)
+    if not os.path.exists(info_path):
+        return False
+    with open(info_path) as f:
+        info = json.load(f)
+    return (info['format'] == shard_format and info['image_size'] == new_image_size and
+            info['images'] == [str(path) for path in image_list] and info['masks'] == [str(path) for path in mask_list] and
+            info.get('image_stats') == files_stats(image_list) and info.get('mask_stats') == files_stats(mask_list))
+
+def read_memmap_shard(images_path):
+    # Pairs of a memmap shard, read lazily from the page cache
+    images_path = images_path.decode() if isinstance(images_path, bytes) else images_path
+    images = np.load(images_path, mmap_mode='r')
+    masks = np.load(images_path.replace('.images.npy', '.masks.npy'), mmap_mode='r')
+    for i in range(len(images)):
+        yield images[i], masks[i]
+
+def shard_data_generator(shard_dir, batch_size, augment_data=True, shuffle=True, shuffle_buffer=1024, cache=True):
+    """
+    Dataset of the shards written by write_shards: the shards are read in parallel (interleave), the decoded uint8 pairs
+    are cached after the first epoch and reshuffled at every epoch, and the augmentation is drawn again at every epoch
+    (each pair is augmented with the probability of augment, instead of a fixed augmented copy of the dataset).
+    Args:
+    - shard_dir (str): The folder of the shards.
+    - batch_size (int): The batch size.
+    - augment_data (bool): Apply the random augmentation.
+    - shuffle (bool): Shuffle the shards and the pairs at every epoch (False for validation and test).
+    - shuffle_buffer (int): The number of pairs of the shuffle buffer.
+    - cache (bool or str): Cache the decoded pairs in memory (True), in a file (path) or not at all (False).
+
+    Returns:
+    - dataset (tf.data.Dataset): Batches of float32 images (0-255) and masks, as data_generator.
+    """
+    with open(os.path.join(shard_dir, SHARD_INFO)) as f:
+        info = json.load(f)
+    size = info['image_size']
+
+    if info['format'] == 'tfrecord':
+        files = sorted(glob(os.path.join(shard_dir, '*.tfrecord')))
+
+        def read_shard(path):
+            return tf_data.TFRecordDataset(path)
+
+        def parse(record):
+            example = tf_io.parse_single_example(record, {'image': tf_io.FixedLenFeature([], tf.string), 'mask': tf_io.FixedLenFeature([], tf.string)})
+            image = tf.reshape(tf_io.decode_raw(example['image'], tf.uint8), [size, size, 3])
+            mask = tf.reshape(tf_io.decode_raw(example['mask'], tf.uint8), [size, size, 1])
+            return image, mask
+    else:
+        files = sorted(glob(os.path.join(shard_dir, '*.images.npy')))
+        signature = (tf.TensorSpec((size, size, 3), tf.uint8), tf.TensorSpec((size, size, 1), tf.uint8))
+
+        def read_shard(path):
+            return tf_data.Dataset.from_generator(read_memmap_shard, output_signature=signature, args=(path,))
+
+        parse = None
+
+    dataset = tf_data.Dataset.from_tensor_slices(files)
+    if shuffle:
+        dataset = dataset.shuffle(len(files), reshuffle_each_iteration=True)
+    dataset = dataset.interleave(read_shard, cycle_length=min(len(files), 8), num_parallel_calls=tf_data.AUTOTUNE, deterministic=not shuffle)
+    if parse is not None:
+        dataset = dataset.map(parse, num_parallel_calls=tf_data.AUTOTUNE)
+
+    # Cache the uint8 pairs (4x smaller than float32), everything after the cache is recomputed at every epoch
+    if cache:
+        dataset = dataset.cache(cache if isinstance(cache, str) else '')
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer, reshuffle_each_iteration=True)
+    dataset = dataset.map(lambda image, mask: (tf.cast(image, tf.float32), tf.cast(mask, tf.float32)), num_parallel_calls=tf_data.AUTOTUNE)
+    if augment_data:
+        dataset = dataset.map(augment, num_parallel_calls=tf_data.AUTOTUNE)
+
+    return dataset.batch(batch_size, drop_remainder=True).prefetch(tf_data.AUTOTUNE)
+
 def infer(model, image_tensor):
     predictions = model.predict(np.expand_dims((image_tensor), axis=0), verbose=0)
     predictions = np.squeeze(predictions)
@@ -133,15 +293,11 @@ def decode_segmentation_masks(mask, colormap, n_classes=11):
     colormap = np.array(colormap) * 100
     colormap = colormap.astype(np.uint8)
 
-    r = np.zeros_like(mask).astype(np.uint8)
-    g = np.zeros_like(mask).astype(np.uint8)
-    b = np.zeros_like(mask).astype(np.uint8)
-    for l in range(0, n_classes):
-        idx = mask == l
-        r[idx] = colormap[l, 0]
-        g[idx] = colormap[l, 1]
-        b[idx] = colormap[l, 2]
-    rgb = np.stack([r, g, b], axis=2)
+    # Palette lookup: the labels outside the first n_classes are black
+    mask = np.asarray(mask)
+    lut = np.zeros((max(n_classes, int(mask.max()) + 1), 3), dtype=np.uint8)
+    lut[:len(colormap[:n_classes])] = colormap[:n_classes]
+    rgb = lut[mask]
 
     # rgb = np.zeros((mask.shape[0], mask.shape[1], 3), dtype=np.uint8)
     # for l in range(0, n_classes):
@@ -246,20 +402,37 @@ def focal_loss_multiclass(alpha=0.25, gamma=2.0, num_classes=2, alpha_tensor=Non
 
     return focal_loss_fixed
 
-def read_masks_and_compute_weights(directory, normalize=True, background_increase=0.1):
-    class_counts = {}
-    total_pixels = 0
-
-    for filename in tqdm(os.listdir(directory)):
-        if filename.endswith('.png'):
-            filepath = os.path.join(directory, filename)
-            with Image.open(filepath) as img:
-                mask = np.array(img)
-                for class_value in np.unique(mask):
-                    if class_value not in class_counts:
-                        class_counts[class_value] = 0
-                    class_counts[class_value] += np.sum(mask == class_value)
-                total_pixels += mask.size
+# Pixel count of every value of a mask
+def mask_histogram(filepath):
+    with Image.open(filepath) as img:
+        return np.bincount(np.asarray(img).ravel(), minlength=256)
+
+def masks_fingerprint(filepaths):
+    """
+    Hash of the mask files (name, size and modification time): it changes if a mask is added, removed or rewritten.
+    """
+    digest = hashlib.sha256()
+    for filepath in sorted(filepaths):
+        stat = os.stat(filepath)
+        digest.update(f"{os.path.basename(filepath)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+def class_histogram(filepaths, workers=None):
+    """
+    Total pixel count of every class value over all the masks. The masks are decoded by a thread pool
+    (the PNG decoding releases the GIL) and counted with np.bincount.
+    """
+    histogram = np.zeros(256, dtype=np.int64)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for mask_counts in tqdm(executor.map(mask_histogram, filepaths, chunksize=64), total=len(filepaths)):
+            histogram[:len(mask_counts)] += mask_counts
+    return histogram
+
+def read_masks_and_compute_weights(directory, normalize=True, background_increase=0.1, workers=None):
+    filepaths = [os.path.join(directory, filename) for filename in os.listdir(directory) if filename.endswith('.png')]
+    histogram = class_histogram(filepaths, workers)
+    class_counts = {int(class_value): int(histogram[class_value]) for class_value in np.flatnonzero(histogram)}
+    total_pixels = int(histogram.sum())
 
     cw = {}
     if normalize:
@@ -280,6 +453,38 @@ def read_masks_and_compute_weights(directory, normalize=True, background_increas
 
     return cw
 
+def cached_class_weights(directory, cache_file='class_weights.json', normalize=True, background_increase=0.1, workers=None, recompute=False):
+    """
+    Class weights of the masks of a directory, cached in a JSON file by the fingerprint of the mask files and the
+    weighting parameters: the weights are computed again automatically when the masks change.
+    Args:
+    - directory (str): The folder of the masks.
+    - cache_file (str): The JSON cache (one entry for each fingerprint).
+    - normalize, background_increase: As read_masks_and_compute_weights.
+    - workers (int): The decoding threads (default: one per core).
+    - recompute (bool): Ignore the cached entry.
+
+    Returns:
+    - cw (dict): The weight of each class value.
+    """
+    filepaths = [os.path.join(directory, filename) for filename in os.listdir(directory) if filename.endswith('.png')]
+    key = f"{masks_fingerprint(filepaths)}-{normalize}-{background_increase}"
+
+    cache = {}
+    if os.path.exists(cache_file):
+        with open(cache_file) as f:
+            cache = json.load(f)
+
+    if not recompute and key in cache:
+        return {int(class_value): weight for class_value, weight in cache[key].items()}
+
+    cw = read_masks_and_compute_weights(directory, normalize, background_increase, workers)
+    cache[key] = {str(class_value): weight for class_value, weight in cw.items()}
+    with open(cache_file + '.tmp', 'w') as f:
+        json.dump(cache, f, indent=4)
+    os.replace(cache_file + '.tmp', cache_file)
+    return cw
+
 def load_and_preprocess_image(image_path,image_size=448):
     image = Image.open(image_path)
     image = image.resize((image_size, image_size))
@@ -325,29 +530,67 @@ def apply_mask_to_image(original_image, mask):
 
     masked_image = original_image * (mask.astype(original_image.dtype) // 255)
     return masked_image
-def remove_background(dataset_dir, output_dir, model, image_size, close_iterations=5, erode_iterations=5):
+# Images read by a thread pool, one batch ahead of the segmenter
+def image_batches(image_paths, image_size, batch_size=16, workers=None):
+    """
+    Yields the index of the first image and the stacked images (batch_size, image_size, image_size, 3) of each batch,
+    while the images of the next batch are being read and decoded.
+    """
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        def submit(start):
+            return [executor.submit(load_and_preprocess_image, path, image_size) for path in image_paths[start:start + batch_size]]
+
+        pending = submit(0)
+        for start in range(0, len(image_paths), batch_size):
+            batch = [future.result() for future in pending]
+            pending = submit(start + batch_size)
+            yield start, np.stack(batch)
+
+def infer_batch(model, images):
+    predictions = model.predict_on_batch(images)
+    return np.argmax(predictions, axis=-1)
+
+def segment_images(jobs, model, image_size, postprocess, batch_size=16, workers=None, desc="Segmenting images"):
+    """
+    Batched segmentation engine: the images are read by a thread pool, segmented in batches and post-processed and
+    saved asynchronously by a second thread pool (at most two batches are waiting to be written).
+    Args:
+    - jobs (list): (image_path, output) pairs, the output is passed to postprocess.
+    - model: The segmentation model.
+    - image_size (int): The side of the resized images.
+    - postprocess (function): Called as postprocess(image, predictions, output) for every image.
+    - batch_size (int): The images of each forward pass.
+    - workers (int): The threads of each pool (default: one per core).
+    """
+    image_paths = [image_path for image_path, _ in jobs]
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as writer:
+        in_flight = []
+        for start, images in tqdm(image_batches(image_paths, image_size, batch_size, workers), total=-(-len(jobs) // batch_size), desc=desc):
+            predictions = infer_batch(model, images)
+            done, in_flight = in_flight, [writer.submit(postprocess, image, prediction, output) for image, prediction, (_, output) in zip(images, predictions, jobs[start:start + batch_size])]
+            for future in done:
+                future.result()
+        for future in in_flight:
+            future.result()
+
+def remove_background(dataset_dir, output_dir, model, image_size, close_iterations=5, erode_iterations=5, batch_size=16, workers=None):
+    jobs = []
     for split in ['Train', 'Test', 'Valid']:
         for condition in ['Real', 'Fake']:
             input_dir = os.path.join(dataset_dir, split, condition)
             output_split_dir = os.path.join(output_dir, split, condition)
             os.makedirs(output_split_dir, exist_ok=True)
+            jobs += [(os.path.join(input_dir, image_name), os.path.join(output_split_dir, image_name)) for image_name in os.listdir(input_dir)]
 
-            for image_name in tqdm(os.listdir(input_dir), desc=f"Segmenting {split} {condition} images"):
-                image_path = os.path.join(input_dir, image_name)
-                save_path = os.path.join(output_split_dir, image_name)
-
-                image_tensor = load_and_preprocess_image(image_path, image_size)
-                predictions = infer(model, image_tensor)
-
-                filled_predictions = fill_holes(predictions, close_iterations=close_iterations, erode_iterations=erode_iterations)
+    def postprocess(image, predictions, save_path):
+        filled_predictions = fill_holes(predictions, close_iterations=close_iterations, erode_iterations=erode_iterations)
+        masked_image = apply_mask_to_image(image, filled_predictions)
+        save_image(masked_image, save_path)
 
-                original_image = load_and_preprocess_image(image_path, image_size)
-                masked_image = apply_mask_to_image(original_image, filled_predictions)
+    segment_images(jobs, model, image_size, postprocess, batch_size, workers, desc="Removing background")
 
-                save_image(masked_image, save_path)
 
-
-def process_dataset_by_class(dataset_dir, output_dir, model, image_size, num_classes):
+def process_dataset_by_class(dataset_dir, output_dir, model, image_size, num_classes, batch_size=16, workers=None):
 
     for class_id in range(num_classes):
         class_dir = os.path.join(output_dir, f"Dataset_{class_id}")
@@ -355,27 +598,20 @@ def process_dataset_by_class(dataset_dir, output_dir, model, image_size, num_cla
             for condition in ['Real', 'Fake']:
                 os.makedirs(os.path.join(class_dir, split, condition), exist_ok=True)
 
-
+    jobs = []
     for split in ['Train', 'Test', 'Valid']:
         for condition in ['Real', 'Fake']:
             input_dir = os.path.join(dataset_dir, split, condition)
-
-            for image_name in tqdm(os.listdir(input_dir), desc=f"Processing {split} {condition} images"):
-                image_path = os.path.join(input_dir, image_name)
-                image_tensor = load_and_preprocess_image(image_path, image_size)
-                predictions = infer(model, image_tensor)
-
-                for class_id in range(num_classes):
-                    class_predictions = (predictions == class_id).astype(np.uint8)
-                    filled_mask = fill_holes(class_predictions)
-
-
-                    original_image = load_and_preprocess_image(image_path, image_size)
-
-
-                    masked_image = apply_mask_to_image(original_image, filled_mask)
-
-
-                    save_path = os.path.join(output_dir, f"Dataset_{class_id}", split, condition, image_name)
-                    save_image(masked_image, save_path)
-
+            jobs += [(os.path.join(input_dir, image_name), (split, condition, image_name)) for image_name in os.listdir(input_dir)]
+
+    # All the classes are post-processed from the same decoded image and prediction
+    def postprocess(image, predictions, output):
+        split, condition, image_name = output
+        for class_id in range(num_classes):
+            class_predictions = (predictions == class_id).astype(np.uint8)
+            filled_mask = fill_holes(class_predictions)
+            masked_image = apply_mask_to_image(image, filled_mask)
+            save_path = os.path.join(output_dir, f"Dataset_{class_id}", split, condition, image_name)
+            save_image(masked_image, save_path)
+
+    segment_images(jobs, model, image_size, postprocess, batch_size, workers, desc="Processing images by class")
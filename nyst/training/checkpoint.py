@@ -0,0 +1,61 @@
+import os
+import torch
+
+
+# Save the training state of a fold
+def save_checkpoint(checkpoint_path:str, model, optimizer, epoch:int, state:dict) -> None:
+    '''
+    Saves the model and optimizer state, the next epoch to run, the training state (best weights, early stopping
+    counters, statistics) and the random number generator state. The file is replaced atomically, so a process killed
+    while saving leaves the previous checkpoint intact.
+
+    Arguments:
+    - checkpoint_path (str): The checkpoint file.
+    - model (nn.Module): The model.
+    - optimizer: The optimizer.
+    - epoch (int): The number of completed epochs.
+    - state (dict): The other values needed to continue the training.
+    '''
+    checkpoint = {
+        'model': model.state_dict(),
+        'optimizer': optimizer.state_dict(),
+        'epoch': epoch,
+        'state': state,
+        'rng': torch.get_rng_state(),
+        'cuda_rng': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+    torch.save(checkpoint, checkpoint_path + '.tmp')
+    os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+# Restore the training state of a fold
+def load_checkpoint(checkpoint_path:str, model, optimizer, device) -> tuple:
+    '''
+    Restores the model, the optimizer and the random number generator state saved by save_checkpoint.
+
+    Arguments:
+    - checkpoint_path (str): The checkpoint file.
+    - model (nn.Module): The model (same architecture of the checkpoint).
+    - optimizer: The optimizer (same type of the checkpoint).
+    - device (torch.device): The training device.
+
+    Returns:
+    - tuple: The number of completed epochs and the saved training state, or (0, None) if there is no checkpoint.
+    '''
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return 0, None
+
+    checkpoint = torch.load(checkpoint_path, map_location=device, weights_only=False)
+    model.load_state_dict(checkpoint['model'])
+    optimizer.load_state_dict(checkpoint['optimizer'])
+    torch.set_rng_state(checkpoint['rng'])
+    if checkpoint['cuda_rng'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(checkpoint['cuda_rng'])
+
+    print(f"\n\tResuming from {checkpoint_path} after {checkpoint['epoch']} epochs")
+    return checkpoint['epoch'], checkpoint['state']
+
+# Remove the checkpoint of a completed fold
+def remove_checkpoint(checkpoint_path:str) -> None:
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
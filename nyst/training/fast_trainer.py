@@ -0,0 +1,167 @@
+import os
+import sys
+import torch
+
+# Add 'code' directory to PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.training.checkpoint import save_checkpoint, load_checkpoint
+from nyst.classifier.precision import autocast, compile_model
+
+
+# Samples of a fold, moved once to the training device
+def fold_tensors(dataset, index, device) -> tuple:
+    '''
+    Gathers the samples of a fold from a TensorDataset into two contiguous tensors on the training device, so that
+    the batches of every epoch are views or index gathers of device memory instead of DataLoader collations.
+
+    Arguments:
+    - dataset (TensorDataset): The dataset with the signals and the labels tensors.
+    - index (np.ndarray): The indices of the samples of the fold.
+    - device (torch.device): The training device.
+
+    Returns:
+    - tuple: The signals (n_samples, 8, n_frames) and the labels (n_samples, 1) of the fold.
+    '''
+    inputs, labels = dataset.tensors
+    index = torch.as_tensor(index, dtype=torch.long)
+    return inputs[index].to(device), labels[index].float().reshape(-1, 1).to(device)
+
+# One pass over the samples of a fold
+def run_epoch(model, inputs, labels, criterion, optimizer, batch_size:int, threshold_correct:float, train:bool, precision:str='fp32') -> torch.Tensor:
+    '''
+    Trains (train = True, samples in a new random order) or evaluates the model on the samples of a fold. The loss and
+    the number of correct predictions are accumulated on the device, without any synchronization inside the epoch.
+    Only the forward pass runs under the autocast of the precision (the model can be a compiled module): the loss is
+    computed in float32 outside of it, since autocast refuses BCELoss on CUDA.
+
+    Returns:
+    - torch.Tensor: The sum of the losses and the number of correct predictions (two values on the device).
+    '''
+    totals = torch.zeros(2, device=inputs.device)
+    order = torch.randperm(len(inputs), device=inputs.device) if train else None
+
+    for start in range(0, len(inputs), batch_size):
+        # Training batches are gathered with the permutation, validation batches are contiguous views
+        batch_inputs = inputs[order[start:start + batch_size]] if train else inputs[start:start + batch_size]
+        batch_labels = labels[order[start:start + batch_size]] if train else labels[start:start + batch_size]
+
+        if train:
+            optimizer.zero_grad(set_to_none=True)
+            with autocast(inputs.device, precision):
+                outputs = model(batch_inputs)  # Forward Step
+            outputs = outputs.float()
+            loss = criterion(outputs, batch_labels)  # Loss calculation (float32, BCELoss cannot be autocast)
+            loss.backward()  # Backpropagation
+            optimizer.step()  # Optimization step
+        else:
+            with autocast(inputs.device, precision):
+                outputs = model(batch_inputs)
+            outputs = outputs.float()
+            loss = criterion(outputs, batch_labels)
+
+        totals[0] += loss.detach() * len(batch_inputs)
+        totals[1] += ((outputs.detach() >= threshold_correct) == batch_labels).sum()
+
+    return totals
+
+# Training function on device-resident fold tensors
+def train_model_fast(model, train_data:tuple, val_data:tuple, criterion, optimizer, device, num_epochs:int=1000, patience:int=30, threshold_correct:float=0.5, batch_size:int=4, log=None, checkpoint_path:str=None, checkpoint_every:int=1, precision:str='fp32', compile:bool=False) -> tuple:
+    '''
+    Fast path of train_model_cross for fixed-length clips: the fold tensors are sliced once (see fold_tensors), the
+    training samples are shuffled at every epoch with an index permutation and the metrics are read back from the
+    device once per epoch. Early stopping and the returned values are the same as train_model_cross.
+    If checkpoint_path is given the training state (with the best weights) is saved every checkpoint_every epochs and
+    when the training stops, and an existing checkpoint is resumed from the epoch after the saved one.
+
+    Arguments:
+    - model (nn.Module): The model to train (already on the device).
+    - train_data (tuple): The training signals and labels on the device.
+    - val_data (tuple): The validation signals and labels on the device.
+    - criterion: The loss criterion.
+    - optimizer: The optimizer.
+    - device (torch.device): The training device.
+    - num_epochs (int): The maximum number of epochs. Default is 1000.
+    - patience (int): The epochs without validation accuracy improvement before stopping. Default is 30.
+    - threshold_correct (float): The probability threshold of a positive prediction. Default is 0.5.
+    - batch_size (int): The batch size. Default is 4.
+    - log (callable): Function receiving the metrics dictionaries of each phase (e.g. wandb.log). Default is None.
+    - checkpoint_path (str): The checkpoint file of the fold. Default is None (no checkpoint).
+    - checkpoint_every (int): The epochs between two checkpoints. Default is 1.
+    - precision (str): The precision of the forward pass, 'fp32' or 'bf16' (autocast). Default is 'fp32'.
+    - compile (bool): Run the forward pass with the torch.compile'd model. Default is False.
+
+    Returns:
+    - tuple: The best model weights (on CPU), the training and validation statistics, the best validation accuracy and the corresponding validation loss.
+    '''
+    train_inputs, train_labels = train_data
+    val_inputs, val_labels = val_data
+
+    # Compiled forward pass (same parameters of model: the state_dict and the optimizer keep using model)
+    forward_model = compile_model(model) if compile else model
+
+    # Initialize the best model weights and accuracy
+    best_model_wts = {k: v.detach().clone() for k, v in model.state_dict().items()}
+    best_acc = 0.0
+    best_loss = float('inf')
+    best_epoch = 0
+    epochs_no_improve = 0
+
+    train_stats = {'loss': [], 'accuracy': []}
+    val_stats = {'loss': [], 'accuracy': []}
+
+    # Continue an interrupted training
+    start_epoch, state = load_checkpoint(checkpoint_path, model, optimizer, device)
+    if state is not None:
+        best_model_wts, best_acc, best_loss, best_epoch, epochs_no_improve, train_stats, val_stats = (state[key] for key in
+            ['best_model_wts', 'best_acc', 'best_loss', 'best_epoch', 'epochs_no_improve', 'train_stats', 'val_stats'])
+        if epochs_no_improve >= patience: # Stopped early just after the checkpoint
+            start_epoch = num_epochs
+
+    for epoch in range(start_epoch, num_epochs):
+        model.train()
+        train_totals = run_epoch(forward_model, train_inputs, train_labels, criterion, optimizer, batch_size, threshold_correct, True, precision)
+
+        model.eval()
+        with torch.no_grad():
+            val_totals = run_epoch(forward_model, val_inputs, val_labels, criterion, optimizer, batch_size, threshold_correct, False, precision)
+
+        # Single device synchronization of the epoch
+        train_loss, train_corrects, val_loss, val_corrects = torch.cat([train_totals, val_totals]).tolist()
+        train_stats['loss'].append(train_loss / len(train_inputs))
+        train_stats['accuracy'].append(train_corrects / len(train_inputs))
+        val_stats['loss'].append(val_loss / len(val_inputs))
+        val_stats['accuracy'].append(val_corrects / len(val_inputs))
+
+        if log is not None:
+            log({'Train_loss': train_stats['loss'][-1], 'Train_accuracy': train_stats['accuracy'][-1], 'epoch': epoch})
+            log({'Val_loss': val_stats['loss'][-1], 'Val_accuracy': val_stats['accuracy'][-1], 'epoch': epoch})
+
+        # Update counter for early stopping criterion, save the best model weights and other info
+        if val_stats['accuracy'][-1] > best_acc:
+            best_acc = val_stats['accuracy'][-1]
+            best_loss = val_stats['loss'][-1]
+            best_epoch = epoch
+            best_model_wts = {k: v.detach().clone() for k, v in model.state_dict().items()}
+            epochs_no_improve = 0
+        else:
+            epochs_no_improve += 1
+
+        print(f'\t\tEpoch {epoch + 1}/{num_epochs} ------------------- T Loss: {train_stats["loss"][-1]:.4f}, T Acc: {train_stats["accuracy"][-1]:.4f}, V Loss: {val_stats["loss"][-1]:.4f}, V Acc: {val_stats["accuracy"][-1]:.4f}')
+
+        # Periodic checkpoint of the training state, and a final one when the training stops (early stopping or last
+        # epoch), so a resumed run never repeats epochs nor loses the best weights
+        if checkpoint_path is not None and ((epoch + 1) % checkpoint_every == 0 or epochs_no_improve >= patience or epoch + 1 == num_epochs):
+            save_checkpoint(checkpoint_path, model, optimizer, epoch + 1, {'best_model_wts': best_model_wts, 'best_acc': best_acc, 'best_loss': best_loss, 'best_epoch': best_epoch,
+                                                                           'epochs_no_improve': epochs_no_improve, 'train_stats': train_stats, 'val_stats': val_stats})
+
+        # Check the early stopping criterion (if no improvement for at least 'patience' number of epochs)
+        if epochs_no_improve >= patience:
+            print(f'\n\n\nEarly stopping at {epoch}° epoch: {epochs_no_improve} without any accuracy improvement')
+            if log is not None:
+                log({'early_stopping_epoch': epoch})
+            break
+
+    print(f'\n\tBEST MODEL ------------------- Best V Acc: {best_acc:.4f}, Best V loss: {best_loss:.6f} Best V Epoch: {best_epoch}\n\n')
+
+    return {k: v.cpu() for k, v in best_model_wts.items()}, train_stats, val_stats, best_acc, best_loss
@@ -0,0 +1,119 @@
+import os
+import torch
+import torch.multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+# Dataset shared by the folds trained in the worker process
+_fold_dataset = None
+
+
+# Number of CPU threads given to each fold
+def threads_per_fold(parallel_folds:int) -> int:
+    '''
+    Splits the CPU cores available to this process evenly among the folds trained at the same time.
+
+    Arguments:
+    - parallel_folds (int): The number of folds trained concurrently.
+
+    Returns:
+    - int: The number of intra-op threads of each fold (at least 1).
+    '''
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    return max(1, cores // max(1, parallel_folds))
+
+# Move the tensors of the dataset to shared memory
+def share_dataset(dataset):
+    '''
+    Moves the tensors of the dataset to shared memory, so that the worker processes map the same memory instead
+    of receiving a copy of the data. TensorDataset and VariableLengthDataset (list of signals) are supported.
+
+    Arguments:
+    - dataset (Dataset): The dataset.
+
+    Returns:
+    - Dataset: The same dataset, with its tensors in shared memory.
+    '''
+    tensors = list(getattr(dataset, 'tensors', []))
+    tensors += list(getattr(dataset, 'signals', []))
+    if isinstance(getattr(dataset, 'labels', None), torch.Tensor):
+        tensors.append(dataset.labels)
+
+    for tensor in tensors:
+        tensor.share_memory_()
+
+    return dataset
+
+# Initialize a worker process: thread budget and shared dataset
+def _init_fold_worker(dataset, num_threads:int):
+    global _fold_dataset
+    _fold_dataset = dataset
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+
+# Train a fold in the worker process
+def _run_fold(train_fn, args:tuple):
+    return train_fn(_fold_dataset, *args)
+
+# Pool of worker processes sharing the dataset
+def worker_pool(dataset, workers:int, num_threads:int=None) -> ProcessPoolExecutor:
+    '''
+    Creates a pool of spawned worker processes, each one with a fixed budget of intra-op threads and the dataset
+    mapped from shared memory. The jobs are submitted with submit_job.
+
+    Arguments:
+    - dataset (Dataset): The dataset shared by all the jobs.
+    - workers (int): The number of worker processes.
+    - num_threads (int): The threads of each worker. Default is None (the cores divided by workers).
+
+    Returns:
+    - ProcessPoolExecutor: The pool (to be used as a context manager).
+    '''
+    num_threads = num_threads or threads_per_fold(workers)
+    print(f"\n\tStarting {workers} workers with {num_threads} threads each")
+
+    # Spawned workers: the shared-memory tensors are passed once, when every worker starts
+    context = mp.get_context('spawn')
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_fold_worker, initargs=(share_dataset(dataset), num_threads))
+
+# Run a job in a worker of the pool
+def submit_job(executor:ProcessPoolExecutor, train_fn, args:tuple):
+    '''
+    Submits train_fn(dataset, *args) to a pool created by worker_pool.
+
+    Arguments:
+    - executor (ProcessPoolExecutor): The pool.
+    - train_fn (callable): Module-level function receiving the shared dataset as first argument.
+    - args (tuple): The other arguments of train_fn.
+
+    Returns:
+    - Future: The future of the result.
+    '''
+    return executor.submit(_run_fold, train_fn, args)
+
+# Train the folds concurrently
+def run_folds(train_fn, dataset, fold_args:list, parallel_folds:int=1, num_threads:int=None) -> list:
+    '''
+    Trains the folds with train_fn, either sequentially in the current process (parallel_folds = 1) or concurrently in a
+    pool of parallel_folds processes. Each worker gets a fixed budget of intra-op threads and maps the dataset from
+    shared memory.
+
+    Arguments:
+    - train_fn (callable): Module-level function called as train_fn(dataset, *args) for each fold.
+    - dataset (Dataset): The dataset shared by all the folds.
+    - fold_args (list): The arguments of each fold (one tuple per fold).
+    - parallel_folds (int): The number of folds trained at the same time. Default is 1 (sequential).
+    - num_threads (int): The threads of each fold. Default is None (the cores divided by parallel_folds).
+
+    Returns:
+    - list: The results of train_fn, in the order of fold_args.
+    '''
+    parallel_folds = min(parallel_folds, len(fold_args))
+
+    # Sequential training in the current process
+    if parallel_folds <= 1:
+        return [train_fn(dataset, *args) for args in fold_args]
+
+    print(f"\n\tTraining {len(fold_args)} folds, {parallel_folds} at a time")
+    with worker_pool(dataset, parallel_folds, num_threads) as executor:
+        futures = [submit_job(executor, train_fn, args) for args in fold_args]
+        return [future.result() for future in futures]
@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import inspect
+import numpy as np
+import torch
+from sklearn.model_selection import KFold
+
+# Add 'code' directory to PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Settings that do not change the trained model (excluded from the cache key)
+CACHE_IGNORED_PARAMETERS = ['parallel_folds', 'compile']
+
+
+# Cross-validation split of a dataset
+def fold_splits(n_samples:int, k_folds:int, fold_seed:int=None) -> list:
+    '''
+    Splits the samples into k folds. With a seed the samples are shuffled first, always in the same way for the same
+    seed; without it the folds are contiguous. The seed is part of the cache key of the folds.
+
+    Arguments:
+    - n_samples (int): The number of samples.
+    - k_folds (int): The number of folds.
+    - fold_seed (int): The seed of the shuffling. Default is None (no shuffling).
+
+    Returns:
+    - list: The (train_index, val_index) pair of each fold.
+    '''
+    kf = KFold(n_splits=k_folds, shuffle=fold_seed is not None, random_state=fold_seed)
+    return list(kf.split(range(n_samples)))
+
+# Hash of the data of a training dataset
+def dataset_hash(dataset) -> str:
+    '''
+    Computes the SHA-256 of the samples and labels of a dataset, so that any change of the data (new videos, different
+    preprocessing or normalization) gives a new hash. TensorDataset and VariableLengthDataset are supported.
+
+    Arguments:
+    - dataset (Dataset): The training dataset.
+
+    Returns:
+    - str: The hexadecimal hash.
+    '''
+    tensors = list(getattr(dataset, 'tensors', []))
+    tensors += list(getattr(dataset, 'signals', []))
+    if getattr(dataset, 'labels', None) is not None:
+        tensors.append(torch.as_tensor(dataset.labels))
+
+    digest = hashlib.sha256()
+    for tensor in tensors:
+        array = np.ascontiguousarray(tensor.detach().cpu().numpy())
+        digest.update(f'{array.dtype}{array.shape}'.encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+# Hash of the source code of the model definition and of the trainer
+def model_definition_hash() -> str:
+    '''
+    Computes the SHA-256 of the source code of the classifier modules and of the fixed-length trainer (fast_trainer):
+    editing the network or switching the training loop invalidates the cached results.
+
+    Returns:
+    - str: The hexadecimal hash.
+    '''
+    from nyst.classifier import classifier, tunedCNN_time
+    from nyst.training import fast_trainer
+
+    digest = hashlib.sha256()
+    for module in [classifier, tunedCNN_time, fast_trainer]:
+        digest.update(inspect.getsource(module).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    '''
+    Local cache of the cross-validation results: the metrics and the best weights of every fold, keyed by the dataset
+    hash, the model definition (and trainer) hash, the hyperparameters and the fold split (number of folds, seed and index).
+    Each entry is a JSON file with the metrics and a .pth file with the weights, named after the key.
+
+    Attributes:
+    - cache_dir (str): The folder of the cache.
+    - dataset (str): The hash of the training dataset.
+    - model (str): The hash of the model definition.
+    '''
+    def __init__(self, cache_dir:str, dataset:str, model:str=None):
+        self.cache_dir = cache_dir
+        self.dataset = dataset
+        self.model = model or model_definition_hash()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # Key of a fold
+    def key(self, params:dict, fold:int, k_folds:int, fold_seed:int=None) -> str:
+        params = {name: value for name, value in params.items() if name not in CACHE_IGNORED_PARAMETERS}
+        content = json.dumps({'dataset': self.dataset, 'model': self.model, 'params': params, 'k_folds': k_folds, 'fold_seed': fold_seed, 'fold': fold}, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    # Paths of the metrics and of the weights of an entry
+    def paths(self, key:str) -> tuple:
+        return os.path.join(self.cache_dir, f'{key}.json'), os.path.join(self.cache_dir, f'{key}.pth')
+
+    # Metrics of a cached fold
+    def get(self, params:dict, fold:int, k_folds:int, fold_seed:int=None) -> dict:
+        '''
+        Returns the cached metrics of a fold ('val_acc', 'val_loss' and the extra values stored with put), or None if
+        the fold has not been trained with this dataset, model definition and hyperparameters.
+        '''
+        metrics_path, weights_path = self.paths(self.key(params, fold, k_folds, fold_seed))
+        if not (os.path.exists(metrics_path) and os.path.exists(weights_path)):
+            return None
+        with open(metrics_path) as file:
+            return json.load(file)
+
+    # Best weights of a cached fold
+    def load_weights(self, params:dict, fold:int, k_folds:int, fold_seed:int=None) -> dict:
+        _, weights_path = self.paths(self.key(params, fold, k_folds, fold_seed))
+        return torch.load(weights_path, map_location='cpu')
+
+    # Store the result of a fold
+    def put(self, params:dict, fold:int, k_folds:int, fold_seed:int, weights:dict, val_acc:float, val_loss:float=None, **extra) -> None:
+        '''
+        Stores the best weights and the metrics of a trained fold. The metrics file is written last (and atomically), so
+        an interrupted write never leaves an entry that looks complete.
+
+        Arguments:
+        - params (dict): The hyperparameters.
+        - fold (int): The index of the fold (from 1).
+        - k_folds (int): The number of folds of the split.
+        - fold_seed (int): The seed of the split (None for a split without shuffling).
+        - weights (dict): The best weights of the fold.
+        - val_acc (float): The best validation accuracy.
+        - val_loss (float): The validation loss at the best accuracy. Default is None (not tracked).
+        - extra: Other JSON-serializable values to be stored with the metrics.
+        '''
+        key = self.key(params, fold, k_folds, fold_seed)
+        metrics_path, weights_path = self.paths(key)
+        torch.save({name: value.cpu() for name, value in weights.items()}, weights_path)
+
+        metrics = {'params': params, 'fold': fold, 'k_folds': k_folds, 'fold_seed': fold_seed, 'dataset': self.dataset, 'model': self.model,
+                   'val_acc': float(val_acc), 'val_loss': None if val_loss is None else float(val_loss), 'created': time.time(), **extra}
+        with open(metrics_path + '.tmp', 'w') as file:
+            json.dump(metrics, file, default=str)
+        os.replace(metrics_path + '.tmp', metrics_path)
@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import torch
+from contextlib import closing, contextmanager
+from concurrent.futures import FIRST_COMPLETED, wait
+from sklearn.model_selection import KFold, ParameterGrid
+
+# Add 'code' directory to PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from nyst.dataset.variable_length import make_loader
+from nyst.training.train import build_training_objects, train_model_cross
+from nyst.training.fold_scheduler import worker_pool, submit_job
+from nyst.training.result_cache import dataset_hash
+
+# Hyperparameters of the grid that are replaced by the search budget (epochs of each rung)
+BUDGET_PARAMETERS = ['num_epochs', 'epochs', 'patience', 'parallel_folds']
+
+
+class SearchStore:
+    '''
+    Persistent local store of a hyperparameter search (SQLite file): the configurations tried and the validation
+    results of every rung. A search interrupted and started again with the same store resumes from these results; the
+    store is bound to the dataset of its first search (dataset_hash), and refuses to resume on a different one.
+
+    Attributes:
+    - path (str): The path of the SQLite file.
+    - checkpoint_dir (str): The folder with the checkpoints of the trials (model and optimizer state at the end of each rung).
+    '''
+    def __init__(self, path:str):
+        self.path = path
+        self.checkpoint_dir = os.path.join(os.path.dirname(os.path.abspath(path)), 'search_checkpoints')
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+        with self.connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS trials (trial_id INTEGER PRIMARY KEY, params TEXT UNIQUE, created REAL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS results (trial_id INTEGER, rung INTEGER, epochs INTEGER, val_acc REAL, val_loss REAL, train_s REAL, '
+                               'PRIMARY KEY (trial_id, rung))')
+            connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    # Connection to the store: committed at the end of the block (rolled back on errors) and always closed
+    @contextmanager
+    def connect(self):
+        with closing(sqlite3.connect(self.path)) as connection, connection:
+            yield connection
+
+    # Bind the store to a dataset (the first one it is used with)
+    def check_dataset(self, digest:str) -> None:
+        '''
+        Records the hash of the dataset of the search, or checks that it is the one of the stored results.
+
+        Arguments:
+        - digest (str): The hash of the dataset (see dataset_hash).
+        '''
+        with self.connect() as connection:
+            connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('dataset', ?)", (digest,))
+            stored = connection.execute("SELECT value FROM meta WHERE key = 'dataset'").fetchone()[0]
+        if stored != digest:
+            raise ValueError(f"The search store {self.path} holds the results of a different dataset: use a new store to search on this one")
+
+    # Identifier of a configuration (a new trial if it has never been tried)
+    def trial_id(self, params:dict) -> int:
+        key = json.dumps(params, sort_keys=True)
+        with self.connect() as connection:
+            connection.execute('INSERT OR IGNORE INTO trials (params, created) VALUES (?, ?)', (key, time.time()))
+            return connection.execute('SELECT trial_id FROM trials WHERE params = ?', (key,)).fetchone()[0]
+
+    # Record the result of a rung
+    def add_result(self, trial_id:int, rung:int, epochs:int, val_acc:float, val_loss:float, train_s:float) -> None:
+        with self.connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)', (trial_id, rung, epochs, val_acc, val_loss, train_s))
+
+    # All the results, rung by rung
+    def results(self) -> list:
+        with self.connect() as connection:
+            rows = connection.execute('SELECT r.trial_id, t.params, r.rung, r.epochs, r.val_acc, r.val_loss, r.train_s FROM results r JOIN trials t USING (trial_id) ORDER BY r.rung, r.trial_id').fetchall()
+        return [{'trial_id': row[0], 'params': json.loads(row[1]), 'rung': row[2], 'epochs': row[3], 'val_acc': row[4], 'val_loss': row[5], 'train_s': row[6]} for row in rows]
+
+    # Best result of every trial (the one of its highest rung)
+    def leaderboard(self) -> list:
+        best = {}
+        for result in self.results():
+            best[result['trial_id']] = result # Results are ordered by rung: the last one is the highest rung
+        return sorted(best.values(), key=lambda result: (result['rung'], result['val_acc'], -result['val_loss']), reverse=True)
+
+    # Path of the checkpoint of a trial at the end of a rung
+    def checkpoint_path(self, trial_id:int, rung:int) -> str:
+        # One file per rung: a rung is always resumed from the checkpoint of the previous one, so a crash between the
+        # checkpoint and add_result only repeats the rung (its result is recorded once, by trial and rung)
+        return os.path.join(self.checkpoint_dir, f'trial_{trial_id}_rung_{rung}.pth')
+
+
+# Train a trial up to the epochs of its rung
+def train_trial(dataset, train_index, val_index, params:dict, device, epochs_done:int, epochs:int, resume_path:str, checkpoint_path:str) -> tuple:
+    '''
+    Trains a configuration from epochs_done to epochs epochs, resuming from its checkpoint of the previous rung if any,
+    and saves the model and optimizer state for the next rung (the checkpoint of the previous rung is not modified).
+    Early stopping is replaced by the pruning of the search.
+
+    Arguments:
+    - dataset (Dataset): The dataset of the search.
+    - train_index (np.ndarray): The indices of the training samples.
+    - val_index (np.ndarray): The indices of the validation samples.
+    - params (dict): The hyperparameters of the trial.
+    - device (torch.device): The training device.
+    - epochs_done (int): The epochs already trained (0 for a new trial).
+    - epochs (int): The total epochs of the trial at the end of this rung.
+    - resume_path (str): The checkpoint of the previous rung (None for a new trial).
+    - checkpoint_path (str): The checkpoint of the rung.
+
+    Returns:
+    - tuple: The best validation accuracy and the corresponding validation loss so far, and the training time in seconds.
+    '''
+    start = time.perf_counter()
+    train_loader = make_loader(dataset, train_index, batch_size=params.get('batch_size', 4), shuffle=False)
+    val_loader = make_loader(dataset, val_index, batch_size=params.get('batch_size', 4), shuffle=False)
+    model, optimizer, criterion = build_training_objects(params, device)
+
+    # Resume from the previous rung
+    best_acc, best_loss = 0.0, float('inf')
+    if epochs_done > 0:
+        checkpoint = torch.load(resume_path, map_location=device)
+        model.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        best_acc, best_loss = checkpoint['best_acc'], checkpoint['best_loss']
+
+    # Patience longer than the rung: no early stopping inside a rung
+    num_epochs = epochs - epochs_done
+    _, _, _, rung_acc, rung_loss = train_model_cross(model, train_loader, val_loader, criterion, optimizer, device, num_epochs, num_epochs + 1, params.get('threshold_correct', 0.5))
+    if float(rung_acc) > best_acc:
+        best_acc, best_loss = float(rung_acc), float(rung_loss)
+
+    # Written to a temporary file first: an interrupted save never leaves a truncated checkpoint
+    torch.save({'model': model.state_dict(), 'optimizer': optimizer.state_dict(), 'best_acc': best_acc, 'best_loss': best_loss}, checkpoint_path + '.tmp')
+    os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+    return best_acc, best_loss, time.perf_counter() - start
+
+
+class ASHASearch:
+    '''
+    Local hyperparameter search with asynchronous successive halving (ASHA): every configuration is trained for
+    min_epochs epochs (rung 0), and a configuration is promoted to the next rung (eta times more epochs, up to max_epochs)
+    only if it is in the best 1/eta of the configurations that completed its rung. Free workers always get a job:
+    a promotion if one is possible, otherwise a new configuration.
+    The configurations are ranked on a single train/validation split (the first fold of a KFold split), a deliberate
+    proxy of the full cross-validation that keeps the cost of a rung to one training; the best configurations of the
+    leaderboard are meant to be cross-validated afterwards (e.g. with training_net).
+
+    Attributes:
+    - param_grid (dict): The hyperparameter lists (as for ParameterGrid).
+    - store (SearchStore): The persistent results store.
+    - rung_epochs (list): The total number of epochs of each rung.
+    - eta (int): The reduction factor.
+    '''
+    def __init__(self, param_grid:dict, store:SearchStore, min_epochs:int=5, max_epochs:int=100, eta:int=3, num_configs:int=None, seed:int=0):
+        self.store = store
+        self.eta = eta
+        self.param_grid = {key: value for key, value in param_grid.items() if key not in BUDGET_PARAMETERS}
+
+        # Epochs of each rung: min_epochs * eta^k, the last rung is max_epochs
+        self.rung_epochs = [min_epochs]
+        while self.rung_epochs[-1] * eta < max_epochs:
+            self.rung_epochs.append(self.rung_epochs[-1] * eta)
+        if self.rung_epochs[-1] < max_epochs:
+            self.rung_epochs.append(max_epochs)
+
+        # Configurations in random order (a random subset of the grid if num_configs is given)
+        self.configs = list(ParameterGrid(self.param_grid))
+        random.Random(seed).shuffle(self.configs)
+        self.configs = self.configs[:num_configs] if num_configs else self.configs
+
+        self.trial_params = {store.trial_id(params): params for params in self.configs}
+
+        # Resume: rebuild the state of the rungs from the store
+        self.rungs = [dict() for _ in self.rung_epochs] # trial_id -> validation accuracy
+        for result in store.results():
+            if result['trial_id'] in self.trial_params and result['rung'] < len(self.rungs):
+                self.rungs[result['rung']][result['trial_id']] = result['val_acc']
+        self.pending_trials = [trial_id for trial_id in self.trial_params if trial_id not in self.rungs[0]]
+        self.running = set() # (trial_id, rung) being trained
+
+    # Next job: a promotion from the highest possible rung, otherwise a new configuration
+    def next_job(self):
+        '''
+        Returns the next (trial_id, params, rung) to be trained, or None if no job is available now.
+        '''
+        for rung in reversed(range(len(self.rung_epochs) - 1)):
+            completed = sorted(self.rungs[rung].items(), key=lambda item: item[1], reverse=True)
+            for trial_id, _ in completed[:len(completed) // self.eta]:
+                if trial_id not in self.rungs[rung + 1] and (trial_id, rung + 1) not in self.running:
+                    return trial_id, self.trial_params[trial_id], rung + 1
+
+        if self.pending_trials:
+            trial_id = self.pending_trials.pop(0)
+            return trial_id, self.trial_params[trial_id], 0
+
+        return None
+
+    # Run the search
+    def run(self, dataset, device, workers:int=1, num_threads:int=None, k_folds:int=5) -> list:
+        '''
+        Runs the search until no configuration can be started or promoted. The configurations are validated on the
+        first fold of a KFold split only (as the first fold of cross_validate_model): a proxy of the cross-validation
+        accuracy, not a replacement for it.
+
+        Arguments:
+        - dataset (Dataset): The dataset (TensorDataset or VariableLengthDataset).
+        - device (torch.device): The training device.
+        - workers (int): The number of trials trained at the same time in worker processes. Default is 1 (current process).
+        - num_threads (int): The threads of each worker. Default is None (the cores divided by workers).
+        - k_folds (int): The number of folds of the split (1/k_folds of the data is used for validation). Default is 5.
+
+        Returns:
+        - list: The leaderboard: the result of the highest rung of each trial, best first.
+        '''
+        # The stored results can only be resumed on the same dataset
+        self.store.check_dataset(dataset_hash(dataset))
+        train_index, val_index = next(KFold(n_splits=k_folds, shuffle=False).split(range(len(dataset))))
+        print(f"\nASHA search: {len(self.configs)} configurations, rungs of {self.rung_epochs} epochs, eta {self.eta}, {workers} workers")
+
+        # Arguments of the training of a job
+        def job_args(job):
+            trial_id, params, rung = job
+            epochs_done = self.rung_epochs[rung - 1] if rung > 0 else 0
+            resume_path = self.store.checkpoint_path(trial_id, rung - 1) if rung > 0 else None
+            return (train_index, val_index, params, device, epochs_done, self.rung_epochs[rung], resume_path, self.store.checkpoint_path(trial_id, rung))
+
+        # Store the result of a job
+        def complete(job, result):
+            trial_id, params, rung = job
+            val_acc, val_loss, train_s = result
+            self.rungs[rung][trial_id] = val_acc
+            self.store.add_result(trial_id, rung, self.rung_epochs[rung], val_acc, val_loss, train_s)
+
+            # The checkpoint of the previous rung is no longer needed once the result of this rung is stored
+            if rung > 0 and os.path.exists(self.store.checkpoint_path(trial_id, rung - 1)):
+                os.remove(self.store.checkpoint_path(trial_id, rung - 1))
+            print(f"\n\tTrial {trial_id} rung {rung} ({self.rung_epochs[rung]} epochs): V Acc {val_acc:.4f}, V Loss {val_loss:.4f} - {params}")
+
+        # Sequential search in the current process
+        if workers <= 1:
+            while (job := self.next_job()) is not None:
+                complete(job, train_trial(dataset, *job_args(job)))
+            return self.store.leaderboard()
+
+        # Asynchronous search: a free worker immediately gets the next job
+        with worker_pool(dataset, workers, num_threads) as executor:
+            futures = {}
+            while True:
+                while len(futures) < workers and (job := self.next_job()) is not None:
+                    self.running.add((job[0], job[2]))
+                    futures[submit_job(executor, train_trial, job_args(job))] = job
+                if not futures:
+                    break
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = futures.pop(future)
+                    self.running.discard((job[0], job[2]))
+                    complete(job, future.result())
+
+        return self.store.leaderboard()
@@ -1,11 +1,12 @@
 import copy
+import numpy as np
 from tqdm import tqdm
 import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import DataLoader, TensorDataset, Subset
 import torch.nn.init as init
-from sklearn.model_selection import KFold, ParameterGrid
+from sklearn.model_selection import ParameterGrid
 import sys
 import os
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"  # Set the desired GPU device (0, 1, 2, ecc.)
@@ -15,7 +16,16 @@ os.environ['PYTORCH_CUDA_ALLOC_CONF'] = 'expandable_segments:True' # Handle memo
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from nyst.classifier.classifier import NystClassifier
-from nyst.classifier.dataset import CustomDataset
+from nyst.classifier.tunedCNN_time import VARIABLE_LENGTH_HEADS
+from nyst.dataset.dataset import CustomDataset
+from nyst.dataset.variable_length import VariableLengthDataset, make_loader
+from nyst.dataset.utils_function import save_normalization_stats, normalization_stats_path, save_holdout_patients, holdout_patients_path
+from nyst.training.fold_scheduler import run_folds
+from nyst.training.result_cache import ResultCache, dataset_hash, fold_splits
+from nyst.training.fast_trainer import fold_tensors, train_model_fast
+from nyst.training.checkpoint import save_checkpoint, load_checkpoint, remove_checkpoint
+from nyst.classifier.precision import autocast, compile_model
+from nyst.classifier.ensemble import save_ensemble as save_fold_ensemble
 
 
 # Initialisation parameters function
@@ -28,11 +38,16 @@ def initialize_parameters(model:nn.Module, mean:float = 0.0, std:float = 0.02):
             init.constant_(param.data, 0)
 
 ### Training Function with k-cross validation and grid-search ### 
-def train_model_cross(model, train_loader, val_loader, criterion, optimizer, device, num_epochs=1000, patience=30, threshold_correct=0.5): # threshold_correct: probability threshold correct response
+def train_model_cross(model, train_loader, val_loader, criterion, optimizer, device, num_epochs=1000, patience=30, threshold_correct=0.5, checkpoint_path=None, checkpoint_every=1, precision='fp32', compile=False): # threshold_correct: probability threshold correct response
+
+    # Forward pass with the compiled model (it shares the parameters of model) and under the autocast of the precision
+    forward_model = compile_model(model) if compile else model
  
     # Initialize the best model weights and accuracy
-    best_model_wts = model.state_dict() # This dictionary includes all model weights and biases of the best trained model 
+    best_model_wts = copy.deepcopy(model.state_dict()) # This dictionary includes all model weights and biases of the best trained model (a copy, not a reference to the live weights)
     best_acc = 0.0
+    best_loss = float('inf')
+    best_epoch = 0
     
     # Initialize dictionaries to store training and validation statistics
     train_stats = {'loss': [], 'accuracy': []}
@@ -41,8 +56,16 @@ def train_model_cross(model, train_loader, val_loader, criterion, optimizer, dev
     # Initialize the early stopping counter
     epochs_no_improve = 0
 
+    # Continue an interrupted training from its checkpoint (model, optimizer, epoch, early stopping counters)
+    start_epoch, state = load_checkpoint(checkpoint_path, model, optimizer, device)
+    if state is not None:
+        best_model_wts, best_acc, best_loss, best_epoch, epochs_no_improve, train_stats, val_stats = (state[key] for key in
+            ['best_model_wts', 'best_acc', 'best_loss', 'best_epoch', 'epochs_no_improve', 'train_stats', 'val_stats'])
+        if epochs_no_improve >= patience: # Stopped early just after the checkpoint
+            return best_model_wts, train_stats, val_stats, best_acc, best_loss
+
     # Loop through epochs
-    for epoch in range(num_epochs):
+    for epoch in range(start_epoch, num_epochs):
                 
         # Each epoch has a training phase and a validation phase
         for phase in ['Train', 'Val']:
@@ -61,27 +84,37 @@ def train_model_cross(model, train_loader, val_loader, criterion, optimizer, dev
             if phase == 'Val': # Validation phase
                 # Use torch.no_grad() to avoid storing gradients during validation
                 with torch.no_grad():
-                    for inputs, labels in data_loader:
+                    for batch in data_loader:
+                        # Batches of variable-length clips also carry the clip lengths
+                        inputs, lengths, labels = batch if len(batch) == 3 else (batch[0], None, batch[1])
+
                         # Move the input and label tensors to the specified device
                         inputs = inputs.to(device)
                         labels = labels.float().to(device)
                         
-                        outputs = model(inputs)  # Forward Step
-                        loss = criterion(outputs, labels)  # Loss calculation
+                        with autocast(device, precision):
+                            outputs = forward_model(inputs, lengths)  # Forward Step
+                        outputs = outputs.float()
+                        loss = criterion(outputs, labels)  # Loss calculation (float32, BCELoss cannot be autocast)
                         preds = (outputs >= threshold_correct)  # Predictions based on threshold
                         
                         running_loss += loss.item() * inputs.size(0)
                         running_corrects += torch.sum(preds == labels.data)
             else: # Training phase
-                for inputs, labels in data_loader:
+                for batch in data_loader:
+                    # Batches of variable-length clips also carry the clip lengths
+                    inputs, lengths, labels = batch if len(batch) == 3 else (batch[0], None, batch[1])
+
                     inputs = inputs.to(device)
                     labels = labels.float().to(device)
                     
                     optimizer.zero_grad()  # Reset gradients
                     
                     # Forward and backward pass with gradients enabled
-                    outputs = model(inputs)  # Forward Step
-                    loss = criterion(outputs, labels)  # Loss calculation
+                    with autocast(device, precision):
+                        outputs = forward_model(inputs, lengths)  # Forward Step
+                    outputs = outputs.float()
+                    loss = criterion(outputs, labels)  # Loss calculation (float32, BCELoss cannot be autocast)
                     preds = (outputs >= threshold_correct)  # Predictions
                     
                     loss.backward()  # Backpropagation
@@ -109,12 +142,17 @@ def train_model_cross(model, train_loader, val_loader, criterion, optimizer, dev
                     best_acc = epoch_acc
                     best_loss = epoch_loss
                     best_epoch = epoch
-                    best_model_wts = model.state_dict()
+                    best_model_wts = copy.deepcopy(model.state_dict())
                     epochs_no_improve = 0
                 else:
                     # If no improvement in accuracy, increment the counter for early stopping
                     epochs_no_improve += 1
 
+                # Periodic checkpoint of the training state
+                if checkpoint_path is not None and ((epoch + 1) % checkpoint_every == 0 or epochs_no_improve >= patience or epoch + 1 == num_epochs):
+                    save_checkpoint(checkpoint_path, model, optimizer, epoch + 1, {'best_model_wts': best_model_wts, 'best_acc': best_acc, 'best_loss': best_loss, 'best_epoch': best_epoch,
+                                                                                   'epochs_no_improve': epochs_no_improve, 'train_stats': train_stats, 'val_stats': val_stats})
+
                 # Check the early stopping criterion (if no improvement for at least 'patience' number of epochs)
                 if epochs_no_improve >= patience:
                     print(f'\n\n\nEarly stopping at {epoch}° epoch: {epochs_no_improve} without any accuracy improvement')
@@ -123,7 +161,8 @@ def train_model_cross(model, train_loader, val_loader, criterion, optimizer, dev
 
         # Clear cache after each epoch to free up memory
         del inputs, labels, outputs, preds
-        torch.cuda.empty_cache()
+        if device.type == 'cuda':
+            torch.cuda.empty_cache()
 
         # Print progress at the end of each epoch
         print(f'\t\tEpoch {epoch + 1}/{num_epochs} ------------------- T Loss: {train_stats["loss"][-1]:.4f}, T Acc: {train_stats["accuracy"][-1]:.4f}, V Loss: {val_stats["loss"][-1]:.4f}, V Acc: {val_stats["accuracy"][-1]:.4f}')
@@ -132,14 +171,110 @@ def train_model_cross(model, train_loader, val_loader, criterion, optimizer, dev
 
     return {k: v.cpu() for k, v in best_model_wts.items()}, train_stats, val_stats, best_acc, best_loss
 
-def cross_validate_model(dataset, param_grid, device, save_path, k_folds=4):
+# Create the model, the optimizer and the loss criterion of a parameters set
+def build_training_objects(params, device):
+    """
+    Creates a new initialized model with its optimizer and loss criterion, as selected by the hyperparameters.
+
+    Args:
+        params: The hyperparameters ('head', 'optimizer', 'lr', 'criterion').
+        device: The training device.
+
+    Returns:
+        tuple: The model, the optimizer and the loss criterion.
+    """
+    # Initialize the model
+    model = NystClassifier(head=params.get('head', 'flatten')).to(device)
+    initialize_parameters(model) 
+    
+    # Select and initialise the optimizer based on parameters (case insensitive, as in the W&B sweep configuration)
+    optimizer_name = params.get('optimizer', 'Adam')
+    if optimizer_name.lower() == 'sgd':
+        optimizer = optim.SGD(model.parameters(), lr=params.get('lr', 1e-3), 
+                              momentum= 0.9, 
+                              weight_decay= 1e-4)
+    elif optimizer_name.lower() == 'adam':
+        optimizer = optim.Adam(model.parameters(), lr=params.get('lr', 1e-3))
+    else:
+        raise ValueError(f"Unsupported optimizer: {optimizer_name}")            
+    
+    # Select and initialise the loss criterion based on parameters
+    criterion_name = params.get('criterion', 'BCELoss')
+    if criterion_name == 'BCELoss':
+        criterion = nn.BCELoss()
+    elif criterion_name == 'MSELoss':
+        criterion = nn.MSELoss()
+    elif criterion_name == 'HingeEmbeddingLoss':
+        criterion = nn.HingeEmbeddingLoss()
+    else:
+        raise ValueError(f"Unsupported criterion: {criterion_name}")
+
+    return model, optimizer, criterion
+
+# Train and validate the model on a single fold
+def train_fold(dataset, train_index, val_index, params, device, checkpoint_path=None, checkpoint_every=1):
+    """
+    Trains a new model on the training indices of a fold and validates it on the validation indices.
+    It is a module-level function so that the folds can be trained in worker processes (see nyst.training.fold_scheduler).
+    With a checkpoint_path the training state is saved during the training and an existing checkpoint is resumed.
+
+    Args:
+        dataset: The dataset of the cross-validation.
+        train_index: The indices of the training samples of the fold.
+        val_index: The indices of the validation samples of the fold.
+        params: The hyperparameters of the model ('precision' and 'compile' select bf16 autocast and torch.compile).
+        device: The training device.
+        checkpoint_path: The checkpoint file of the fold. Default is None (no checkpoint).
+        checkpoint_every: The epochs between two checkpoints. Default is 1.
+
+    Returns:
+        tuple: The best model weights (on CPU), the best validation accuracy and the corresponding validation loss.
+    """
+    # Re-initialize the model, the optimizer and the loss criterion for each fold
+    model, optimizer, criterion = build_training_objects(params, device)
+    
+    # Extract number of epochs from parameters grid
+    num_epochs=params.get('num_epochs', 100)
+
+    # Extract number of epochs from parameters grid
+    patience = params.get('patience', 40)
+    
+    # Extract number of epochs from parameters grid
+    threshold_correct = params.get('threshold_correct', 0.5)
+
+    # Precision of the forward pass and compiled model
+    precision, compile = params.get('precision', 'fp32'), params.get('compile', False)
     
-    # Initialize KFold with the specified number of folds
-    kf = KFold(n_splits=k_folds, shuffle=False) # You can set shuffle to True and delete the seed(random_state=42)
+    # Fixed-length clips: fold tensors sliced once on the device and shuffled by index permutation at every epoch
+    if isinstance(dataset, TensorDataset):
+        train_data, val_data = fold_tensors(dataset, train_index, device), fold_tensors(dataset, val_index, device)
+        best_model_wts, _, _, best_acc, best_loss = train_model_fast(model, train_data, val_data, criterion, optimizer, device, num_epochs, patience, threshold_correct, params.get('batch_size', 4), checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every, precision=precision, compile=compile)
+    else:
+        # Create data loaders for the training and validation subsets (length-bucketed batches for variable-length clips)
+        train_loader = make_loader(dataset, train_index, batch_size=params.get('batch_size', 4), shuffle=False) # 4 is a default value for batch_size if it is not provided in the param_grid
+        val_loader = make_loader(dataset, val_index, batch_size=params.get('batch_size', 4), shuffle=False)
+
+        # Train the model and retrieve the training and validation statistics
+        best_model_wts, _, _, best_acc, best_loss = train_model_cross(model, train_loader, val_loader, criterion, optimizer, device, num_epochs, patience, threshold_correct, checkpoint_path, checkpoint_every, precision, compile)
+        best_model_wts = {k: v.cpu() for k, v in best_model_wts.items()}
+    
+    # Move best model weights to CPU to free GPU memory
+    del model  # Free model from GPU memory
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()  # Clear CUDA cache
+
+    return best_model_wts, best_acc, best_loss
+
+def cross_validate_model(dataset, param_grid, device, save_path, k_folds=4, parallel_folds=1, cache=None, fold_seed=None, checkpoint_dir=None, resume=False, checkpoint_every=1, save_ensemble=False):
+    
+    # Folds of the dataset, shuffled only if a seed is given (the seed is part of the cache key)
+    splits = fold_splits(len(dataset), k_folds, fold_seed)
     # Initialize list to store all results
     all_results = []
     # Create a parameter grid iterator
     grid = ParameterGrid(param_grid)
+    # Fold models of the best parameter set so far (kept only to save the ensemble)
+    ensemble_members, ensemble_acc = None, -1.0
   
     print('\n\n')
 
@@ -150,77 +285,51 @@ def cross_validate_model(dataset, param_grid, device, save_path, k_folds=4):
         print(f"Training Net with this HyperParameters Matrix: {params}")
 
         # Dictionary to store results for the current parameter set
-        fold_results = {'Best models': [], 'Val Loss list': [], 'Val accuracies list': [],'Avarage val loss': 0.0, 'Avarage val accuracy': 0.0}
+        fold_results = {'Best models': [], 'Val Loss list': [], 'Val accuracies list': [],'Average val loss': 0.0, 'Average val accuracy': 0.0}
         
-        # List folds models
-        fold_models_list = []
-
-        # Perform k-fold cross-validation
-        for fold, (train_index, val_index) in enumerate(kf.split(range(len(dataset.tensors[0]))), 1):
-            
-            print(f"\n\t---> Fold {fold}/{k_folds}:")
+        # Folds already trained with the same data, model definition and hyperparameters are read from the cache
+        cached = {fold: cache.get(params, fold, k_folds, fold_seed) for fold in range(1, k_folds + 1)} if cache is not None else {}
+        missing = [fold for fold in range(1, k_folds + 1) if cached.get(fold) is None]
+        if cache is not None and len(missing) < k_folds:
+            print(f"\n\t{k_folds - len(missing)}/{k_folds} folds found in the result cache")
+
+        # Checkpoint of each missing fold (named after its cache key); without resume the training starts again from scratch
+        checkpoints = {fold: fold_checkpoint_path(checkpoint_dir, cache, params, fold, k_folds, fold_seed) for fold in missing}
+        if not resume:
+            for checkpoint_path in checkpoints.values():
+                remove_checkpoint(checkpoint_path)
+
+        # Perform k-fold cross-validation of the missing folds (parallel_folds folds at a time, each one in its own process if parallel_folds > 1)
+        fold_args = [(*splits[fold - 1], params, device, checkpoint_path, checkpoint_every) for fold, checkpoint_path in checkpoints.items()]
+        for fold, (best_model_wts, best_acc, best_loss) in zip(missing, run_folds(train_fold, dataset, fold_args, parallel_folds)):
             
-            # Create training and validation subsets using the generated indices
-            train_subset = Subset(dataset, train_index)
-            val_subset = Subset(dataset, val_index)
+            print(f"\n\t---> Fold {fold}/{k_folds}: Best V Acc: {float(best_acc):.4f}, Best V loss: {best_loss:.6f}")
             
-            # Create data loaders for training and validation subsets
-            train_loader = DataLoader(train_subset, batch_size=params.get('batch_size', 4), shuffle=False) # 4 is a default value for batch_size if it is not provided in the param_grid
-            val_loader = DataLoader(val_subset, batch_size=params.get('batch_size', 4), shuffle=False)
-            
-            # Re-initialize the model for each fold
-            model = NystClassifier().to(device)
-            initialize_parameters(model) 
-            
-            # Select and initialise the optimizer based on parameters
-            optimizer_name = params.get('optimizer', 'Adam')
-            if optimizer_name == 'SGD':
-                optimizer = optim.SGD(model.parameters(), lr=params.get('lr', 1e-3), 
-                                      momentum= 0.9, 
-                                      weight_decay= 1e-4)
-            elif optimizer_name == 'Adam':
-                optimizer = optim.Adam(model.parameters(), lr=params.get('lr', 1e-3))
-            else:
-                raise ValueError(f"Unsupported optimizer: {optimizer_name}")            
-            
-            # Select and initialise the loss criterion based on parameters
-            criterion_name = params.get('criterion', 'BCELoss')
-            if criterion_name == 'BCELoss':
-                criterion = nn.BCELoss()
-            elif criterion_name == 'MSELoss':
-                criterion = nn.MSELoss()
-            elif criterion_name == 'HingeEmbeddingLoss':
-                criterion = nn.HingeEmbeddingLoss()
-            else:
-                raise ValueError(f"Unsupported criterion: {criterion_name}")
-            
-            # Extract number of epochs from parameters grid
-            num_epochs=params.get('num_epochs', 100)
+            # Store the fold in the cache (the weights are read back only for the best fold)
+            if cache is not None:
+                cache.put(params, fold, k_folds, fold_seed, best_model_wts, best_acc, best_loss)
+            cached[fold] = {'val_acc': float(best_acc), 'val_loss': float(best_loss), 'weights': best_model_wts}
 
-            # Extract number of epochs from parameters grid
-            patience = params.get('patience', 40)
-            
-            # Extract number of epochs from parameters grid
-            threshold_correct = params.get('threshold_correct', 0.5)
-            
-            # Train the model and retrieve the training and validation statistics
-            best_model_wts, _, _, best_acc, best_loss = train_model_cross(model, train_loader, val_loader, criterion, optimizer, device, num_epochs, patience, threshold_correct)
-            
-            # Store best models and corrispondent validation accuracies
-            fold_models_list.append(best_model_wts)
-            fold_results['Val Loss list'].append(best_loss)
-            fold_results['Val accuracies list'].append(best_acc)
-            
-            # Move best model weights to CPU to free GPU memory
-            del model  # Free model from GPU memory
-            torch.cuda.empty_cache()  # Clear CUDA cache
+            # The completed fold is in the cache: its checkpoint is no longer needed
+            if cache is not None:
+                remove_checkpoint(checkpoints[fold])
+
+        # Store best models and corrispondent validation accuracies
+        fold_results['Val Loss list'] = [cached[fold]['val_loss'] for fold in range(1, k_folds + 1)]
+        fold_results['Val accuracies list'] = [cached[fold]['val_acc'] for fold in range(1, k_folds + 1)]
 
         # Store the avarage validation accuracy an loss in the partial dictionary
         avg_val_loss = sum(fold_results['Val Loss list']) / k_folds
         avg_val_acc = sum(fold_results['Val accuracies list']) / k_folds
-        fold_results['Avarage val loss'] = avg_val_loss
-        fold_results['Avarage val accuracy'] = avg_val_acc
-        fold_results['Best models'] = fold_models_list[fold_results['Val accuracies list'].index(max(fold_results['Val accuracies list']))]
+        fold_results['Average val loss'] = avg_val_loss
+        fold_results['Average val accuracy'] = avg_val_acc
+        best_fold = fold_results['Val accuracies list'].index(max(fold_results['Val accuracies list'])) + 1
+        fold_results['Best models'] = cached[best_fold].get('weights') or cache.load_weights(params, best_fold, k_folds, fold_seed)
+
+        # Keep all the fold models of the best parameter set for the ensemble
+        if save_ensemble and avg_val_acc > ensemble_acc:
+            ensemble_members = [cached[fold].get('weights') or cache.load_weights(params, fold, k_folds, fold_seed) for fold in range(1, k_folds + 1)]
+            ensemble_acc = avg_val_acc
          
         # Save results for current parameters
         all_results.append({
@@ -232,39 +341,87 @@ def cross_validate_model(dataset, param_grid, device, save_path, k_folds=4):
         print(f"\n\n\nAverage validation accuracy - loss for {idx}° parameters set: {avg_val_acc:.4f} - {avg_val_loss:.4f}")
 
         # **Empty the GPU cache after each parameter set (after all folds for one param combination)**
-        torch.cuda.empty_cache()
+        if device.type == 'cuda':
+            torch.cuda.empty_cache()
     
     # Sort results by average accuracy
-    sorted_results = sorted(all_results, key=lambda x: x['Models info']['Avarage val accuracy'], reverse=True)
+    sorted_results = sorted(all_results, key=lambda x: x['Models info']['Average val accuracy'], reverse=True)
         
     print("\n\n","="*100,"\n\n")
-    print(f"\n\nBest parameters: {sorted_results[0]['Parameters']}, Average validation accuracy: {sorted_results[0]['Models info']['Avarage val accuracy']:.4f}")
+    print(f"\n\nBest parameters: {sorted_results[0]['Parameters']}, Average validation accuracy: {sorted_results[0]['Models info']['Average val accuracy']:.4f}")
 
     # Extract the list of best models and corresponding validation accuracies
     best_model_param = sorted_results[0]['Models info']['Best models']
 
     # Create the best model
-    best_model = NystClassifier().to(device)
+    best_model = NystClassifier(head=sorted_results[0]['Parameters'].get('head', 'flatten')).to(device)
     best_model.load_state_dict(best_model_param)
 
     # Save the best model
     torch.save(best_model.state_dict(), save_path)
 
+    # Save the k fold models of the best parameters as an ensemble ('ensemble.pth' next to the model, loadable with load_classifier)
+    if save_ensemble:
+        save_fold_ensemble(ensemble_members, sorted_results[0]['Parameters'].get('head', 'flatten'), os.path.join(os.path.dirname(os.path.abspath(save_path)), 'ensemble.pth'))
+
     # Save the model information
     save_model_info(sorted_results, save_path)
 
     return sorted_results
 
+# Checkpoint file of a fold
+def fold_checkpoint_path(checkpoint_dir, cache, params, fold, k_folds, fold_seed=None):
+    """
+    Returns the checkpoint file of a fold, named after its result cache key (the same data, model definition,
+    hyperparameters and fold split), or None if checkpoints are disabled.
+    """
+    if checkpoint_dir is None or cache is None:
+        return None
+    return os.path.join(checkpoint_dir, f'{cache.key(params, fold, k_folds, fold_seed)}.ckpt')
+
+# Rebuild the results of a parameter grid from the result cache
+def results_from_cache(cache, param_grid, k_folds, fold_seed=None):
+    """
+    Rebuilds the sorted results of cross_validate_model from the result cache, without training.
+    The parameter sets with missing folds are skipped and the best models are not loaded (use cache.load_weights).
+
+    Args:
+        cache: The ResultCache of the dataset.
+        param_grid: The parameter grid of the training.
+        k_folds: The number of folds.
+        fold_seed: The seed of the fold split (None for folds without shuffling).
+
+    Returns:
+        list: The results sorted by average validation accuracy, in the format of cross_validate_model.
+    """
+    all_results = []
+    for idx, params in enumerate(ParameterGrid(param_grid)):
+        folds = [cache.get(params, fold, k_folds, fold_seed) for fold in range(1, k_folds + 1)]
+        if any(fold is None for fold in folds):
+            continue
+
+        val_losses = [fold['val_loss'] for fold in folds]
+        val_accuracies = [fold['val_acc'] for fold in folds]
+        all_results.append({
+            'Parameters': params,
+            'Param index': idx,
+            'Models info': {'Best models': None, 'Val Loss list': val_losses, 'Val accuracies list': val_accuracies,
+                            'Average val loss': sum(val_losses) / k_folds, 'Average val accuracy': sum(val_accuracies) / k_folds}
+        })
+
+    return sorted(all_results, key=lambda x: x['Models info']['Average val accuracy'], reverse=True)
+
 def save_model_info(results, save_path):
     """
-    Save the information of the best model to a text file.
+    Save the information of the best model to a text file, in the folder of the model.
+    The results can be the ones returned by cross_validate_model or rebuilt with results_from_cache.
     
     Args:
         results: The results dictionary containing the best model's statistics.
-        save_path: The path where to save the text file.
+        save_path: The path of the saved model (the text file is saved in the same folder).
     """
     # Create the file path
-    file_path = os.path.join(save_path, 'best_model_info.txt')
+    file_path = os.path.join(os.path.dirname(save_path), 'best_model_info.txt')
     
     # Retrieve best result information
     best_params = results[0]['Parameters']
@@ -291,14 +448,47 @@ def save_model_info(results, save_path):
     
     print(f"\n\nBest model information saved in {file_path}")
 
+# Result cache of a training dataset
+def result_cache(dataset, save_path, cache_dir=None):
+    """
+    Opens the result cache of a training dataset: re-running or extending a grid only trains the new parameter sets.
+
+    Args:
+        dataset: The training dataset (its content is hashed).
+        save_path: The path of the saved model.
+        cache_dir: The folder of the cache. Default is None ('result_cache' in the folder of the model).
+
+    Returns:
+        ResultCache: The cache.
+    """
+    return ResultCache(cache_dir or os.path.join(os.path.dirname(os.path.abspath(save_path)), 'result_cache'), dataset_hash(dataset))
+
 # Function to perform the training of the full net 
-def training_net(csv_input_file, csv_label_file, save_path, batch_size, lr, optimizer, criterion, threshold_correct, patience, num_epochs, k_folds):
+def training_net(csv_input_file, csv_label_file, save_path, batch_size, lr, optimizer, criterion, threshold_correct, patience, num_epochs, k_folds, head=None, variable_length=False, parallel_folds=1, cache_dir=None, fold_seed=None, checkpoint_dir=None, resume=False, checkpoint_every=1, precision='fp32', compile=False, save_ensemble=False, holdout_patients=None):
     
     # Define the device
     device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
 
+    # Heads to be tested: a list of head names, a single name, or None for the original 'flatten' head
+    head = ['flatten'] if head is None else [head] if isinstance(head, str) else list(head)
+
+    # Checkpoints of the folds being trained ('checkpoints' in the folder of the model by default)
+    checkpoint_dir = checkpoint_dir or os.path.join(os.path.dirname(os.path.abspath(save_path)), 'checkpoints')
+
     # Create the training and validation datasets object
-    dataset = CustomDataset(csv_input_file, csv_label_file)
+    dataset = CustomDataset(csv_input_file, variable_length=variable_length)
+    train_signals, train_labels = dataset.fil_norm_data, dataset.fil_data['labels']
+
+    # Exclude the clips of the held-out patients from the training and the cross-validation (e.g. for the export parity report)
+    holdout_patients = [str(patient) for patient in (holdout_patients or [])]
+    if holdout_patients:
+        keep = np.flatnonzero(~np.isin(np.asarray(dataset.fil_data['patients']).reshape(-1).astype(str), holdout_patients))
+        train_signals = [train_signals[i] for i in keep] if isinstance(train_signals, list) else np.asarray(train_signals)[keep]
+        train_labels = np.asarray(train_labels)[keep]
+
+    # Save the normalization statistics of the training set and the held-out patients next to the model (used at inference and export time)
+    save_normalization_stats(normalization_stats_path(save_path), dataset.normalization_std)
+    save_holdout_patients(holdout_patients_path(save_path), holdout_patients)
 
     # Parameters to be tested during the training phase
     param_grid = {
@@ -309,12 +499,28 @@ def training_net(csv_input_file, csv_label_file, save_path, batch_size, lr, opti
             'threshold_correct': threshold_correct,
             'patience': patience,
             'num_epochs': num_epochs,
+            'head': head,
         }
+
+    # Opt-in bf16 autocast and torch.compile (only added when enabled, so the result cache keys of float32 eager training do not change)
+    if precision != 'fp32':
+        param_grid['precision'] = [precision]
+    if compile:
+        param_grid['compile'] = [True]
     
+    # Clips with their native number of frames: only the heads independent of the input length can be used
+    if variable_length:
+        param_grid['head'] = [h for h in head if h in VARIABLE_LENGTH_HEADS] or ['gap']
+
+        # Truncate the data to be a multiple of the fold size (avoid different fold size problems)
+        fold_size = len(train_signals) // k_folds
+        train_dataset = VariableLengthDataset(train_signals[:fold_size * k_folds], train_labels[:fold_size * k_folds])
+
+        return cross_validate_model(train_dataset, param_grid, device, save_path, k_folds, parallel_folds, result_cache(train_dataset, save_path, cache_dir), fold_seed, checkpoint_dir, resume, checkpoint_every, save_ensemble)
 
     # Create the training and validation datasets and convert numpy arrays to PyTorch tensors
-    train_input_tensor = torch.tensor(dataset.train_signals, dtype=torch.float32)
-    train_labels_tensor = torch.tensor(dataset.train_labels, dtype=torch.float32)
+    train_input_tensor = torch.tensor(np.asarray(train_signals), dtype=torch.float32)
+    train_labels_tensor = torch.tensor(np.asarray(train_labels, dtype=float), dtype=torch.float32)
                
     # Calculate the number of samples per fold
     n_samples = len(train_input_tensor)
@@ -328,6 +534,6 @@ def training_net(csv_input_file, csv_label_file, save_path, batch_size, lr, opti
     train_dataset_truncated = TensorDataset(train_input_truncated, train_labels_truncated)
 
     # Start the training
-    results = cross_validate_model(train_dataset_truncated, param_grid, device, save_path, k_folds)
+    results = cross_validate_model(train_dataset_truncated, param_grid, device, save_path, k_folds, parallel_folds, result_cache(train_dataset_truncated, save_path, cache_dir), fold_seed, checkpoint_dir, resume, checkpoint_every, save_ensemble)
 
     return results
@@ -1,4 +1,3 @@
-import copy
 import wandb
 from tqdm import tqdm
 import torch
@@ -6,11 +5,14 @@ import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import DataLoader, TensorDataset, Subset
 import torch.nn.init as init
-from sklearn.model_selection import KFold
 import os
+from types import SimpleNamespace
 from demo.yaml_function import load_hyperparams, pathConfiguratorYaml
 from nyst.classifier.classifier import NystClassifier
 from nyst.dataset.dataset import CustomDataset
+from nyst.training.fold_scheduler import run_folds
+from nyst.training.result_cache import ResultCache, dataset_hash, fold_splits
+from nyst.training.fast_trainer import fold_tensors, train_model_fast
 
 # Set the desired GPU device and manage CUDA memory fragmentation
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"  # Set desired GPU device
@@ -63,99 +65,45 @@ def get_optimizer_and_criterion(model, config):
 
     return optimizer, criterion
 
-# Training function with k-fold cross-validation
-def train_model_cross(model, train_loader, val_loader, criterion, optimizer, device, num_epochs=1000, patience=30, threshold_correct=0.5):
+# Train and validate the model on a single fold in a worker process
+def train_fold(dataset, train_index, val_index, config, device):
     """
-    Trains the model with k-fold cross-validation.
+    Trains a new model on a fold outside the W&B run (in a worker process): the metrics are collected and returned,
+    so that the main process can log them.
     
     Args:
-        model (nn.Module): The model to train.
-        train_loader (DataLoader): DataLoader for the training data.
-        val_loader (DataLoader): DataLoader for the validation data.
-        criterion: Loss function for training.
-        optimizer: Optimizer for updating model weights.
+        dataset: The dataset to train and validate on.
+        train_index: The indices of the training samples of the fold.
+        val_index: The indices of the validation samples of the fold.
+        config (dict): The training settings.
         device: Device to run the model on (CPU or GPU).
-        num_epochs (int): Number of epochs for training. Default is 1000.
-        patience (int): Number of epochs to wait for improvement before stopping. Default is 30.
-        threshold_correct (float): Threshold for predicting correct labels. Default is 0.5.
     
     Returns:
-        model: The trained model with the best weights.
+        tuple: The best model weights, the best validation accuracy and the list of the logged metrics.
     """
-    best_model_wts = model.state_dict() # Save the best model weights
-    best_acc = 0.0 # Initialize best accuracy
-    epochs_no_improve = 0 # Initialize counter for epochs without improvement
-
-    # Loop through each epoch
-    for epoch in range(num_epochs):
-
-        # Set model to training/validation mode
-        for phase in ['Train', 'Val']:
-            if phase == 'Train':
-                model.train()
-                data_loader = train_loader
-            else:
-                model.eval()
-                data_loader = val_loader
-
-            running_loss = 0.0 # Initialize running loss
-            running_corrects = 0 # Initialize correct predictions count
-
-            # Loop through data batches
-            for inputs, labels in data_loader:
-                inputs, labels = inputs.to(device), labels.float().to(device)
-                optimizer.zero_grad() # Clear previous gradients
-
-                # Enable gradients only during training
-                with torch.set_grad_enabled(phase == 'Train'):
-                    outputs = model(inputs)  # Forward pass
-                    loss = criterion(outputs, labels)  # Compute loss
-                    preds = (outputs >= threshold_correct)  # Compute predictions
-
-                    # If training phase execute backward pass and update model weights
-                    if phase == 'Train':
-                        loss.backward()
-                        optimizer.step()
-
-                # Accumulate loss and Count correct predictions
-                running_loss += loss.item() * inputs.size(0)
-                running_corrects += torch.sum(preds.float() == labels.data)
-
-            # Compute average loss and accuracy for the epoch
-            epoch_loss = running_loss / len(data_loader.dataset)
-            epoch_acc = running_corrects.float() / len(data_loader.dataset)
-
-            # Log metrics to W&B
-            wandb.log({
-                f"{phase}_loss": epoch_loss,   # Log loss for the current phase
-                f"{phase}_accuracy": epoch_acc, # Log accuracy for the current phase
-                "epoch": epoch # Log current epoch
-            })
-
-            # Check for improvements in validation accuracy
-            if phase == 'Val' and epoch_acc > best_acc:
-                best_acc = epoch_acc
-                best_model_wts = model.state_dict()
-                epochs_no_improve = 0
-            elif phase == 'Val':
-                epochs_no_improve += 1
-
-            # Early stopping if no improvement
-            if epochs_no_improve >= patience:
-                print(f"Early stopping at epoch {epoch}")
-                wandb.log({"early_stopping_epoch": epoch}) # Log early stopping epoch
-                model.load_state_dict(best_model_wts) # Load best model weights
-                return model, best_acc
-            
-        # Clear CUDA cache
-        torch.cuda.empty_cache()
-
-    return model, best_acc
+    config = SimpleNamespace(**config)
+    logs = []
+
+    # Initialize model and model parameters
+    model = NystClassifier(head=getattr(config, 'head', 'flatten')).to(device)
+    initialize_parameters(model)
+
+    # Get optimizer and criterion
+    optimizer, criterion = get_optimizer_and_criterion(model, config)
+
+    # Train the model for the current fold (fold tensors sliced once on the device)
+    train_data, val_data = fold_tensors(dataset, train_index, device), fold_tensors(dataset, val_index, device)
+    best_model_wts, _, _, fold_acc, _ = train_model_fast(model, train_data, val_data, criterion, optimizer, device, config.epochs, config.patience, config.threshold_correct, config.batch_size, log=logs.append,
+                                                      precision=getattr(config, 'precision', 'fp32'), compile=getattr(config, 'compile', False))
+
+    return best_model_wts, fold_acc, logs
 
 # Cross-validation and hyperparameter sweep function
-def cross_validate_model(dataset, config, device, save_path_wb, k_folds=5):
+def cross_validate_model(dataset, config, device, save_path_wb, k_folds=5, cache=None):
     """
     Performs cross-validation and hyperparameter sweep on the model.
+    The folds are trained concurrently in worker processes if config.parallel_folds is greater than 1.
+    The folds found in the result cache (same data, model definition, configuration and fold seed) are not trained again.
     
     Args:
         dataset: The dataset to train and validate on.
@@ -163,51 +111,84 @@ def cross_validate_model(dataset, config, device, save_path_wb, k_folds=5):
         device: Device to run the model on (CPU or GPU).
         save_path (str): Path to save the best model weights.
         k_folds (int): Number of folds for cross-validation. Default is 4.
+        cache (ResultCache): Cache of the fold results. Default is None (no cache).
     
     Returns:
         None: Saves the best model weights.
     """
     # Initializations
-    kf = KFold(n_splits=k_folds, shuffle=True) # KFold object
+    if 'fold_seed' not in config:
+        config.update({'fold_seed': 0}) # Written into the run config, so the folds of the run can be reproduced from it
+    fold_seed = config['fold_seed'] # Fixed seed: the same configuration always gets the same folds (part of the cache key)
     best_avg_acc = 0.0 # Variable to store best average accuracy
     best_model_wts = None # Variable to store best model weights
+    parallel_folds = config.get('parallel_folds', 1)
+    params = {key: value for key, value in dict(config).items() if key != 'fold_seed'}
+    splits = fold_splits(len(dataset.tensors[0]), k_folds, fold_seed) # Shuffled folds, the same for the same seed
+
+    # Folds already trained: log their cached accuracy and keep the best one
+    cached = {fold: cache.get(params, fold, k_folds, fold_seed) for fold in range(1, k_folds + 1)} if cache is not None else {}
+    missing = [fold for fold in range(1, k_folds + 1) if cached.get(fold) is None]
+    for fold in sorted(set(range(1, k_folds + 1)) - set(missing)):
+        fold_acc = cached[fold]['val_acc']
+        wandb.log({'fold': fold, 'cached_fold_accuracy': fold_acc})
+        if fold_acc > best_avg_acc:
+            best_avg_acc = fold_acc
+            best_model_wts = cache.load_weights(params, fold, k_folds, fold_seed)
+            print(f"Best cached model for fold {fold} with accuracy {fold_acc}")
 
     '''# Using only the training data for cross-validation
     train_signals = dataset.train_signals
     train_labels = dataset.train_labels'''
 
-    # Loop through each fold
-    for fold, (train_index, val_index) in enumerate(kf.split(range(len(dataset.tensors[0]))), 1):        
+    # Folds trained concurrently: the metrics of each fold are logged once it is completed
+    if parallel_folds > 1:
+        fold_args = [(*splits[fold - 1], dict(config), device) for fold in missing]
+        for fold, (fold_wts, fold_acc, logs) in zip(missing, run_folds(train_fold, dataset, fold_args, parallel_folds)):
+            for metrics in logs:
+                wandb.log({'fold': fold, **metrics})
+            if cache is not None:
+                cache.put(params, fold, k_folds, fold_seed, fold_wts, fold_acc)
+
+            # Update best model if accuracy improves
+            if fold_acc > best_avg_acc:
+                best_avg_acc = fold_acc # Update best average accuracy
+                best_model_wts = fold_wts # Best model weights (already a copy)
+                print(f"New best model found for fold {fold} with accuracy {fold_acc}")
+    else:
+        # Loop through each fold
+        for fold in missing:        
+            train_index, val_index = splits[fold - 1]
         
-        # Create training and validation subset
-        train_subset = Subset(dataset, train_index)
-        val_subset = Subset(dataset, val_index)
+            # Training and validation tensors of the fold, sliced once on the device
+            train_data, val_data = fold_tensors(dataset, train_index, device), fold_tensors(dataset, val_index, device)
 
-        # Create DataLoader for training and validation
-        train_loader = DataLoader(train_subset, batch_size=config.batch_size, shuffle=False)
-        val_loader = DataLoader(val_subset, batch_size=config.batch_size, shuffle=False)
+            # Initialize model and model parameters
+            model = NystClassifier(head=config.get('head', 'flatten')).to(device)
+            initialize_parameters(model)
 
-        # Initialize model and model parameters
-        model = NystClassifier().to(device)
-        initialize_parameters(model)
+            # Get optimizer and criterion
+            optimizer, criterion = get_optimizer_and_criterion(model, config)
 
-        # Get optimizer and criterion
-        optimizer, criterion = get_optimizer_and_criterion(model, config)
+            # Monitor gradients with wandb.watch
+            wandb.watch(model, criterion, log="gradients")
 
-        # Monitor gradients with wandb.watch
-        wandb.watch(model, criterion, log="gradients")
+            # Train the model for the current fold
+            fold_wts, _, _, fold_acc, _ = train_model_fast(model, train_data, val_data, criterion, optimizer, device, config.epochs, config.patience, config.threshold_correct, config.batch_size, log=wandb.log,
+                                                              precision=config.get('precision', 'fp32'), compile=config.get('compile', False))
 
-        # Train the model for the current fold
-        best_model, fold_acc = train_model_cross(model, train_loader, val_loader, criterion, optimizer, device, config.epochs, config.patience, config.threshold_correct)
+            # Log GPU/CPU stats to W&B
+            wandb.log({"GPU_memory_allocated": torch.cuda.memory_allocated(), "CPU_usage": os.cpu_count()})
 
-        # Log GPU/CPU stats to W&B
-        wandb.log({"GPU_memory_allocated": torch.cuda.memory_allocated(), "CPU_usage": os.cpu_count()})
+            # Store the fold in the cache
+            if cache is not None:
+                cache.put(params, fold, k_folds, fold_seed, fold_wts, fold_acc)
 
-        # Update best model if accuracy improves
-        if fold_acc > best_avg_acc:
-            best_avg_acc = fold_acc # Update best average accuracy
-            best_model_wts = copy.deepcopy(best_model.state_dict())  # Copy best model weights
-            print(f"New best model found for fold {fold} with accuracy {fold_acc}")
+            # Update best model if accuracy improves
+            if fold_acc > best_avg_acc:
+                best_avg_acc = fold_acc # Update best average accuracy
+                best_model_wts = fold_wts # Best model weights (already a copy)
+                print(f"New best model found for fold {fold} with accuracy {fold_acc}")
 
     
     # Save the model with the best accuracy across all folds
@@ -262,5 +243,6 @@ def train(config=None):
         # Create Truncate Dataset TensorDataset for train and test sets (avoid different fold size problems)
         train_dataset_truncated = TensorDataset(train_input_truncated, train_labels_truncated)
 
-        # Start cross-validation
-        cross_validate_model(train_dataset_truncated, config, device, save_path_wb, k_folds=5)
+        # Start cross-validation (the folds already trained are read from the result cache)
+        cache = ResultCache(os.path.join(save_path_wb, 'result_cache'), dataset_hash(train_dataset_truncated))
+        cross_validate_model(train_dataset_truncated, config, device, save_path_wb, k_folds=5, cache=cache)
@@ -1,5 +1,6 @@
 r"""init file for visualization package."""
 
 from .annotator import FirstFrameAnnotator
+from .segmentation import OverlayRenderer, palette_lut, colorize_mask, render_overlay_video, SEGMENTATION_COLORS
 
-__all__ = ["FirstFrameAnnotator"]
\ No newline at end of file
+__all__ = ["FirstFrameAnnotator", "OverlayRenderer", "palette_lut", "colorize_mask", "render_overlay_video", "SEGMENTATION_COLORS"]
\ No newline at end of file
@@ -1,12 +1,15 @@
 import cv2
 import numpy as np
 
+from nyst.visualization.segmentation import OverlayRenderer, SEGMENTATION_COLORS
+
 class FirstFrameAnnotator:
     """
     Class responsible for annotating frames by drawing crosshairs on the detected pupil positions.
     """
     def __init__(self):
-        pass
+        # Renderer of the segmentation overlays (buffers reused across frames)
+        self.overlay_renderer = OverlayRenderer(SEGMENTATION_COLORS)
 
     def apply(self, frame, left_pupil_absolute_position, right_pupil_absolute_position, length:int=50):
         """
@@ -56,32 +59,10 @@ class FirstFrameAnnotator:
         if frame.shape[:2] != mask.shape:
             raise ValueError("La dimensione della maschera non corrisponde a quella del frame")
         
-        # Crea una copia del frame per la fusione con la maschera
-        masked_frame = frame.copy()
-        
-        # Crea una nuova immagine per la maschera colorata
-        mask_colored = np.zeros_like(frame)  # Inizializza una maschera colorata vuota
-        
-        # Applica i colori per ciascuna classe (1, 2, 3)
-        # Classe 1: Rosso
-        mask_colored[mask == 1] = [0, 0, 255]  # Red
-        
-        # Classe 2: Blu
-        mask_colored[mask == 2] = [255, 0, 0]  # Blue
-        
-        # Classe 3: Verde
-        mask_colored[mask == 3] = [0, 255, 0]  # Green
-        
-        # Il background (classe 0) rimarrà trasparente, quindi non modifichiamo il frame per quelli
-        
-        # Applicazione della trasparenza per il background
-        frame_with_transparency = cv2.addWeighted(mask_colored, alpha_classes, frame, 1 - alpha_classes, 0)
-        
-        # Applicazione della trasparenza per il background (classe 0), che rimarrà completamente trasparente
-        masked_frame[mask == 0] = frame[mask == 0]
-        
-        # Combina il frame colorato con la trasparenza per le altre classi
-        masked_frame = cv2.addWeighted(frame_with_transparency, 1 - alpha_background, frame, alpha_background, 0)
+        # Colori delle classi (1: rosso, 2: blu, 3: verde) con una sola lookup sulla palette e fusione nel buffer preallocato
+        self.overlay_renderer.alpha = alpha_classes
+        self.overlay_renderer.background_alpha = alpha_background
+        masked_frame = self.overlay_renderer.render(frame, mask)
 
         # Mostra il risultato
         cv2.imshow(f"Segmented Frame {pos} eye", masked_frame)
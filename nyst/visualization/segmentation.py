@@ -0,0 +1,159 @@
+import os
+import cv2
+import numpy as np
+
+# BGR colors of the segmentation classes: background, pupil (red), eyes (blue), iris (green)
+SEGMENTATION_COLORS = [(0, 0, 0), (0, 0, 255), (255, 0, 0), (0, 255, 0)]
+
+
+def palette_lut(colors) -> np.ndarray:
+    '''
+    Builds the lookup table that maps every label value (0-255) to its color; the labels without a color are black.
+
+    Arguments:
+    - colors: The color of each class, in class order (a list of triplets or a dict {class_name: triplet}).
+
+    Returns:
+    - np.ndarray: The (256, 3) uint8 palette.
+    '''
+    colors = list(colors.values()) if isinstance(colors, dict) else list(colors)
+    lut = np.zeros((256, 3), dtype=np.uint8)
+    lut[:len(colors)] = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+    return lut
+
+def colorize_mask(mask, lut:np.ndarray, out:np.ndarray=None) -> np.ndarray:
+    '''
+    Colorizes a label mask with a single palette lookup.
+
+    Arguments:
+    - mask: The label mask (H, W) with values 0-255.
+    - lut (np.ndarray): The (256, 3) palette (see palette_lut).
+    - out (np.ndarray): Optional (H, W, 3) uint8 buffer where the colors are written.
+
+    Returns:
+    - np.ndarray: The (H, W, 3) colored mask.
+    '''
+    mask = np.asarray(mask)
+    if mask.dtype != np.uint8:
+        mask = mask.astype(np.uint8)
+    return np.take(lut, mask, axis=0, out=out)
+
+
+class OverlayRenderer:
+    '''
+    Blends colorized label masks onto frames. The colored mask and the blended frame are written into buffers that are
+    allocated once for each frame size, so rendering a video does not allocate memory at every frame.
+
+    Attributes:
+    - lut (np.ndarray): The (256, 3) palette of the classes.
+    - alpha (float): The opacity of the class colors.
+    - background_alpha (float): The weight of the original frame blended back on top of the overlay (0.0 = pure overlay).
+    '''
+    def __init__(self, colors=SEGMENTATION_COLORS, alpha:float=0.1, background_alpha:float=0.0):
+        '''
+        Initializes the renderer.
+
+        Arguments:
+        - colors: The BGR color of each class (see palette_lut). Default is SEGMENTATION_COLORS.
+        - alpha (float): The opacity of the class colors. Default is 0.1.
+        - background_alpha (float): The weight of the original frame blended on top of the overlay. Default is 0.0.
+        '''
+        self.lut = palette_lut(colors)
+        self.alpha = alpha
+        self.background_alpha = background_alpha
+        self._colored = None
+        self._blended = None
+        self._resized = None
+
+    def _buffers(self, shape):
+        # (Re)allocate the buffers only when the frame size changes
+        if self._blended is None or self._blended.shape != shape:
+            self._colored = np.empty(shape, dtype=np.uint8)
+            self._blended = np.empty(shape, dtype=np.uint8)
+            self._resized = np.empty(shape[:2], dtype=np.uint8)
+
+    def render(self, frame:np.ndarray, mask:np.ndarray) -> np.ndarray:
+        '''
+        Blends the colorized mask onto the frame. A mask smaller than the frame (e.g. at the input size of the
+        segmenter) is resized with nearest neighbour interpolation.
+
+        Arguments:
+        - frame (np.ndarray): The (H, W, 3) uint8 BGR frame.
+        - mask (np.ndarray): The label mask.
+
+        Returns:
+        - np.ndarray: The blended frame (a view of the internal buffer: copy it to keep it after the next call).
+        '''
+        self._buffers(frame.shape)
+
+        # Label mask at the frame size
+        if mask.shape[:2] != frame.shape[:2]:
+            mask = cv2.resize(np.asarray(mask, dtype=np.uint8), (frame.shape[1], frame.shape[0]), dst=self._resized, interpolation=cv2.INTER_NEAREST)
+
+        colorize_mask(mask, self.lut, out=self._colored)
+        cv2.addWeighted(self._colored, self.alpha, frame, 1 - self.alpha, 0, dst=self._blended)
+        if self.background_alpha > 0:
+            cv2.addWeighted(self._blended, 1 - self.background_alpha, frame, self.background_alpha, 0, dst=self._blended)
+        return self._blended
+
+
+# Lazy reader of the cached masks of a video
+def cached_masks(masks):
+    '''
+    Iterates over the cached label masks of a video: a (n_frames, H, W) .npy file (memory-mapped), a folder of PNG
+    masks (one per frame, in sorted order) or an array.
+
+    Arguments:
+    - masks: The .npy file, the folder or the array.
+
+    Returns:
+    - generator: The mask of each frame.
+    '''
+    if isinstance(masks, str) and os.path.isdir(masks):
+        for name in sorted(file for file in os.listdir(masks) if file.endswith('.png')):
+            yield cv2.imread(os.path.join(masks, name), cv2.IMREAD_GRAYSCALE)
+        return
+    if isinstance(masks, str):
+        masks = np.load(masks, mmap_mode='r')
+    for mask in masks:
+        yield mask
+
+def render_overlay_video(video_path:str, masks, output_path:str, colors=SEGMENTATION_COLORS, alpha:float=0.5, codec:str='mp4v') -> int:
+    '''
+    Renders offline the overlay video of a video and its cached segmentation masks, with the same renderer used during
+    the analysis. The rendering stops at the end of the shorter between the video and the masks.
+
+    Arguments:
+    - video_path (str): The input video.
+    - masks: The cached masks (see cached_masks).
+    - output_path (str): The output video.
+    - colors: The BGR color of each class. Default is SEGMENTATION_COLORS.
+    - alpha (float): The opacity of the class colors. Default is 0.5.
+    - codec (str): The FourCC of the output video. Default is 'mp4v'.
+
+    Returns:
+    - int: The number of rendered frames.
+    '''
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError(f"Unable to open the video {video_path}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30
+    size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*codec), fps, size)
+    renderer = OverlayRenderer(colors, alpha)
+
+    n_frames = 0
+    try:
+        for mask in cached_masks(masks):
+            ret, frame = capture.read()
+            if not ret:
+                break
+            writer.write(renderer.render(frame, mask))
+            n_frames += 1
+    finally:
+        capture.release()
+        writer.release()
+
+    return n_frames
@@ -0,0 +1,74 @@
+import pytest
+import torch
+import torch.nn as nn
+
+from nyst.training.fast_trainer import train_model_fast
+
+
+class Interrupted(Exception):
+    pass
+
+
+def make_model():
+    torch.manual_seed(0)
+    return nn.Sequential(nn.Flatten(), nn.Linear(8 * 20, 16), nn.ReLU(), nn.Linear(16, 1), nn.Sigmoid())
+
+
+def fold_data():
+    generator = torch.Generator().manual_seed(1)
+    inputs = torch.randn(40, 8, 20, generator=generator)
+    labels = (inputs[:, 0].mean(dim=1, keepdim=True) > 0).float()
+    return (inputs[:32], labels[:32]), (inputs[32:], labels[32:])
+
+
+def train(checkpoint_path=None, num_epochs=6, patience=30, log=None, checkpoint_every=2):
+    model = make_model()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.05)
+    train_data, val_data = fold_data()
+    torch.manual_seed(2) # Shuffling of the training batches
+    return train_model_fast(model, train_data, val_data, nn.BCELoss(), optimizer, torch.device('cpu'), num_epochs, patience,
+                            batch_size=8, log=log, checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every)
+
+
+# Log callback raising during the given epoch, as a process killed in the middle of the training
+def crash_at(epoch):
+    def log(metrics):
+        if metrics.get('epoch') == epoch:
+            raise Interrupted()
+    return log
+
+
+def assert_same_training(result, expected):
+    weights, train_stats, val_stats, best_acc, best_loss = result
+    expected_weights, expected_train_stats, expected_val_stats, expected_acc, expected_loss = expected
+    for stats, expected_stats in [(train_stats, expected_train_stats), (val_stats, expected_val_stats)]:
+        assert stats['loss'] == pytest.approx(expected_stats['loss'])
+        assert stats['accuracy'] == pytest.approx(expected_stats['accuracy'])
+    assert best_acc == pytest.approx(expected_acc)
+    assert best_loss == pytest.approx(expected_loss)
+    for name, value in expected_weights.items():
+        torch.testing.assert_close(weights[name], value)
+
+
+def test_resume_reproduces_uninterrupted_history(tmp_path):
+    expected = train()
+
+    checkpoint_path = str(tmp_path / 'fold.ckpt')
+    with pytest.raises(Interrupted):
+        train(checkpoint_path, log=crash_at(3)) # Last checkpoint after epoch 2
+
+    assert_same_training(train(checkpoint_path), expected)
+
+
+def test_final_checkpoint_after_early_stopping(tmp_path):
+    checkpoint_path = str(tmp_path / 'fold.ckpt')
+    # checkpoint_every larger than the training: only the final checkpoint is written
+    expected = train(checkpoint_path, num_epochs=50, patience=2, checkpoint_every=100)
+    epochs = len(expected[1]['loss'])
+    assert epochs < 50
+
+    # Resuming a stopped fold trains no more epochs and keeps the best weights
+    log_calls = []
+    resumed = train(checkpoint_path, num_epochs=50, patience=2, checkpoint_every=100, log=log_calls.append)
+    assert log_calls == []
+    assert_same_training(resumed, expected)
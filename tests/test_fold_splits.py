@@ -0,0 +1,37 @@
+import numpy as np
+
+from nyst.training.result_cache import ResultCache, fold_splits
+
+
+def as_lists(splits):
+    return [(train.tolist(), val.tolist()) for train, val in splits]
+
+
+def test_same_seed_same_folds():
+    assert as_lists(fold_splits(50, 5, fold_seed=7)) == as_lists(fold_splits(50, 5, fold_seed=7))
+
+
+def test_different_seeds_different_folds():
+    assert as_lists(fold_splits(50, 5, fold_seed=0)) != as_lists(fold_splits(50, 5, fold_seed=1))
+
+
+def test_folds_partition_the_samples():
+    splits = fold_splits(50, 5, fold_seed=3)
+    validation = np.concatenate([val for _, val in splits])
+    assert sorted(validation.tolist()) == list(range(50))
+    for train, val in splits:
+        assert len(val) == 10
+        assert not set(train.tolist()) & set(val.tolist())
+
+
+def test_no_seed_contiguous_folds():
+    splits = fold_splits(20, 4)
+    assert [val.tolist() for _, val in splits] == [list(range(start, start + 5)) for start in range(0, 20, 5)]
+
+
+def test_seed_is_part_of_the_cache_key(tmp_path):
+    cache = ResultCache(str(tmp_path), dataset='data', model='model')
+    params = {'lr': 0.001, 'head': 'gap'}
+    assert cache.key(params, 1, 5, 0) == cache.key(dict(params), 1, 5, 0)
+    assert cache.key(params, 1, 5, 0) != cache.key(params, 1, 5, 1)
+    assert cache.key(params, 1, 5, 0) != cache.key(params, 1, 5, None)
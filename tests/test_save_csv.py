@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+from nyst.dataset.binary_dataset import SIGNAL_COLUMNS, load_binary_dataset
+from nyst.dataset.utils_function import parse_signal_column, save_csv
+
+
+# Raw dataset with regular, space-separated, empty, ragged and malformed rows
+def raw_dataset():
+    rows = {
+        'video_a': '[1.0, 2.0, 3.0]',
+        'video_b': '[4. 5.  nan]',
+        'video_c': '[]',
+        'video_d': '[6.0]',
+        'video_e': '[7.0, oops]',
+    }
+    data = pd.DataFrame({'video': list(rows), 'resolution': [1080] * len(rows), 'label': [0, 1, 0, 1, 1]})
+    for column in SIGNAL_COLUMNS:
+        data[column] = list(rows.values())
+    return data
+
+
+def test_csv_round_trip(tmp_path):
+    csv_file = str(tmp_path / 'dataset.csv')
+    malformed = save_csv(raw_dataset(), csv_file)
+
+    # The malformed row is excluded from the dataset and reported in the side table
+    assert set(malformed['video']) == {'video_e'}
+    assert (tmp_path / 'dataset_malformed.csv').exists()
+
+    saved = pd.read_csv(csv_file)
+    assert saved['video'].tolist() == ['video_a', 'video_b', 'video_c', 'video_d']
+    assert saved['label'].tolist() == [0, 1, 0, 1]
+
+    # The saved signals parse back to the same values
+    for column in SIGNAL_COLUMNS:
+        values, lengths = parse_signal_column(saved[column])
+        assert lengths.tolist() == [3, 3, 0, 1]
+        np.testing.assert_array_equal(values, [1.0, 2.0, 3.0, 4.0, 5.0, np.nan, 6.0])
+
+
+def test_binary_round_trip(tmp_path):
+    npz_file = str(tmp_path / 'dataset.npz')
+    save_csv(raw_dataset(), npz_file)
+
+    dataset = load_binary_dataset(npz_file)
+    assert dataset['video'].tolist() == ['video_a', 'video_b', 'video_c', 'video_d']
+    assert dataset['signals'].shape == (4, len(SIGNAL_COLUMNS), 3)
+    assert dataset['lengths'].tolist() == [3, 3, 0, 1]
+
+    # Ragged rows are padded with nan after their last value
+    np.testing.assert_array_equal(dataset['signals'][0, 0], [1.0, 2.0, 3.0])
+    np.testing.assert_array_equal(dataset['signals'][3, 0], [6.0, np.nan, np.nan])
+    assert np.isnan(dataset['signals'][2]).all()
+
+
+def test_no_malformed_rows(tmp_path):
+    data = raw_dataset().iloc[:4]
+    malformed = save_csv(data, str(tmp_path / 'dataset.csv'))
+
+    assert len(malformed) == 0
+    assert not (tmp_path / 'dataset_malformed.csv').exists()
+
+
+def test_all_rows_malformed(tmp_path):
+    data = raw_dataset().iloc[4:]
+
+    # Only the header is written, with or without the label column
+    for frame in [data, data.drop(columns='label')]:
+        csv_file = str(tmp_path / 'dataset.csv')
+        malformed = save_csv(frame, csv_file)
+        assert set(malformed['video']) == {'video_e'}
+        saved = pd.read_csv(csv_file)
+        assert len(saved) == 0
+        assert list(saved.columns[:2]) == ['video', 'resolution']
+
+    npz_file = str(tmp_path / 'dataset.npz')
+    save_csv(data, npz_file)
+    assert load_binary_dataset(npz_file)['signals'].shape[0] == 0
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from nyst.visualization.segmentation import palette_lut, colorize_mask
+
+COLORMAP = {'background': [0, 0, 0], 'pupil': [1, 0, 0], 'eyes': [0, 1, 0], 'iris': [0, 0, 1]}
+
+
+# Per-class loop of the original decode_segmentation_masks
+def reference_decode(mask, colormap, n_classes):
+    colormap = (np.array(list(colormap.values())) * 100).astype(np.uint8)
+    rgb = np.zeros(mask.shape + (3,), dtype=np.uint8)
+    for label in range(n_classes):
+        rgb[mask == label] = colormap[label]
+    return rgb
+
+
+def random_mask(n_labels, shape=(64, 80), seed=0):
+    return np.random.default_rng(seed).integers(0, n_labels, size=shape)
+
+
+def test_decode_matches_per_class_loop():
+    utils = pytest.importorskip('nyst.seg_eyes.utils', reason='the segmentation utilities need TensorFlow')
+    mask = random_mask(len(COLORMAP))
+    np.testing.assert_array_equal(utils.decode_segmentation_masks(mask, COLORMAP, len(COLORMAP)), reference_decode(mask, COLORMAP, len(COLORMAP)))
+
+
+def test_decode_labels_outside_the_classes_are_black():
+    utils = pytest.importorskip('nyst.seg_eyes.utils', reason='the segmentation utilities need TensorFlow')
+    mask = random_mask(len(COLORMAP) + 2)
+    np.testing.assert_array_equal(utils.decode_segmentation_masks(mask, COLORMAP, 3), reference_decode(mask, COLORMAP, 3))
+
+
+def test_colorize_mask_matches_per_class_loop():
+    colors = {name: (np.array(color) * 100).tolist() for name, color in COLORMAP.items()}
+    mask = random_mask(len(colors) + 1).astype(np.uint8)
+    np.testing.assert_array_equal(colorize_mask(mask, palette_lut(colors)), reference_decode(mask, COLORMAP, len(COLORMAP)))
+
+
+def test_colorize_mask_into_buffer():
+    lut = palette_lut([[10, 20, 30], [40, 50, 60]])
+    mask = random_mask(2).astype(np.int64)
+    out = np.empty(mask.shape + (3,), dtype=np.uint8)
+
+    result = colorize_mask(mask, lut, out)
+    assert result is out
+    np.testing.assert_array_equal(out[mask == 1], np.tile([40, 50, 60], (int((mask == 1).sum()), 1)))
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from nyst.dataset.utils_function import parse_signal_column, replace_spaces_with_commas, clean_comma_issues, parse_float_list
+
+
+# Per-cell parsing of the original save_csv
+def reference_parse(cell):
+    return parse_float_list(clean_comma_issues(replace_spaces_with_commas(cell)))
+
+
+def split_cells(values, lengths):
+    return np.split(values, np.cumsum(lengths)[:-1]) if len(lengths) else []
+
+
+def test_matches_per_cell_parsing():
+    cells = ['[1.0, 2.5, nan]', '[1.0 2.0  3.0]', '[ -4e-3 5 ]', '[0.1,,0.2]']
+    values, lengths = parse_signal_column(cells)
+
+    assert lengths.tolist() == [3, 3, 2, 2]
+    for cell, parsed in zip(cells, split_cells(values, lengths)):
+        np.testing.assert_array_equal(parsed, np.array(reference_parse(cell), dtype=float))
+
+
+def test_numpy_printed_floats():
+    # NumPy prints '1.' for whole floats, which the per-cell JSON parsing rejected
+    values, lengths = parse_signal_column(['[1. 2.  3.]'])
+    assert lengths.tolist() == [3]
+    np.testing.assert_array_equal(values, [1.0, 2.0, 3.0])
+
+
+def test_empty_and_ragged_cells():
+    cells = ['[]', '[1.0]', '[ ]', '[2.0, 3.0, 4.0, 5.0]', '[nan, 6.0]']
+    values, lengths = parse_signal_column(cells)
+
+    assert lengths.tolist() == [0, 1, 0, 4, 2]
+    parsed = split_cells(values, lengths)
+    assert [cell.size for cell in parsed] == [0, 1, 0, 4, 2]
+    np.testing.assert_array_equal(parsed[3], [2.0, 3.0, 4.0, 5.0])
+    assert np.isnan(parsed[4][0]) and parsed[4][1] == 6.0
+
+
+def test_only_empty_cells():
+    values, lengths = parse_signal_column(['[]', '[]'])
+    assert values.size == 0
+    assert lengths.tolist() == [0, 0]
+
+
+def test_mixed_cell_types():
+    cells = ['[1.0, 2.0]', np.array([3.0, 4.0, 5.0]), [6.0], None, float('nan'), 'None']
+    values, lengths = parse_signal_column(cells)
+
+    assert lengths.tolist() == [2, 3, 1, 0, 0, 1]
+    np.testing.assert_array_equal(values[:6], [1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+    assert np.isnan(values[6])
+
+
+def test_numpy_scalar_wrappers():
+    values, lengths = parse_signal_column(['[np.float64(1.5), np.float64(nan)]'])
+    assert lengths.tolist() == [2]
+    assert values[0] == 1.5 and np.isnan(values[1])
+
+
+def test_non_numeric_token_raises():
+    with pytest.raises(ValueError):
+        parse_signal_column(['[1.0, 2.0]', '[1.0, abc]'])
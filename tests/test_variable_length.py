@@ -0,0 +1,65 @@
+import pytest
+import torch
+
+from nyst.classifier.classifier import NystClassifier
+from nyst.classifier.tunedCNN_time import VARIABLE_LENGTH_HEADS
+
+CLIP_LENGTHS = [300, 213, 157, 41]
+
+
+# Clips of different lengths, zero-padded to the same number of frames
+def padded_batch(n_frames=300, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    clips = [torch.randn(8, length, generator=generator) for length in CLIP_LENGTHS]
+    batch = torch.zeros(len(clips), 8, n_frames)
+    for i, clip in enumerate(clips):
+        batch[i, :, :clip.shape[1]] = clip
+    return clips, batch, torch.tensor(CLIP_LENGTHS)
+
+
+@pytest.fixture(params=VARIABLE_LENGTH_HEADS)
+def model(request):
+    torch.manual_seed(0)
+    return NystClassifier(head=request.param)
+
+
+def test_padded_batch_matches_single_clips(model):
+    model.eval()
+    clips, batch, lengths = padded_batch()
+    with torch.no_grad():
+        features = model.tunedCNN(batch, lengths)
+        single = torch.cat([model.tunedCNN(clip[None], torch.tensor([clip.shape[1]])) for clip in clips])
+    torch.testing.assert_close(features, single, atol=1e-5, rtol=1e-4)
+
+
+def test_full_length_clips_match_unmasked_path(model):
+    model.eval()
+    _, batch, _ = padded_batch()
+    with torch.no_grad():
+        torch.testing.assert_close(model.tunedCNN(batch[:1], torch.tensor([300])), model.tunedCNN(batch[:1]), atol=1e-5, rtol=1e-4)
+
+
+def test_training_mode_independent_of_padding(model):
+    model.train()
+    _, batch, lengths = padded_batch()
+    longer = torch.zeros(batch.shape[0], 8, 420)
+    longer[:, :, :300] = batch
+
+    state = {name: value.clone() for name, value in model.state_dict().items()}
+    features = model.tunedCNN(batch, lengths)
+    running = {name: value.clone() for name, value in model.state_dict().items()}
+
+    model.load_state_dict(state)
+    features_longer = model.tunedCNN(longer, lengths)
+
+    # Same features and same running statistics of the batch normalization layers
+    torch.testing.assert_close(features, features_longer, atol=1e-5, rtol=1e-4)
+    for name, value in model.state_dict().items():
+        torch.testing.assert_close(value, running[name], atol=1e-5, rtol=1e-4)
+
+
+@pytest.mark.parametrize('head', ['flatten', 'strided'])
+def test_fixed_length_heads_reject_lengths(head):
+    model = NystClassifier(head=head).eval()
+    with pytest.raises(ValueError):
+        model(torch.zeros(1, 8, 300), torch.tensor([300]))